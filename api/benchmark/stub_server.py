@@ -0,0 +1,201 @@
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from typing import Optional
+from urllib.parse import parse_qs, urlsplit
+
+from PIL import Image, ImageDraw
+
+from api.client.http_client import PooledHTTPAdapter
+
+IMAGE_HOST = 'images.benchmark.test'
+IMAGE_SIZES = (64, 128, 256, 512, 1024)
+IMAGE_FORMATS = ('PNG', 'JPEG', 'WEBP', 'GIF')
+IMAGE_EXTENSIONS = {'PNG': 'png', 'JPEG': 'jpg', 'WEBP': 'webp', 'GIF': 'gif'}
+CONTENT_TYPES = {'png': 'image/png', 'jpg': 'image/jpeg', 'webp': 'image/webp', 'gif': 'image/gif'}
+
+
+def slugify(text: str) -> str:
+    return re.sub(r'[^a-z0-9]+', '-', text.lower()).strip('-')
+
+
+def program_slug(query: str) -> str:
+    """
+    Returns the slug of the program a SERP query is about, without its site: and inurl: filters.
+    """
+    words = [word for word in query.split() if not word.startswith(('site:', 'inurl:'))]
+    return slugify(' '.join(words).replace('"', ''))
+
+
+def site_page_url(site: str, slug: str) -> str:
+    """
+    Returns a download page URL on the given site that matches its pattern in SITES.
+    """
+    if site == 'computerbase.de':
+        return f'https://www.computerbase.de/downloads/{slug}/'
+    if site == 'uptodown.com':
+        return f'https://{slug}.uptodown.com/windows'
+    return f'https://{slug}.{site}/'
+
+
+def image_url(slug: str, seed: int) -> str:
+    """
+    Returns the og:image URL of a program, with a size and format picked deterministically from its slug.
+    """
+    rng = random.Random(f'{seed}:{slug}')
+    image_format = rng.choice(IMAGE_FORMATS)
+    return f'https://{IMAGE_HOST}/{slug}-{rng.choice(IMAGE_SIZES)}.{IMAGE_EXTENSIONS[image_format]}'
+
+
+def render_image(name: str, seed: int, noisy_share: float) -> bytes:
+    """
+    Renders the image of an image URL path like 'my-app-256.png': shapes on a light background, which is
+    solid, and cut out by colour key, or for a share of the images noisy, which needs rembg.
+    """
+    stem, extension = name.rsplit('.', 1)
+    size = int(stem.rsplit('-', 1)[1])
+    rng = random.Random(f'{seed}:{stem}')
+
+    if rng.random() < noisy_share:
+        # Grain of about +-12 around a light grey, too coarse for the colour key but not for rembg
+        noise = Image.effect_noise((size, size), 12).point(lambda value: min(255, value + 116))
+        image = Image.merge('RGB', (noise, noise, noise))
+    else:
+        image = Image.new('RGB', (size, size), (246, 246, 246))
+    # Motives differ in shape, not only in colour, so the perceptual dedup doesn't take them for one another
+    draw = ImageDraw.Draw(image)
+    for _ in range(rng.randint(2, 5)):
+        left, top = rng.uniform(0.05, 0.6) * size, rng.uniform(0.05, 0.6) * size
+        box = (left, top, left + rng.uniform(0.2, 0.4) * size, top + rng.uniform(0.2, 0.4) * size)
+        color = tuple(rng.randrange(0, 200) for _ in range(3))
+        if rng.random() < 0.5:
+            draw.ellipse(box, fill=color)
+        else:
+            draw.rectangle(box, fill=color)
+
+    output = BytesIO()
+    if extension == 'gif':
+        image.convert('P', palette=Image.Palette.ADAPTIVE).save(output, format='GIF')
+    else:
+        image.save(output, format={'png': 'PNG', 'jpg': 'JPEG', 'webp': 'WEBP'}[extension])
+    return output.getvalue()
+
+
+class StubServer:
+    """
+    A local HTTP server standing in for SpaceSERP, the scraped download sites and the image hosts.
+
+    Requests are expected as /<original host><original path>, see `StubAdapter`. Every response is delayed by
+    `latency` seconds, +-50%, and fails with a 503 at `error_rate`. Pages and images carry ETags and answer
+    conditional requests with a 304.
+    """
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, noisy_share: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.noisy_share = noisy_share
+        self.seed = seed
+        self._images = {}
+        self._images_lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> 'StubServer':
+        self._thread = threading.Thread(target=self._server.serve_forever, name='stub-server', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def image(self, name: str) -> bytes:
+        with self._images_lock:
+            if name not in self._images:
+                self._images[name] = render_image(name, self.seed, self.noisy_share)
+            return self._images[name]
+
+    def respond(self, host: str, path: str, query: dict) -> tuple[int, str, bytes]:
+        """
+        Returns the status, content type and body for a request to the original host and path.
+        """
+        if host == 'api.spaceserp.com':
+            search_query = query.get('q', [''])[0]
+            site = next((word[len('site:'):] for word in search_query.split() if word.startswith('site:')), '')
+            links = [{'link': site_page_url(site, program_slug(search_query)), 'position': 1}] if site else []
+            return 200, 'application/json', json.dumps({'organic_results': links}).encode()
+
+        if host == IMAGE_HOST:
+            name = path.strip('/')
+            return 200, CONTENT_TYPES[name.rsplit('.', 1)[1]], self.image(name)
+
+        slug = host.split('.')[0] if host.count('.') > 1 and not host.startswith('www.') \
+            else path.strip('/').split('/')[-1]
+        page = (f'<!DOCTYPE html><html><head><title>{slug}</title>'
+                f'<meta property="og:image" content="{image_url(slug, self.seed)}">'
+                f'</head><body><h1>{slug}</h1>{"<p>Download</p>" * 200}</body></html>')
+        return 200, 'text/html; charset=utf-8', page.encode()
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                if stub.latency:
+                    time.sleep(stub.latency * random.uniform(0.5, 1.5))
+                if random.random() < stub.error_rate:
+                    self.send_body(503, 'text/plain', b'Service Unavailable')
+                    return
+
+                parts = urlsplit(self.path)
+                host, _, path = parts.path.lstrip('/').partition('/')
+                status, content_type, body = stub.respond(host, '/' + path, parse_qs(parts.query))
+                etag = '"%s"' % hashlib.sha1(body).hexdigest()
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_body(304, content_type, b'', etag)
+                else:
+                    self.send_body(status, content_type, body, etag)
+
+            def send_body(self, status: int, content_type: str, body: bytes, etag: Optional[str] = None):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                if etag:
+                    self.send_header('ETag', etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+class StubAdapter(PooledHTTPAdapter):
+    """
+    Sends every request to the stub server instead, as /<original host><original path>. Mounted on the shared
+    session, see `get_session`, it keeps the whole pipeline, including pooling, off the internet.
+    """
+
+    def __init__(self, base_url: str, **kwargs):
+        super().__init__(**kwargs)
+        self.base_url = base_url
+
+    def send(self, request, **kwargs):
+        parts = urlsplit(request.url)
+        request.url = f"{self.base_url}/{parts.hostname}{parts.path or '/'}" + (f"?{parts.query}" if parts.query
+                                                                                  else '')
+        return super().send(request, **kwargs)
@@ -0,0 +1,94 @@
+import logging
+import time
+from typing import Optional
+
+from django.conf import settings
+
+from api.client.host_state import HostState, host_key
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+def _state(breaker: dict, now: float) -> str:
+    if breaker.get('open_until', 0) > now:
+        return OPEN
+    if breaker.get('open_until'):
+        return HALF_OPEN
+    return CLOSED
+
+
+def breaker_state(host: str) -> str:
+    """
+    Returns the state of the circuit breaker of a host, see `host_key`: CLOSED, OPEN, or HALF_OPEN once the
+    cooldown of an open breaker is over.
+    """
+    if settings.HTTP_BREAKER_FAILURES <= 0:
+        return CLOSED
+    with HostState('breaker', host) as breaker:
+        return _state(breaker, time.time())
+
+
+def breaker_open(host: str) -> bool:
+    """
+    Checks whether requests to the host are currently refused, so callers can move on to another source.
+    """
+    return breaker_state(host) == OPEN
+
+
+def allow_request(url: str) -> bool:
+    """
+    Checks whether a request to the host of the URL may be sent. A closed breaker allows every request, an open
+    one none. A half-open breaker allows a single probe request at a time across all processes, whose outcome,
+    see `record_success` and `record_failure`, closes or opens the breaker again.
+    """
+    if settings.HTTP_BREAKER_FAILURES <= 0:
+        return True
+    with HostState('breaker', host_key(url)) as breaker:
+        now = time.time()
+        state = _state(breaker, now)
+        if state == HALF_OPEN:
+            if breaker.get('probe_until', 0) > now:
+                return False
+            # A probe that never reports back, e.g. of a killed worker, only blocks the host until its timeout
+            breaker['probe_until'] = now + settings.HTTP_CONNECT_TIMEOUT + settings.HTTP_READ_TIMEOUT
+        return state != OPEN
+
+
+def record_success(url: str) -> None:
+    """
+    Records that the host of the URL responded, which closes its breaker.
+    """
+    if settings.HTTP_BREAKER_FAILURES <= 0:
+        return
+    with HostState('breaker', host_key(url)) as breaker:
+        if breaker.get('open_until'):
+            logger.warning(f"Closing the circuit breaker of {host_key(url)}")
+        breaker.clear()
+
+
+def record_failure(url: str, retry_after: Optional[float] = None) -> None:
+    """
+    Records a failed request to the host of the URL: a connection error, a timeout or a retryable status.
+    After HTTP_BREAKER_FAILURES consecutive failures, or a failed probe, the breaker opens for
+    HTTP_BREAKER_COOLDOWN seconds. A Retry-After, e.g. of a 429 for an exhausted quota, opens it right away
+    for as long as the host asked for.
+    """
+    if settings.HTTP_BREAKER_FAILURES <= 0:
+        return
+    host = host_key(url)
+    with HostState('breaker', host) as breaker:
+        now = time.time()
+        breaker['failures'] = breaker.get('failures', 0) + 1
+        state = _state(breaker, now)
+        # Failures of requests sent before the breaker opened do not extend the cooldown
+        if state != OPEN and (retry_after or state == HALF_OPEN
+                              or breaker['failures'] >= settings.HTTP_BREAKER_FAILURES):
+            cooldown = retry_after or settings.HTTP_BREAKER_COOLDOWN
+            breaker['open_until'] = now + cooldown
+            breaker['probe_until'] = 0
+            logger.warning(f"Opening the circuit breaker of {host} for {cooldown:.0f}s after "
+                           f"{breaker['failures']} failures")
@@ -0,0 +1,34 @@
+import time
+from typing import Optional
+
+
+class Deadline:
+    """
+    A total time budget for one request, passed down through every stage that may block.
+    """
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        """
+        Returns the number of seconds left before the deadline, never less than zero.
+        """
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def cap(self, seconds: float) -> float:
+        """
+        Returns `seconds` limited to the time left before the deadline.
+        """
+        return min(seconds, self.remaining())
+
+
+def remaining_or(deadline: Optional[Deadline], seconds: float) -> float:
+    """
+    Returns `seconds` limited by the deadline, or `seconds` unchanged when there is no deadline.
+    """
+    return deadline.cap(seconds) if deadline else seconds
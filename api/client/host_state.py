@@ -0,0 +1,58 @@
+import json
+import os
+from urllib.parse import urlsplit
+
+from django.conf import settings
+
+from api.utils.file_lock import FileLock, lock_path
+
+
+def host_key(url: str) -> str:
+    """
+    Returns the host a URL is limited and tracked as. Subdomains of the sites in HTTP_HOST_GROUPS, e.g. the
+    per-app subdomains of uptodown.com, count as that site.
+    """
+    host = (urlsplit(url).hostname or '').lower()
+    for site in settings.HTTP_HOST_GROUPS:
+        if host == site or host.endswith('.' + site):
+            return site
+    return host
+
+
+class HostState:
+    """
+    A small JSON document about one host, e.g. its token bucket, shared by all threads and worker processes
+    of the machine. It is read on entering the context and written back, if changed, on leaving it, under a
+    file lock:
+
+        with HostState('breaker', host) as state:
+            state['failures'] = state.get('failures', 0) + 1
+    """
+
+    def __init__(self, kind: str, host: str):
+        name = f"{kind}:{host}"
+        self.lock = FileLock(lock_path(name))
+        self.path = lock_path(name, '.json')
+        self.state = {}
+        self._read_state = {}
+
+    def __enter__(self) -> dict:
+        self.lock.acquire()
+        try:
+            with open(self.path, encoding='utf-8') as state_file:
+                self.state = json.load(state_file)
+        except (OSError, ValueError):
+            # Not written yet, or cut off by a crash, which just resets the host
+            self.state = {}
+        self._read_state = dict(self.state)
+        return self.state
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None and self.state != self._read_state:
+                temporary_path = self.path + '.tmp'
+                with open(temporary_path, 'w', encoding='utf-8') as state_file:
+                    json.dump(self.state, state_file)
+                os.replace(temporary_path, self.path)
+        finally:
+            self.lock.release()
@@ -1,40 +1,220 @@
+import os
+import random
+import threading
+from collections import defaultdict
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
 import requests
 import time
 import logging
-from typing import Any, Optional, Dict, Union
+from typing import Any, Optional, Dict, Tuple, Union
+
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from api.client.deadline import Deadline
+from api.client.circuit_breaker import allow_request, record_failure, record_success
+from api.client.rate_limiter import get_rate_limiter
 
 logger = logging.getLogger(__name__)
 
+RETRYABLE_STATUS_CODES = frozenset({408, 425, 429, 500, 502, 503, 504})
+RETRYABLE_EXCEPTIONS = (requests.ConnectionError, requests.Timeout)
+
+_pool_stats = defaultdict(lambda: {'hits': 0, 'misses': 0})
+_pool_stats_lock = threading.Lock()
+_checkout = threading.local()
+
+
+def _count_checkout(host: str, new_connection: bool) -> None:
+    with _pool_stats_lock:
+        _pool_stats[host]['misses' if new_connection else 'hits'] += 1
+
+
+class _CountingPoolMixin:
+    """
+    Counts connection checkouts per host. A checkout that has to open a new connection is a pool miss,
+    one that reuses a kept-alive connection is a pool hit.
+    """
+
+    def _get_conn(self, timeout=None):
+        _checkout.opened_connection = False
+        conn = super()._get_conn(timeout=timeout)
+        _count_checkout(self.host, _checkout.opened_connection)
+        return conn
+
+    def _new_conn(self):
+        _checkout.opened_connection = True
+        return super()._new_conn()
+
+
+class CountingHTTPConnectionPool(_CountingPoolMixin, HTTPConnectionPool):
+    pass
+
+
+class CountingHTTPSConnectionPool(_CountingPoolMixin, HTTPSConnectionPool):
+    pass
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter keeping one keep-alive connection pool per host, with pool hit/miss counting.
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': CountingHTTPConnectionPool,
+            'https': CountingHTTPSConnectionPool,
+        }
+
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """
+    Returns the process-wide session shared by all HTTPClient instances.
+
+    The session is created lazily and recreated after a fork, so every gunicorn worker owns its pools.
+    """
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _session_lock:
+            if _session is None or _session_pid != pid:
+                adapter = PooledHTTPAdapter(
+                    pool_connections=settings.HTTP_POOL_CONNECTIONS,
+                    pool_maxsize=settings.HTTP_POOL_MAXSIZE,
+                    pool_block=settings.HTTP_POOL_BLOCK,
+                )
+                session = requests.Session()
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                session.headers['Connection'] = 'keep-alive'
+                with _pool_stats_lock:
+                    _pool_stats.clear()
+                _session = session
+                _session_pid = pid
+    return _session
+
+
+def pool_stats() -> Dict[str, Dict[str, int]]:
+    """
+    Returns the connection pool hit and miss counters of this process, per host.
+    """
+    with _pool_stats_lock:
+        return {host: dict(counts) for host, counts in _pool_stats.items()}
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parses a Retry-After header given either in seconds or as an HTTP date.
+
+    Returns:
+        Optional[float]: The number of seconds to wait, or None if the header is missing or invalid.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def conditional_headers(etag: str = '', last_modified: str = '') -> Dict[str, str]:
+    """
+    Builds the headers of a conditional GET from the validators of a previous response.
+    """
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    return headers
+
+
+def response_validators(response) -> Dict[str, str]:
+    """
+    Returns the 'etag' and 'last_modified' validators of a response, empty if the server sent none.
+    """
+    return {
+        'etag': response.headers.get('ETag', '')[:255],
+        'last_modified': response.headers.get('Last-Modified', '')[:64],
+    }
+
 
 class HTTPClient:
-    def __init__(self, url: str, api_key: Optional[str] = None, retry_count: int = 2, backoff_factor: float = 1.0):
+    def __init__(self, url: str, api_key: Optional[str] = None, retry_count: int = 2, backoff_factor: float = 1.0,
+                 timeout: Optional[Tuple[float, float]] = None):
         """
         Initializes the HTTP client with a base URL, optional API key for authentication, retry count, and backoff factor for retries.
+        Requests go through the process-wide pooled session, see `get_session`.
 
         Args:
             url (str): The base URL for the API.
             api_key (Optional[str]): The API key for authentication.
             retry_count (int): The number of times to retry the request upon failure.
-            backoff_factor (float): The factor by which to increase the delay between retries.
+            backoff_factor (float): The base delay in seconds of the exponential backoff between retries.
+            timeout (Optional[Tuple[float, float]]): The (connect, read) timeout in seconds.
+                Defaults to HTTP_CONNECT_TIMEOUT and HTTP_READ_TIMEOUT.
         """
         self.url = url
         self.api_key = api_key
         self.retry_count = retry_count
         self.backoff_factor = backoff_factor
+        self.timeout = timeout or (settings.HTTP_CONNECT_TIMEOUT, settings.HTTP_READ_TIMEOUT)
+
+    def _timeout(self, deadline: Optional[Deadline]) -> Tuple[float, float]:
+        if deadline is None:
+            return self.timeout
+        connect_timeout, read_timeout = self.timeout
+        return deadline.cap(connect_timeout), deadline.cap(read_timeout)
+
+    def _backoff(self, attempt: int, retry_after: Optional[float]) -> float:
+        """
+        Exponential backoff with full jitter; a Retry-After hint from the server takes precedence.
+        """
+        delay = random.uniform(0, min(settings.HTTP_MAX_BACKOFF, self.backoff_factor * 2 ** (attempt - 1)))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
 
     def request(self, method: str, params: Optional[Dict[str, Any]] = None,
-                data: Optional[Union[Dict[str, Any], str]] = None, headers: Optional[Dict[str, Any]] = None) -> Any:
+                data: Optional[Union[Dict[str, Any], str]] = None, headers: Optional[Dict[str, Any]] = None,
+                deadline: Optional[Deadline] = None, stream: bool = False,
+                accepted_status_codes: Tuple[int, ...] = (200,)) -> Any:
         """
         Makes an HTTP request and optionally returns the raw response object.
 
+        Only connection errors, timeouts and the status codes in RETRYABLE_STATUS_CODES are retried.
+        No attempt is started and no backoff is slept past the deadline.
+        Every attempt waits for the per-host rate limit, see `get_rate_limiter`, and no attempt is made while
+        the host's circuit breaker is open, see `allow_request`.
+
         Args:
             method (str): The HTTP method to use.
             params (Optional[Dict[str, Any]]): Query parameters for the request.
             data (Optional[Union[Dict[str, Any], str]]): Data to send in the request body.
             headers (Optional[Dict[str, Any]]): HTTP headers to send with the request.
+            deadline (Optional[Deadline]): The total time budget of the calling request.
+            stream (bool): Whether to defer reading the response body; the caller must close the response.
+            accepted_status_codes (Tuple[int, ...]): The status codes returned as a response, e.g. 304 for
+                conditional requests.
 
         Returns:
-            Any: The response data or the raw Response object if return_raw is True.
+            Any: The response data or the raw Response object if return_raw is True. On failure a dict with the
+            'error' and the 'status_code' of the last response, None if there was none.
         """
         default_headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'
@@ -47,18 +227,55 @@ class HTTPClient:
             headers = default_headers
 
         attempts = 0
+        status_code = None
         while attempts < self.retry_count:
+            if deadline and deadline.expired():
+                logger.error(f"Deadline of {deadline.seconds}s exceeded before fetching {self.url}")
+                break
+            if not allow_request(self.url):
+                logger.error(f"Not fetching {self.url}, the circuit breaker of its host is open")
+                break
+            if not get_rate_limiter().acquire(self.url, deadline):
+                logger.error(f"Not fetching {self.url}, waiting for the host's rate limit would exceed the deadline")
+                break
+
+            retry_after = None
+            timeout = self._timeout(deadline)
             try:
-                response = requests.request(method, self.url, params=params, data=data, headers=headers)
-                if response.status_code == 200:
+                response = get_session().request(method, self.url, params=params, data=data, headers=headers,
+                                                 timeout=timeout, stream=stream)
+                if response.status_code in accepted_status_codes:
+                    record_success(self.url)
                     return response
                 else:
+                    status_code = response.status_code
+                    response.close()
                     logger.error(response)
-                    logger.error(f"Expected status code 200 but got {response.status_code} for {self.url}")
+                    logger.error(f"Expected status code {accepted_status_codes} but got {response.status_code} "
+                                 f"for {self.url}")
+                    if response.status_code not in RETRYABLE_STATUS_CODES:
+                        # The host is up, the request just has no usable answer
+                        record_success(self.url)
+                        break
+                    retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                    record_failure(self.url, retry_after)
+            except RETRYABLE_EXCEPTIONS as e:
+                logger.error(f"Error occurred while fetching or processing {self.url}", exc_info=e)
+                # A timeout cut short by the caller's deadline says nothing about the health of the host
+                if not (isinstance(e, requests.Timeout) and timeout != self.timeout):
+                    record_failure(self.url)
             except Exception as e:
                 logger.error(f"Error occurred while fetching or processing {self.url}", exc_info=e)
+                break
 
-            time.sleep(self.backoff_factor * 20)
             attempts += 1
+            if attempts >= self.retry_count:
+                break
+
+            delay = self._backoff(attempts, retry_after)
+            if deadline and delay >= deadline.remaining():
+                logger.error(f"Not retrying {self.url}, a {delay:.1f}s backoff would exceed the deadline")
+                break
+            time.sleep(delay)
 
-        return {"error": "Failed to fetch the response after retries"}
+        return {"error": "Failed to fetch the response after retries", "status_code": status_code}
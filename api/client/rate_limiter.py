@@ -0,0 +1,113 @@
+import threading
+import time
+from typing import Dict, Optional
+
+from django.conf import settings
+
+from api.client.deadline import Deadline
+from api.client.host_state import HostState, host_key
+
+
+class TokenBucket:
+    """
+    Allows `rate` requests per second on average to a host, and bursts of up to `burst` requests.
+    The bucket is kept in a HostState, so all worker processes of the machine draw from the same tokens.
+    """
+
+    def __init__(self, host: str, rate: float, burst: int):
+        self.host = host
+        self.rate = rate
+        self.burst = max(1, burst)
+
+    def reserve(self, max_wait: Optional[float] = None) -> Optional[float]:
+        """
+        Takes a token, possibly one that is only available in the future.
+
+        Returns:
+            Optional[float]: The seconds to wait before the request may start, or None without taking a token
+            if that is longer than `max_wait`.
+        """
+        with HostState('rate', self.host) as state:
+            now = time.time()
+            elapsed = max(0.0, now - state.get('updated', now))
+            tokens = min(self.burst, state.get('tokens', self.burst) + elapsed * self.rate)
+            wait = max(0.0, (1 - tokens) / self.rate)
+            if max_wait is not None and wait > max_wait:
+                state.update(tokens=tokens, updated=now)
+                return None
+            state.update(tokens=tokens - 1, updated=now)
+            return wait
+
+
+class RateLimiter:
+    """
+    Limits the requests per host, see `host_key`, with one token bucket per host shared across processes.
+
+    Args:
+        rate (float): Requests per second allowed per host, 0 for no limit.
+        burst (int): Requests a host may get at once after being idle.
+        host_rates (Optional[Dict[str, float]]): Rates of specific hosts, overriding `rate`.
+    """
+
+    def __init__(self, rate: float, burst: int = 1, host_rates: Optional[Dict[str, float]] = None):
+        self.rate = rate
+        self.burst = burst
+        self.host_rates = host_rates or {}
+
+    def acquire(self, url: str, deadline: Optional[Deadline] = None) -> bool:
+        """
+        Waits until a request to the host of the URL is allowed.
+
+        Returns:
+            bool: False, without waiting, if that would take past the deadline.
+        """
+        host = host_key(url)
+        rate = self.host_rates.get(host, self.rate)
+        if rate <= 0:
+            return True
+        wait = TokenBucket(host, rate, self.burst).reserve(deadline.remaining() if deadline else None)
+        if wait is None:
+            return False
+        if wait:
+            time.sleep(wait)
+        return True
+
+
+def parse_host_rates(values) -> Dict[str, float]:
+    """
+    Parses 'host=rate' pairs, e.g. from HTTP_HOST_RATES, into a dict.
+    """
+    host_rates = {}
+    for value in values:
+        host, separator, rate = value.partition('=')
+        if not separator:
+            raise ValueError(f"Expected 'host=rate' but got '{value}'")
+        host_rates[host.strip().lower()] = float(rate)
+    return host_rates
+
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """
+    Returns the rate limiter of this process, configured from HTTP_HOST_RATE, HTTP_HOST_BURST and HTTP_HOST_RATES
+    unless replaced with `set_rate_limiter`.
+    """
+    global _rate_limiter
+    if _rate_limiter is None:
+        with _rate_limiter_lock:
+            if _rate_limiter is None:
+                _rate_limiter = RateLimiter(settings.HTTP_HOST_RATE, settings.HTTP_HOST_BURST,
+                                            parse_host_rates(settings.HTTP_HOST_RATES))
+    return _rate_limiter
+
+
+def set_rate_limiter(rate_limiter: RateLimiter) -> None:
+    """
+    Replaces the rate limiter of this process, e.g. with the limits given to a management command.
+    """
+    global _rate_limiter
+    with _rate_limiter_lock:
+        _rate_limiter = rate_limiter
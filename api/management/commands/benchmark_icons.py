@@ -0,0 +1,272 @@
+import hashlib
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from decouple import config
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from api.benchmark.stub_server import StubAdapter, StubServer, image_url, slugify
+from api.client.http_client import get_session
+from api.models.processed_icon import ProcessedIcon
+from api.models.program import Program
+from api.utils.webdriver_pool import get_webdriver_pool
+
+SCENARIOS = ('download_icon:cold', 'download_icon:warm', 'download_icon:stale',
+             'remove_bg_img:cold', 'remove_bg_img:warm')
+
+# Compared between runs, with whether an increase is a regression
+COMPARED_STATS = (('p50_ms', True), ('p95_ms', True), ('p99_ms', True), ('throughput', False))
+
+
+def percentile(latencies: list, percent: int) -> float:
+    if len(latencies) < 2:
+        return latencies[0] if latencies else 0.0
+    return statistics.quantiles(latencies, n=100, method='inclusive')[percent - 1]
+
+
+def parse_server_timing(value: str) -> dict:
+    """
+    Parses a Server-Timing header into milliseconds per stage.
+    """
+    stages = {}
+    for entry in value.split(','):
+        name, _, duration = entry.strip().partition(';dur=')
+        if name and duration:
+            stages[name] = float(duration)
+    return stages
+
+
+def summarize(samples: list, elapsed: float) -> dict:
+    """
+    Returns the throughput, latency percentiles in milliseconds, error counts, the most common icon errors and
+    mean stage durations of the requests of a scenario.
+    """
+    latencies = [sample['latency'] for sample in samples]
+    errors = Counter(sample['error'] for sample in samples if sample['error'])
+    stage_totals = {}
+    for sample in samples:
+        for name, duration in sample['stages'].items():
+            stage_totals[name] = stage_totals.get(name, 0.0) + duration
+    return {
+        'requests': len(samples),
+        'http_errors': sum(1 for sample in samples if sample['status'] >= 400),
+        'icon_errors': sum(1 for sample in samples if sample['error']),
+        'throughput': len(samples) / elapsed if elapsed else 0.0,
+        'mean_ms': statistics.mean(latencies) if latencies else 0.0,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'max_ms': max(latencies, default=0.0),
+        'stages_ms': {name: total / len(samples) for name, total in sorted(stage_totals.items())},
+        'top_errors': dict(errors.most_common(5)),
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True,
+                              text=True, timeout=5).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ''
+
+
+class Command(BaseCommand):
+    help = ("Measures throughput and latency of download_icon and remove_bg_img under concurrent load, for cold, "
+            "warm and stale icon stores, against local stand-ins for SpaceSERP, the download sites and the image "
+            "hosts. Runs on a test database and never reaches the internet.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--programs', type=int, default=50, help="Programs, and so requests, per scenario.")
+        parser.add_argument('--concurrency', type=int, default=8, help="Concurrent requests.")
+        parser.add_argument('--latency', type=float, default=20.0,
+                            help="Milliseconds the stub servers take per response, +-50%%.")
+        parser.add_argument('--error-rate', type=float, default=0.0,
+                            help="Share of stub responses failing with a 503.")
+        parser.add_argument('--noisy-share', type=float, default=0.2,
+                            help="Share of images with a noisy background, which needs rembg instead of a colour key.")
+        parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                            help="Comma separated scenarios to run, in order, from: " + ', '.join(SCENARIOS))
+        parser.add_argument('--seed', type=int, default=0, help="Seed of the generated pages and images.")
+        parser.add_argument('--selenium', action='store_true',
+                            help="Keep the Selenium fallback enabled. It reaches out to the real sites.")
+        parser.add_argument('--output', help="JSON file to save the results to, by default benchmark_<time>.json.")
+        parser.add_argument('--compare', help="JSON file of an earlier run to compare the results with.")
+        parser.add_argument('--threshold', type=float, default=10.0,
+                            help="Percent a latency may grow, or the throughput drop, before it is a regression.")
+        parser.add_argument('--fail-on-regression', action='store_true',
+                            help="Exit with an error if --compare finds a regression.")
+
+    def handle(self, *args, **options):
+        scenarios = [scenario.strip() for scenario in options['scenarios'].split(',') if scenario.strip()]
+        unknown = set(scenarios) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+        baseline = None
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as baseline_file:
+                baseline = json.load(baseline_file)
+
+        self.programs = [(f"Benchmark App {index:04d}", str(100000 + index)) for index in range(options['programs'])]
+        self.options = options
+        self.local = threading.local()
+
+        work_dir = tempfile.mkdtemp(prefix='benchmark_icons_')
+        stub = StubServer(options['latency'] / 1000, options['error_rate'], options['noisy_share'], options['seed'])
+        results = {}
+        # Locks, host state and metrics of this run must not mix with those of a running server
+        overrides = {'LOCK_DIR': os.path.join(work_dir, 'locks'), 'METRICS_DIR': os.path.join(work_dir, 'metrics'),
+                     'ALLOWED_HOSTS': list(settings.ALLOWED_HOSTS) + ['testserver']}
+        originals = {name: getattr(settings, name) for name in overrides}
+        os.environ.setdefault('SPACESERP_API_KEY', 'benchmark')
+        if connection.vendor == 'sqlite':
+            # An in-memory test database can't take concurrent writes, and a file one needs to wait for them
+            connection.settings_dict['TEST']['NAME'] = os.path.join(work_dir, 'benchmark.sqlite3')
+            connection.settings_dict['OPTIONS'].setdefault('timeout', 30)
+            if options['concurrency'] > 1:
+                self.stderr.write("SQLite fails concurrent transactions that write after reading with 'database is "
+                                  "locked', benchmark on MySQL for representative error counts")
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            for name, value in overrides.items():
+                setattr(settings, name, value)
+            stub.start()
+            adapter = StubAdapter(stub.base_url, pool_connections=settings.HTTP_POOL_CONNECTIONS,
+                                  pool_maxsize=settings.HTTP_POOL_MAXSIZE, pool_block=settings.HTTP_POOL_BLOCK)
+            get_session().mount('http://', adapter)
+            get_session().mount('https://', adapter)
+            if not options['selenium']:
+                get_webdriver_pool().shutdown()
+
+            for scenario in scenarios:
+                results[scenario] = self.run_scenario(scenario)
+                self.write_stats(scenario, results[scenario])
+        finally:
+            stub.stop()
+            for name, value in originals.items():
+                setattr(settings, name, value)
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        report = {
+            'created': timezone.now().isoformat(),
+            'commit': git_commit(),
+            'options': {name: options[name] for name in ('programs', 'concurrency', 'latency', 'error_rate',
+                                                         'noisy_share', 'seed', 'selenium')},
+            'scenarios': results,
+        }
+        output = options['output'] or f"benchmark_{datetime.now():%Y%m%d_%H%M%S}.json"
+        with open(output, 'w', encoding='utf-8') as output_file:
+            json.dump(report, output_file, indent=2)
+        self.stdout.write(f"Results saved to {output}")
+
+        if baseline is not None and self.compare(baseline, report) and options['fail_on_regression']:
+            raise CommandError(f"Regressions of more than {options['threshold']}% against {options['compare']}")
+
+    def run_scenario(self, scenario: str) -> dict:
+        endpoint, _, cache_state = scenario.partition(':')
+        if cache_state == 'cold':
+            call_command('flush', interactive=False, verbosity=0)
+        elif cache_state == 'stale':
+            stale_since = timezone.now() - timedelta(days=settings.ICON_STORE_TTL_DAYS + 1)
+            ProcessedIcon.objects.update(last_updated=stale_since)
+
+        send = self.download_icon if endpoint == 'download_icon' else self.remove_bg_img
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.options['concurrency']) as executor:
+            samples = list(executor.map(send, self.programs))
+        elapsed = time.perf_counter() - started
+
+        if cache_state == 'stale':
+            self.wait_for_refreshes()
+        return summarize(samples, elapsed)
+
+    def client(self) -> Client:
+        if not hasattr(self.local, 'client'):
+            self.local.client = Client(HTTP_API_KEY=config('API_KEY'))
+        return self.local.client
+
+    def download_icon(self, program: tuple) -> dict:
+        program_name, program_id = program
+        provided_hash = hashlib.sha256(f"{program_name}{program_id}{config('SECRET_KEY').strip()}".encode())
+        return self.send(lambda client: client.get(reverse('download_icon'),
+                                                   {'program_name': program_name, 'program_id': program_id},
+                                                   HTTP_X_HASH=provided_hash.hexdigest()))
+
+    def remove_bg_img(self, program: tuple) -> dict:
+        icon_url = image_url(slugify(program[0]), self.options['seed'])
+        return self.send(lambda client: client.post(reverse('remove_bg_img'), {'icon-url': icon_url, 'rm-bg': 'true'}))
+
+    def send(self, request) -> dict:
+        started = time.perf_counter()
+        response = request(self.client())
+        latency = (time.perf_counter() - started) * 1000
+        error = ''
+        if response.get('Content-Type', '').startswith('application/json'):
+            error = json.loads(response.content).get('error', '')
+        return {'latency': latency, 'status': response.status_code, 'error': error,
+                'stages': parse_server_timing(response.get('Server-Timing', ''))}
+
+    def wait_for_refreshes(self, timeout: float = 300.0) -> None:
+        """
+        Waits for the background refreshes started by stale hits, so they don't overlap the next scenario.
+        """
+        deadline = time.monotonic() + timeout
+        while Program.objects.filter(refresh_claimed_until__gt=timezone.now()).exists():
+            if time.monotonic() > deadline:
+                self.stderr.write("Background refreshes still running, moving on")
+                return
+            time.sleep(0.1)
+        refreshed = ProcessedIcon.objects.filter(last_updated__gte=timezone.now() - timedelta(minutes=10)).count()
+        self.stdout.write(f"  {refreshed} of {ProcessedIcon.objects.count()} stale icons refreshed")
+
+    def write_stats(self, scenario: str, stats: dict) -> None:
+        self.stdout.write(f"{scenario:<20} {stats['requests']:>4} requests {stats['throughput']:>7.1f}/s  "
+                          f"p50 {stats['p50_ms']:>7.0f}ms  p95 {stats['p95_ms']:>7.0f}ms  "
+                          f"p99 {stats['p99_ms']:>7.0f}ms  max {stats['max_ms']:>7.0f}ms  "
+                          f"errors {stats['http_errors']} http, {stats['icon_errors']} icon")
+        if stats['stages_ms']:
+            self.stdout.write("  " + "  ".join(f"{name} {duration:.1f}ms"
+                                               for name, duration in stats['stages_ms'].items()))
+        for error, count in stats['top_errors'].items():
+            self.stdout.write(f"  {count}x {error}")
+
+    def compare(self, baseline: dict, report: dict) -> bool:
+        """
+        Prints the change of each compared stat against the baseline run.
+
+        Returns:
+            bool: Whether any latency grew, or any throughput dropped, by more than the threshold.
+        """
+        if baseline.get('options') != report['options']:
+            self.stderr.write("The baseline was run with other options, the comparison may be misleading")
+        self.stdout.write(f"Compared with {baseline.get('commit') or 'the baseline'} ({baseline.get('created')}):")
+        regressed = False
+        for scenario, stats in report['scenarios'].items():
+            baseline_stats = baseline.get('scenarios', {}).get(scenario)
+            if not baseline_stats:
+                continue
+            changes = []
+            for name, higher_is_worse in COMPARED_STATS:
+                if not baseline_stats[name]:
+                    continue
+                change = (stats[name] - baseline_stats[name]) / baseline_stats[name] * 100
+                regression = (change if higher_is_worse else -change) > self.options['threshold']
+                regressed = regressed or regression
+                changes.append(f"{name} {change:+.1f}%" + (" REGRESSION" if regression else ""))
+            self.stdout.write(f"{scenario:<20} " + "  ".join(changes))
+        return regressed
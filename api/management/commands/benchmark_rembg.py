@@ -0,0 +1,66 @@
+import statistics
+import time
+from io import BytesIO
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from PIL import Image, ImageDraw
+
+from api.utils.rembg import get_session, remove_background, session_threads
+
+
+def sample_image() -> bytes:
+    """
+    Returns a banner sized image with a motive on a light background, the typical og:image rembg gets.
+    """
+    image = Image.new('RGB', (1200, 630), (244, 246, 248))
+    draw = ImageDraw.Draw(image)
+    draw.rounded_rectangle((450, 165, 750, 465), radius=60, fill=(30, 110, 220))
+    draw.ellipse((530, 245, 670, 385), fill=(250, 200, 40))
+    output = BytesIO()
+    image.save(output, format='JPEG', quality=90)
+    return output.getvalue()
+
+
+class Command(BaseCommand):
+    help = "Measures the background removal latency of each rembg model tier, with and without downscaling."
+
+    def add_arguments(self, parser):
+        parser.add_argument('images', nargs='*', help="Image files to use instead of a generated banner.")
+        parser.add_argument('--models', default=','.join(settings.REMBG_MODELS),
+                            help="Comma separated rembg models to measure.")
+        parser.add_argument('--max-sizes', default=f'0,{settings.REMBG_MAX_INPUT_SIZE}',
+                            help="Comma separated REMBG_MAX_INPUT_SIZE values to measure, 0 for no downscaling.")
+        parser.add_argument('--runs', type=int, default=5, help="Measured runs per image and setting.")
+
+    def handle(self, *args, **options):
+        images = []
+        for path in options['images']:
+            with open(path, 'rb') as image_file:
+                images.append(image_file.read())
+        images = images or [sample_image()]
+        max_sizes = [int(size) for size in options['max_sizes'].split(',')]
+
+        self.stdout.write(f"ONNX Runtime threads (intra-op, inter-op): {session_threads()}")
+        self.stdout.write(f"{'model':<10} {'max size':>8} {'load s':>7} {'p50 ms':>8} {'mean ms':>8} {'max ms':>8}")
+        for model_name in options['models'].split(','):
+            started = time.perf_counter()
+            try:
+                session = get_session(model_name, session_threads())
+            except Exception as e:
+                self.stderr.write(f"{model_name}: the model could not be loaded: {e}")
+                continue
+            load_time = time.perf_counter() - started
+
+            for max_size in max_sizes:
+                # The first inference initializes ONNX Runtime buffers and is not measured
+                remove_background(images[0], session, max_size)
+                latencies = []
+                for image_data in images:
+                    for _ in range(options['runs']):
+                        started = time.perf_counter()
+                        remove_background(image_data, session, max_size)
+                        latencies.append((time.perf_counter() - started) * 1000)
+                self.stdout.write(f"{model_name:<10} {max_size or '-':>8} {load_time:>7.1f} "
+                                  f"{statistics.median(latencies):>8.0f} {statistics.mean(latencies):>8.0f} "
+                                  f"{max(latencies):>8.0f}")
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.utils.icon_misses import invalidate_icon_misses
+
+
+class Command(BaseCommand):
+    help = "Removes cached icon misses so the programs are searched again on their next request."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--program-id', help="Only remove the misses of programs with this ID.")
+        parser.add_argument('--program-name', help="Only remove the misses of programs with this name.")
+        parser.add_argument('--all', action='store_true', help="Remove every cached miss.")
+
+    def handle(self, *args, **options):
+        program_id = options['program_id']
+        program_name = options['program_name']
+        if program_id is None and program_name is None and not options['all']:
+            raise CommandError("Pass --program-id and/or --program-name, or --all.")
+
+        deleted = invalidate_icon_misses(program_id, program_name)
+        self.stdout.write(f"Removed {deleted} cached icon misses.")
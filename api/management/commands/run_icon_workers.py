@@ -0,0 +1,110 @@
+import logging
+import multiprocessing
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from api.client.deadline import Deadline
+from api.utils.icon_jobs import claim_job, complete_job, delete_finished_jobs, fail_job
+from api.utils.metrics import flush_metrics
+from api.views.icon import resolve_icon, response_payload
+
+logger = logging.getLogger(__name__)
+
+# Seconds between removals of old finished jobs, per worker
+CLEANUP_INTERVAL = 3600
+
+
+def run_job(job) -> None:
+    """
+    Resolves the icon of a claimed job the same way download_icon does, and records the outcome. Only a found
+    icon or a miss, see `handle_base64icon_processing`, finishes the job; any other response, e.g. a timeout or
+    no free browser, puts it back in the queue until ICON_JOB_MAX_ATTEMPTS.
+    """
+    try:
+        response = resolve_icon(job.program_name, job.program_id, Deadline(settings.ICON_JOB_DEADLINE))
+    except Exception as e:
+        logger.error(f"Icon job {job.pk} failed", exc_info=e)
+        fail_job(job, str(e))
+        return
+
+    if getattr(response, 'processed_icon', None) or getattr(response, 'icon_miss', None):
+        complete_job(job, getattr(response, 'processed_icon', None), response_payload(response))
+    else:
+        fail_job(job, response_payload(response).get('error', ''))
+
+
+def work(poll_interval: float, burst: bool) -> None:
+    """
+    The loop of one worker process: claims and runs jobs until stopped, or until the queue is empty in burst mode.
+    """
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    last_cleanup = 0.0
+    while not stopping:
+        if time.monotonic() - last_cleanup > CLEANUP_INTERVAL:
+            delete_finished_jobs()
+            last_cleanup = time.monotonic()
+
+        job = claim_job()
+        if job is None:
+            if burst:
+                break
+            time.sleep(poll_interval)
+            continue
+        run_job(job)
+        flush_metrics()
+
+    flush_metrics(force=True)
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    help = "Runs local worker processes resolving the icon jobs queued by download_icon in async mode."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=settings.ICON_JOB_WORKERS,
+                            help="Number of worker processes.")
+        parser.add_argument('--poll-interval', type=float, default=settings.ICON_JOB_POLL_INTERVAL,
+                            help="Seconds to wait before polling an empty queue again.")
+        parser.add_argument('--burst', action='store_true',
+                            help="Exit once the queue is empty instead of waiting for new jobs.")
+
+    def handle(self, *args, **options):
+        processes = options['processes']
+        # Every worker opens its own database connections
+        connections.close_all()
+
+        workers = [
+            multiprocessing.Process(target=work, args=(options['poll_interval'], options['burst']),
+                                    name=f'icon-worker-{index}')
+            for index in range(processes)
+        ]
+        for worker in workers:
+            worker.start()
+        self.stdout.write(f"Started {processes} icon workers.")
+
+        def forward(signum, frame):
+            for worker in workers:
+                if worker.is_alive():
+                    worker.terminate()
+
+        signal.signal(signal.SIGTERM, forward)
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            # The workers got the SIGINT as well and stop after their current job
+            for worker in workers:
+                worker.join()
+        self.stdout.write("Icon workers stopped.")
@@ -0,0 +1,205 @@
+import csv
+import json
+import logging
+import os
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from api.client.deadline import Deadline
+from api.client.rate_limiter import RateLimiter, parse_host_rates, set_rate_limiter
+from api.views.icon import cached_icon_response, resolve_icon
+
+logger = logging.getLogger(__name__)
+
+STORED = 'stored'
+RESOLVED = 'resolved'
+MISS = 'miss'
+FAILED = 'failed'
+INVALID = 'invalid'
+
+
+def read_programs(path: str, input_format: str) -> list:
+    """
+    Reads (program_id, program_name) pairs from a CSV file, with a header naming the 'program_id' and
+    'program_name' columns or with both as the first two columns, or from a JSON list of objects or pairs.
+    """
+    with open(path, newline='', encoding='utf-8') as input_file:
+        if input_format == 'json':
+            rows = json.load(input_file)
+            return [(row['program_id'], row['program_name']) if isinstance(row, dict) else tuple(row[:2])
+                    for row in rows]
+
+        rows = list(csv.reader(input_file))
+        if rows and 'program_id' in rows[0] and 'program_name' in rows[0]:
+            id_column, name_column = rows[0].index('program_id'), rows[0].index('program_name')
+            rows = rows[1:]
+        else:
+            id_column, name_column = 0, 1
+        return [(row[id_column], row[name_column]) for row in rows if len(row) > max(id_column, name_column)]
+
+
+def program_key(program_id, program_name) -> str:
+    return f"{str(program_id).strip()}:{str(program_name).strip()}"
+
+
+def read_checkpoint(path: str) -> dict:
+    """
+    Returns the outcomes recorded in a checkpoint file, keyed by `program_key`.
+    """
+    outcomes = {}
+    if not os.path.exists(path):
+        return outcomes
+    with open(path, encoding='utf-8') as checkpoint:
+        for line in checkpoint:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # The last line is cut off if the command was killed while writing it
+                continue
+            outcomes[program_key(record['program_id'], record['program_name'])] = record['outcome']
+    return outcomes
+
+
+def valid_program(program_id, program_name) -> bool:
+    """
+    Applies the checks of `validate_program_input`, apart from the hash, which a program list does not carry.
+    """
+    if not isinstance(program_name, str) or not 0 < len(program_name.strip()) < 80:
+        return False
+    try:
+        float(str(program_id))
+    except ValueError:
+        return False
+    return True
+
+
+def warm_program(program_id, program_name, deadline_seconds: float) -> str:
+    """
+    Resolves the icon of one program through the same pipeline as download_icon, and returns the outcome.
+    """
+    if not valid_program(program_id, program_name):
+        return INVALID
+    program_id, program_name = str(program_id).strip(), program_name.strip()
+    try:
+        response = cached_icon_response(program_name, program_id)
+        if response is not None:
+            return STORED if getattr(response, 'processed_icon', None) else MISS
+
+        response = resolve_icon(program_name, program_id, Deadline(deadline_seconds))
+        if getattr(response, 'processed_icon', None):
+            return RESOLVED
+        if getattr(response, 'icon_miss', None):
+            return MISS
+        return FAILED
+    except Exception as e:
+        logger.error(f"Warming the icon of {program_name} failed", exc_info=e)
+        return FAILED
+    finally:
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = ("Resolves the icons of a list of programs ahead of traffic, filling the stored search results and "
+            "processed icons. Progress is checkpointed, so an interrupted run resumes where it stopped.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help="CSV or JSON file listing program_id and program_name.")
+        parser.add_argument('--format', choices=['csv', 'json'],
+                            help="Format of the input file, by default from its extension.")
+        parser.add_argument('--concurrency', type=int, default=settings.ICON_BATCH_CONCURRENCY,
+                            help="Number of programs resolved at once.")
+        parser.add_argument('--rate', type=float, default=settings.HTTP_HOST_RATE,
+                            help="Requests per second allowed per host, 0 for no limit.")
+        parser.add_argument('--burst', type=int, default=settings.HTTP_HOST_BURST,
+                            help="Requests a host may get at once after being idle.")
+        parser.add_argument('--host-rate', action='append', default=list(settings.HTTP_HOST_RATES),
+                            metavar='HOST=RATE', help="Requests per second for a specific host, repeatable.")
+        parser.add_argument('--deadline', type=float, default=settings.ICON_JOB_DEADLINE,
+                            help="Seconds allowed to resolve one program.")
+        parser.add_argument('--checkpoint',
+                            help="File recording the finished programs, by default the input path plus "
+                                 "'.checkpoint'. Programs recorded there are skipped, apart from failures.")
+        parser.add_argument('--restart', action='store_true', help="Discard the checkpoint and start over.")
+        parser.add_argument('--report-interval', type=float, default=10.0,
+                            help="Seconds between progress reports.")
+
+    def handle(self, *args, **options):
+        path = options['input']
+        input_format = options['format'] or ('json' if path.lower().endswith('.json') else 'csv')
+        checkpoint_path = options['checkpoint'] or f"{path}.checkpoint"
+        concurrency = max(1, options['concurrency'])
+
+        try:
+            programs = read_programs(path, input_format)
+            host_rates = parse_host_rates(options['host_rate'])
+        except (OSError, ValueError, KeyError, IndexError, TypeError) as e:
+            raise CommandError(f"Could not read the program list: {e}")
+        set_rate_limiter(RateLimiter(options['rate'], options['burst'], host_rates))
+
+        if options['restart'] and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        finished = read_checkpoint(checkpoint_path)
+
+        pending, seen = [], set()
+        for program_id, program_name in programs:
+            key = program_key(program_id, program_name)
+            if key in seen or finished.get(key, FAILED) != FAILED:
+                continue
+            seen.add(key)
+            pending.append((program_id, program_name))
+
+        total = len(pending)
+        self.stdout.write(f"Warming {total} programs, {len(programs) - total} skipped as already done or "
+                          f"duplicate, with {concurrency} workers.")
+
+        outcomes = Counter()
+        started = last_report = time.monotonic()
+        executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='icon-warm')
+        remaining = iter(pending)
+        in_flight = {}
+        try:
+            with open(checkpoint_path, 'a', encoding='utf-8') as checkpoint:
+                while True:
+                    # Submitting a bounded number at a time keeps memory flat for large lists
+                    while len(in_flight) < concurrency * 2:
+                        program = next(remaining, None)
+                        if program is None:
+                            break
+                        in_flight[executor.submit(warm_program, *program, options['deadline'])] = program
+                    if not in_flight:
+                        break
+
+                    done, _ = wait(in_flight, timeout=options['report_interval'], return_when=FIRST_COMPLETED)
+                    for future in done:
+                        program_id, program_name = in_flight.pop(future)
+                        outcome = future.result()
+                        outcomes[outcome] += 1
+                        checkpoint.write(json.dumps({'program_id': program_id, 'program_name': program_name,
+                                                     'outcome': outcome}) + "\n")
+                    checkpoint.flush()
+
+                    if time.monotonic() - last_report >= options['report_interval']:
+                        self.report(outcomes, total, started)
+                        last_report = time.monotonic()
+        except KeyboardInterrupt:
+            self.stdout.write("Interrupted, run the same command again to resume.")
+            executor.shutdown(wait=False, cancel_futures=True)
+            return
+        executor.shutdown()
+
+        self.report(outcomes, total, started)
+        self.stdout.write(f"Checkpoint written to {checkpoint_path}.")
+
+    def report(self, outcomes: Counter, total: int, started: float) -> None:
+        done = sum(outcomes.values())
+        elapsed = time.monotonic() - started
+        throughput = done / elapsed if elapsed else 0.0
+        eta = (total - done) / throughput if throughput else 0.0
+        counts = ', '.join(f"{outcome} {count}" for outcome, count in sorted(outcomes.items()))
+        self.stdout.write(f"{done}/{total} ({done / total if total else 1:.0%}) in {elapsed:.0f}s, "
+                          f"{throughput:.2f} programs/s, ETA {eta:.0f}s: {counts or 'nothing done yet'}")
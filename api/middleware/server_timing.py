@@ -0,0 +1,32 @@
+import time
+
+from api.utils.metrics import REQUEST_DURATION, flush_metrics, observe
+from api.utils.timing import start_timings, stop_timings
+
+
+class ServerTimingMiddleware:
+    """
+    Times every request, reports its stages, see `api.utils.timing.stage`, in a Server-Timing header, and
+    records its duration per endpoint. The metrics of the process are flushed for the metrics endpoint
+    every METRICS_FLUSH_INTERVAL seconds.
+
+    Streamed responses only report the stages that ran before streaming started.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timings, token = start_timings()
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            stop_timings(token)
+        total = time.perf_counter() - started
+
+        response['Server-Timing'] = timings.server_timing(total)
+        url_name = request.resolver_match.url_name if request.resolver_match else 'unknown'
+        observe(REQUEST_DURATION, {'endpoint': url_name or 'unknown'}, total)
+        flush_metrics()
+        return response
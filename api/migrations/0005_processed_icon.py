@@ -0,0 +1,41 @@
+# Generated by Django 5.0.2 on 2026-10-18 04:12
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_alter_program_program_id_alter_program_program_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProcessedIcon',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source_hash', models.CharField(max_length=64)),
+                ('rm_bg', models.BooleanField(default=True)),
+                ('image_format', models.CharField(max_length=10)),
+                ('image_data', models.BinaryField()),
+                ('size', models.PositiveIntegerField()),
+                ('date_added', models.DateTimeField(auto_now_add=True)),
+                ('last_updated', models.DateTimeField(auto_now=True)),
+                ('last_accessed', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['last_accessed'], name='api_process_last_ac_80a654_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='processedicon',
+            constraint=models.UniqueConstraint(fields=('source_hash', 'rm_bg'), name='unique_processed_icon_source'),
+        ),
+        migrations.AddField(
+            model_name='program',
+            name='icon',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='programs', to='api.processedicon'),
+        ),
+    ]
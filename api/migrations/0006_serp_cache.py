@@ -0,0 +1,26 @@
+# Generated by Django 5.0.2 on 2026-10-18 04:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_processed_icon'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SerpCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cache_key', models.CharField(max_length=64, unique=True)),
+                ('query', models.CharField(max_length=400)),
+                ('gl', models.CharField(max_length=10)),
+                ('hl', models.CharField(max_length=10)),
+                ('result_blocks', models.CharField(max_length=100)),
+                ('results', models.JSONField(default=list)),
+                ('fetched_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
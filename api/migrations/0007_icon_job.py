@@ -0,0 +1,33 @@
+# Generated by Django 5.0.2 on 2026-10-18 04:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_serp_cache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IconJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('program_name', models.CharField(max_length=80)),
+                ('program_id', models.CharField(max_length=32)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('attempts', models.IntegerField(default=0)),
+                ('locked_until', models.DateTimeField(blank=True, null=True)),
+                ('result', models.JSONField(blank=True, null=True)),
+                ('error', models.TextField(blank=True)),
+                ('date_added', models.DateTimeField(auto_now_add=True)),
+                ('last_updated', models.DateTimeField(auto_now=True)),
+                ('icon', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='api.processedicon')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'date_added'], name='api_iconjob_status_1a9b5c_idx'), models.Index(fields=['program_id', 'program_name'], name='api_iconjob_program_acdc6e_idx')],
+            },
+        ),
+    ]
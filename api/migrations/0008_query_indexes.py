@@ -0,0 +1,21 @@
+# Generated by Django 5.0.2 on 2026-10-18 04:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_icon_job'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='program',
+            index=models.Index(fields=['program_id', 'program_name'], name='api_program_program_3f909b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='searchresults',
+            index=models.Index(fields=['program_id', 'last_updated'], name='api_searchr_program_61161b_idx'),
+        ),
+    ]
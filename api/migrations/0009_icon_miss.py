@@ -0,0 +1,26 @@
+# Generated by Django 5.0.2 on 2026-10-18 04:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IconMiss',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reason', models.TextField()),
+                ('failures', models.IntegerField(default=1)),
+                ('recheck_after', models.DateTimeField(db_index=True)),
+                ('date_added', models.DateTimeField(auto_now_add=True)),
+                ('last_updated', models.DateTimeField(auto_now=True)),
+                ('program', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='icon_miss', to='api.program')),
+            ],
+        ),
+    ]
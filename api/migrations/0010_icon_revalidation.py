@@ -0,0 +1,43 @@
+# Generated by Django 5.0.2 on 2026-10-18 04:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_icon_miss'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='processedicon',
+            name='source_etag',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='processedicon',
+            name='source_last_modified',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='processedicon',
+            name='source_url',
+            field=models.URLField(blank=True, default='', max_length=4000),
+        ),
+        migrations.AddField(
+            model_name='program',
+            name='refresh_claimed_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='searchresults',
+            name='etag',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='searchresults',
+            name='last_modified',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
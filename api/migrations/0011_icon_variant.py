@@ -0,0 +1,30 @@
+# Generated by Django 5.0.2 on 2026-10-18 04:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_icon_revalidation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IconVariant',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dimension', models.PositiveSmallIntegerField()),
+                ('image_format', models.CharField(max_length=10)),
+                ('image_data', models.BinaryField()),
+                ('size', models.PositiveIntegerField()),
+                ('date_added', models.DateTimeField(auto_now_add=True)),
+                ('icon', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='variants', to='api.processedicon')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='iconvariant',
+            constraint=models.UniqueConstraint(fields=('icon', 'dimension', 'image_format'), name='unique_icon_variant'),
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 5.0.2 on 2026-10-18 04:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_icon_variant'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='processedicon',
+            name='dhash_band0',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='processedicon',
+            name='dhash_band1',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='processedicon',
+            name='dhash_band2',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='processedicon',
+            name='dhash_band3',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='processedicon',
+            name='source_ahash',
+            field=models.CharField(blank=True, default='', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='processedicon',
+            name='source_dhash',
+            field=models.CharField(blank=True, default='', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='processedicon',
+            name='source_height',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='processedicon',
+            name='source_width',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='processedicon',
+            index=models.Index(fields=['dhash_band0'], name='api_process_dhash_b_f3a66c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='processedicon',
+            index=models.Index(fields=['dhash_band1'], name='api_process_dhash_b_6be60b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='processedicon',
+            index=models.Index(fields=['dhash_band2'], name='api_process_dhash_b_58c291_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='processedicon',
+            index=models.Index(fields=['dhash_band3'], name='api_process_dhash_b_72791d_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.0.2 on 2026-10-18 05:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_perceptual_hash'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='processedicon',
+            name='unique_processed_icon_source',
+        ),
+        migrations.AddField(
+            model_name='processedicon',
+            name='rembg_model',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+        migrations.AddConstraint(
+            model_name='processedicon',
+            constraint=models.UniqueConstraint(fields=('source_hash', 'rm_bg', 'rembg_model'), name='unique_processed_icon_source'),
+        ),
+    ]
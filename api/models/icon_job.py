@@ -0,0 +1,36 @@
+from django.db import models
+
+from api.models.processed_icon import ProcessedIcon
+
+
+class IconJob(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    program_name = models.CharField(max_length=80)
+    program_id = models.CharField(max_length=32)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    icon = models.ForeignKey(ProcessedIcon, null=True, blank=True, on_delete=models.SET_NULL)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    date_added = models.DateTimeField(auto_now_add=True)
+    last_updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.program_name} ({self.status})"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'date_added']),
+            models.Index(fields=['program_id', 'program_name']),
+        ]
@@ -0,0 +1,15 @@
+from django.db import models
+
+from api.models.program import Program
+
+
+class IconMiss(models.Model):
+    program = models.OneToOneField(Program, on_delete=models.CASCADE, related_name='icon_miss')
+    reason = models.TextField()
+    failures = models.IntegerField(default=1)
+    recheck_after = models.DateTimeField(db_index=True)
+    date_added = models.DateTimeField(auto_now_add=True)
+    last_updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.program} ({self.failures} failures)"
@@ -0,0 +1,21 @@
+from django.db import models
+
+from api.models.processed_icon import ProcessedIcon
+
+
+class IconVariant(models.Model):
+    icon = models.ForeignKey(ProcessedIcon, on_delete=models.CASCADE, related_name='variants')
+    # Longest side in pixels, 0 keeps the dimensions of the processed icon
+    dimension = models.PositiveSmallIntegerField()
+    image_format = models.CharField(max_length=10)
+    image_data = models.BinaryField()
+    size = models.PositiveIntegerField()
+    date_added = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.icon.source_hash} ({self.dimension}px {self.image_format})"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['icon', 'dimension', 'image_format'], name='unique_icon_variant'),
+        ]
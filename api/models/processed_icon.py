@@ -0,0 +1,45 @@
+from django.db import models
+from django.utils import timezone
+
+
+class ProcessedIcon(models.Model):
+    source_hash = models.CharField(max_length=64)
+    rm_bg = models.BooleanField(default=True)
+    # The rembg model requested for the icon if it is not REMBG_MODEL, so other tiers are never served for it
+    rembg_model = models.CharField(max_length=32, blank=True, default='')
+    image_format = models.CharField(max_length=10)
+    image_data = models.BinaryField()
+    size = models.PositiveIntegerField()
+    date_added = models.DateTimeField(auto_now_add=True)
+    last_updated = models.DateTimeField(auto_now=True)
+    last_accessed = models.DateTimeField(default=timezone.now)
+    # Where the source image was downloaded from, and its validators for conditional re-downloads
+    source_url = models.URLField(max_length=4000, blank=True, default='')
+    source_etag = models.CharField(max_length=255, blank=True, default='')
+    source_last_modified = models.CharField(max_length=64, blank=True, default='')
+    # Perceptual hashes of the source image as 16 hex digits, and the dHash split into bands for the near
+    # duplicate lookup, see api.utils.perceptual_hash. Empty for nearly blank images.
+    source_ahash = models.CharField(max_length=16, blank=True, default='')
+    source_dhash = models.CharField(max_length=16, blank=True, default='')
+    dhash_band0 = models.PositiveIntegerField(null=True, blank=True)
+    dhash_band1 = models.PositiveIntegerField(null=True, blank=True)
+    dhash_band2 = models.PositiveIntegerField(null=True, blank=True)
+    dhash_band3 = models.PositiveIntegerField(null=True, blank=True)
+    source_width = models.PositiveIntegerField(null=True, blank=True)
+    source_height = models.PositiveIntegerField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.source_hash} ({self.image_format})"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['source_hash', 'rm_bg', 'rembg_model'],
+                                    name='unique_processed_icon_source'),
+        ]
+        indexes = [
+            models.Index(fields=['last_accessed']),
+            models.Index(fields=['dhash_band0']),
+            models.Index(fields=['dhash_band1']),
+            models.Index(fields=['dhash_band2']),
+            models.Index(fields=['dhash_band3']),
+        ]
@@ -1,9 +1,20 @@
 from django.db import models
 
+from api.models.processed_icon import ProcessedIcon
+
 
 class Program(models.Model):
     program_id = models.IntegerField()
     program_name = models.CharField(max_length=80)
+    icon = models.ForeignKey(ProcessedIcon, null=True, blank=True, on_delete=models.SET_NULL,
+                             related_name='programs')
+    # Set while a background refresh of the stale icon runs, so only one worker refreshes it
+    refresh_claimed_until = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
         return self.program_name
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['program_id', 'program_name']),
+        ]
@@ -11,9 +11,15 @@ class SearchResults(models.Model):
     date_added = models.DateTimeField(auto_now_add=True)
     last_updated = models.DateTimeField(auto_now=True)
     program_id = models.ForeignKey(Program, on_delete=models.CASCADE)
+    # Validators of the page, for conditional requests when the result is refreshed
+    etag = models.CharField(max_length=255, blank=True, default='')
+    last_modified = models.CharField(max_length=64, blank=True, default='')
 
     def __str__(self):
         return self.url
 
     class Meta:
         ordering = ['-last_updated']
+        indexes = [
+            models.Index(fields=['program_id', 'last_updated']),
+        ]
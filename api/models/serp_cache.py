@@ -0,0 +1,14 @@
+from django.db import models
+
+
+class SerpCache(models.Model):
+    cache_key = models.CharField(max_length=64, unique=True)
+    query = models.CharField(max_length=400)
+    gl = models.CharField(max_length=10)
+    hl = models.CharField(max_length=10)
+    result_blocks = models.CharField(max_length=100)
+    results = models.JSONField(default=list)
+    fetched_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.query
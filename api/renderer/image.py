@@ -0,0 +1,15 @@
+from rest_framework.renderers import BaseRenderer
+
+
+class ImageRenderer(BaseRenderer):
+    """
+    Lets clients ask for raw image responses with `Accept: image/*` instead of being refused by content
+    negotiation. The image responses themselves are built by the views, see `raw_icon_response`.
+    """
+    media_type = 'image/*'
+    format = 'image'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return data
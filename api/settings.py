@@ -1,5 +1,6 @@
+import tempfile
 from pathlib import Path
-from decouple import config
+from decouple import Csv, config
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -19,6 +20,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.server_timing.ServerTimingMiddleware',
 ]
 
 ROOT_URLCONF = 'api.urls'
@@ -52,6 +54,113 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Outbound HTTP connection pooling
+HTTP_POOL_CONNECTIONS = config('HTTP_POOL_CONNECTIONS', default=16, cast=int)
+HTTP_POOL_MAXSIZE = config('HTTP_POOL_MAXSIZE', default=8, cast=int)
+HTTP_POOL_BLOCK = config('HTTP_POOL_BLOCK', default=False, cast=bool)
+HTTP_CONNECT_TIMEOUT = config('HTTP_CONNECT_TIMEOUT', default=5.0, cast=float)
+HTTP_READ_TIMEOUT = config('HTTP_READ_TIMEOUT', default=20.0, cast=float)
+HTTP_MAX_BACKOFF = config('HTTP_MAX_BACKOFF', default=10.0, cast=float)
+# Outbound requests per second allowed per host, 0 for no limit, with bursts of HTTP_HOST_BURST requests,
+# shared by all worker processes of the machine.
+# HTTP_HOST_RATES overrides the rate of specific hosts, e.g. 'api.spaceserp.com=1.5,uptodown.com=0.5'.
+HTTP_HOST_RATE = config('HTTP_HOST_RATE', default=0.0, cast=float)
+HTTP_HOST_BURST = config('HTTP_HOST_BURST', default=1, cast=int)
+HTTP_HOST_RATES = config('HTTP_HOST_RATES', default='', cast=Csv())
+# Subdomains of these sites are rate limited and tracked by the circuit breaker as one host
+HTTP_HOST_GROUPS = config('HTTP_HOST_GROUPS', default='computerbase.de,uptodown.com,softonic.com', cast=Csv())
+# A host's circuit breaker opens after this many consecutive failed requests, 0 disables it, and lets a probe
+# request through after HTTP_BREAKER_COOLDOWN seconds
+HTTP_BREAKER_FAILURES = config('HTTP_BREAKER_FAILURES', default=5, cast=int)
+HTTP_BREAKER_COOLDOWN = config('HTTP_BREAKER_COOLDOWN', default=30.0, cast=float)
+
+# Stop reading a page once its <head> is scanned, or after this many bytes
+HTML_STREAMING_EXTRACTION = config('HTML_STREAMING_EXTRACTION', default=True, cast=bool)
+HTML_HEAD_MAX_BYTES = config('HTML_HEAD_MAX_BYTES', default=256 * 1024, cast=int)
+
+# Abort image downloads larger than this
+IMAGE_MAX_BYTES = config('IMAGE_MAX_BYTES', default=5 * 1024 * 1024, cast=int)
+
+# Total time budget in seconds of a single icon request, shared by all of its stages
+ICON_REQUEST_DEADLINE = config('ICON_REQUEST_DEADLINE', default=45.0, cast=float)
+
+# Directory of the lock files shared by the worker processes of this host, e.g. to coalesce concurrent
+# resolutions of the same program
+LOCK_DIR = config('LOCK_DIR', default=str(Path(tempfile.gettempdir()) / 'data_scraper_locks'))
+
+# Every worker process writes its metrics to METRICS_DIR at most every METRICS_FLUSH_INTERVAL seconds, summed up
+# by the metrics endpoint, which folds the files of exited processes into one. Empty METRICS_DIR on deploy to reset
+# the counters.
+METRICS_DIR = config('METRICS_DIR', default=str(Path(tempfile.gettempdir()) / 'data_scraper_metrics'))
+METRICS_FLUSH_INTERVAL = config('METRICS_FLUSH_INTERVAL', default=5.0, cast=float)
+
+# Seconds clients and CDNs may cache raw icon responses, see `raw_icon_response`
+ICON_CACHE_MAX_AGE = config('ICON_CACHE_MAX_AGE', default=86400, cast=int)
+
+# Icon sizes in pixels clients may ask for with `size`; each variant is rendered once and stored
+ICON_VARIANT_SIZES = config('ICON_VARIANT_SIZES', default='16,24,32,48,64,128,256', cast=Csv(int))
+
+# Search all sites in parallel on a cache miss. This spends one SERP query per site on every miss.
+ICON_SEARCH_CONCURRENT = config('ICON_SEARCH_CONCURRENT', default=False, cast=bool)
+ICON_SEARCH_MAX_WORKERS = config('ICON_SEARCH_MAX_WORKERS', default=12, cast=int)
+
+# Batch icon endpoint
+ICON_BATCH_MAX_ITEMS = config('ICON_BATCH_MAX_ITEMS', default=1000, cast=int)
+ICON_BATCH_CONCURRENCY = config('ICON_BATCH_CONCURRENCY', default=4, cast=int)
+
+# Pool of headless Chrome instances used by the Selenium icon fallback
+SELENIUM_POOL_SIZE = config('SELENIUM_POOL_SIZE', default=2, cast=int)
+SELENIUM_MAX_USES = config('SELENIUM_MAX_USES', default=50, cast=int)
+SELENIUM_CHECKOUT_TIMEOUT = config('SELENIUM_CHECKOUT_TIMEOUT', default=30.0, cast=float)
+# Page load timeout of the pooled browsers, further limited by the deadline of the request
+SELENIUM_PAGE_LOAD_TIMEOUT = config('SELENIUM_PAGE_LOAD_TIMEOUT', default=30.0, cast=float)
+
+# Background removal. With REMBG_WORKERS = 0 rembg runs inline on the request thread.
+REMBG_MODEL = config('REMBG_MODEL', default='u2net')
+REMBG_WORKERS = config('REMBG_WORKERS', default=2, cast=int)
+REMBG_QUEUE_DEPTH = config('REMBG_QUEUE_DEPTH', default=32, cast=int)
+REMBG_BATCH_SIZE = config('REMBG_BATCH_SIZE', default=4, cast=int)
+REMBG_BATCH_WINDOW = config('REMBG_BATCH_WINDOW', default=0.02, cast=float)
+REMBG_TIMEOUT = config('REMBG_TIMEOUT', default=30.0, cast=float)
+# Models clients may pick per request with `rembg-model`, from best quality to fastest
+REMBG_MODELS = config('REMBG_MODELS', default='u2net,silueta,u2netp', cast=Csv())
+# Images are downscaled to this longest side for inference, the mask is upsampled back. 0 disables it.
+REMBG_MAX_INPUT_SIZE = config('REMBG_MAX_INPUT_SIZE', default=512, cast=int)
+# ONNX Runtime thread counts per inference session, 0 leaves them to ONNX Runtime
+REMBG_INTRA_OP_THREADS = config('REMBG_INTRA_OP_THREADS', default=0, cast=int)
+REMBG_INTER_OP_THREADS = config('REMBG_INTER_OP_THREADS', default=0, cast=int)
+
+# SpaceSERP organic results are reused for this many days
+SERP_CACHE_TTL_DAYS = config('SERP_CACHE_TTL_DAYS', default=30, cast=int)
+
+# Async icon jobs, resolved by `manage.py run_icon_workers`
+ICON_JOB_WORKERS = config('ICON_JOB_WORKERS', default=2, cast=int)
+ICON_JOB_MAX_ATTEMPTS = config('ICON_JOB_MAX_ATTEMPTS', default=3, cast=int)
+ICON_JOB_VISIBILITY_TIMEOUT = config('ICON_JOB_VISIBILITY_TIMEOUT', default=300, cast=int)
+ICON_JOB_DEADLINE = config('ICON_JOB_DEADLINE', default=120.0, cast=float)
+ICON_JOB_POLL_INTERVAL = config('ICON_JOB_POLL_INTERVAL', default=1.0, cast=float)
+ICON_JOB_RETENTION_DAYS = config('ICON_JOB_RETENTION_DAYS', default=7, cast=int)
+
+# Processed icon store
+ICON_STORE_TTL_DAYS = config('ICON_STORE_TTL_DAYS', default=30, cast=int)
+ICON_STORE_MAX_BYTES = config('ICON_STORE_MAX_BYTES', default=256 * 1024 * 1024, cast=int)
+# The size of the store is checked every ICON_STORE_EVICT_INTERVAL seconds per process, or sooner once the process
+# stored as many bytes as were left under the cap, so the cap can be exceeded until the next check
+ICON_STORE_EVICT_INTERVAL = config('ICON_STORE_EVICT_INTERVAL', default=60.0, cast=float)
+# Icons past the TTL are still served for ICON_STORE_STALE_DAYS while a background refresh revalidates them
+ICON_STORE_STALE_DAYS = config('ICON_STORE_STALE_DAYS', default=30, cast=int)
+ICON_REFRESH_WORKERS = config('ICON_REFRESH_WORKERS', default=2, cast=int)
+ICON_REFRESH_DEADLINE = config('ICON_REFRESH_DEADLINE', default=120.0, cast=float)
+# A source image whose perceptual hashes are within this many bits of a stored one reuses its processed icon
+# instead of removing the background again. Up to 3 bits the lookup by dHash bands finds every such image;
+# -1 disables it.
+ICON_DEDUP_MAX_DISTANCE = config('ICON_DEDUP_MAX_DISTANCE', default=3, cast=int)
+
+# Programs without a findable icon are answered from the miss cache until their next re-check. The interval
+# starts at ICON_MISS_RECHECK_HOURS and doubles with every failed re-check, up to ICON_MISS_MAX_RECHECK_DAYS.
+ICON_MISS_RECHECK_HOURS = config('ICON_MISS_RECHECK_HOURS', default=6, cast=int)
+ICON_MISS_MAX_RECHECK_DAYS = config('ICON_MISS_MAX_RECHECK_DAYS', default=30, cast=int)
+
 REST_FRAMEWORK = {
     'UNAUTHENTICATED_USER': None,
     'DEFAULT_AUTHENTICATION_CLASSES': [],
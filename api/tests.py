@@ -0,0 +1,237 @@
+import hashlib
+import shutil
+import tempfile
+import threading
+from unittest import mock
+
+from decouple import config
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from api.benchmark.stub_server import StubAdapter, StubServer
+from api.client.http_client import get_session
+from api.models.program import Program
+from api.models.processed_icon import ProcessedIcon
+from api.models.search_results import SearchResults
+from api.models.serp_cache import SerpCache
+from api.utils import icon_store
+from api.utils.google_search import fetch_google_search, search_failed
+from api.utils.html_content_parser import HeadElementScanner, scan_document_head
+from api.utils.single_flight import single_flight
+from api.views.icon import search_icon
+
+# A program whose og:image on the stub server is a PNG on a solid background, cut out without rembg
+PROGRAM_NAME = 'Icon Test'
+PROGRAM_ID = '4711'
+
+
+class StubServerTestCase(TestCase):
+    """
+    Runs the tests against the stub servers of api.benchmark instead of SpaceSERP, the download sites and the
+    image hosts.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.state_dir = tempfile.mkdtemp(prefix='api_tests_')
+        cls.settings_override = override_settings(
+            LOCK_DIR=cls.state_dir, METRICS_DIR=cls.state_dir, ALLOWED_HOSTS=['testserver'],
+            ICON_SEARCH_CONCURRENT=False, HTTP_HOST_RATE=0.0, HTTP_HOST_RATES=[], HTTP_BREAKER_FAILURES=0)
+        cls.settings_override.enable()
+
+        cls.stub = StubServer().start()
+        session = get_session()
+        cls.adapters = {prefix: session.adapters[prefix] for prefix in ('http://', 'https://')}
+        adapter = StubAdapter(cls.stub.base_url)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+
+    @classmethod
+    def tearDownClass(cls):
+        session = get_session()
+        for prefix, adapter in cls.adapters.items():
+            session.mount(prefix, adapter)
+        cls.stub.stop()
+        cls.settings_override.disable()
+        shutil.rmtree(cls.state_dir, ignore_errors=True)
+        super().tearDownClass()
+
+    def download_icon(self, program_name=PROGRAM_NAME, program_id=PROGRAM_ID, **headers):
+        provided_hash = hashlib.sha256(f"{program_name.strip()}{program_id}{config('SECRET_KEY').strip()}".encode())
+        return self.client.get(reverse('download_icon'), {'program_name': program_name, 'program_id': program_id},
+                               HTTP_API_KEY=config('API_KEY'), HTTP_X_HASH=provided_hash.hexdigest(), **headers)
+
+
+class PageValidatorTests(StubServerTestCase):
+    """
+    Checks that the first search stores the ETag of the page it found, so its refresh is a conditional request.
+    """
+
+    def test_search_icon(self):
+        search_icon(PROGRAM_NAME, PROGRAM_ID)
+        self.assertNotIn('', SearchResults.objects.values_list('etag', flat=True))
+
+
+class QueryCountTests(StubServerTestCase):
+    """
+    Pins the number of queries of the hot paths, so a change that adds round trips to them shows up here.
+    """
+
+    def test_warm_download_icon(self):
+        response = self.download_icon()
+        self.assertIn('image_data', response.json())
+
+        # A single lookup of the stored icon
+        with self.assertNumQueries(1):
+            response = self.download_icon()
+        self.assertIn('image_data', response.json())
+
+    def test_repeated_search_icon(self):
+        response = search_icon(PROGRAM_NAME, PROGRAM_ID)
+        self.assertTrue(getattr(response, 'processed_icon', None))
+
+        # The program, the known search terms, the SERP cache, touching the search result, the attempts of
+        # the search term and the stored icon by source hash
+        with self.assertNumQueries(6):
+            response = search_icon(PROGRAM_NAME, PROGRAM_ID)
+        self.assertTrue(getattr(response, 'processed_icon', None))
+
+
+class ProgramNameTests(StubServerTestCase):
+    """
+    Checks that a program name with surrounding whitespace is resolved, stored and served under the stripped name.
+    """
+
+    def test_padded_program_name(self):
+        response = self.download_icon(f'  {PROGRAM_NAME} ')
+        self.assertIn('image_data', response.json())
+        self.assertEqual(list(Program.objects.values_list('program_name', flat=True)), [PROGRAM_NAME])
+
+        with self.assertNumQueries(1):
+            response = self.download_icon(PROGRAM_NAME)
+        self.assertIn('image_data', response.json())
+
+
+class AsyncDownloadIconTests(StubServerTestCase):
+    """
+    Checks the async mode of download_icon, see `wants_async`.
+    """
+
+    def test_fractional_program_id(self):
+        # Passes the numeric check of `validate_program_input`, but not the integer lookup of the program
+        response = self.download_icon(program_id='1.5', HTTP_PREFER='respond-async')
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.json(), {'error': 'An unexpected error occurred.'})
+
+
+class SerpCacheTests(TestCase):
+    """
+    Checks which SpaceSERP responses are stored in the SERP cache, see `fetch_google_search`.
+    """
+
+    def search(self, payload):
+        response = mock.Mock()
+        response.json.return_value = payload
+        with mock.patch('api.utils.google_search.HTTPClient.request', return_value=response):
+            return fetch_google_search('Icon Test site:chip.de')
+
+    def test_no_results(self):
+        links = self.search({'organic_results': []})
+        self.assertFalse(search_failed(links))
+        self.assertEqual(SerpCache.objects.get().results, [])
+
+    def test_missing_organic_results(self):
+        # E.g. a quota error answered with a 200
+        links = self.search({'request_info': {'success': False}})
+        self.assertTrue(search_failed(links))
+        self.assertFalse(SerpCache.objects.exists())
+
+
+@override_settings(ICON_STORE_MAX_BYTES=1000, ICON_STORE_EVICT_INTERVAL=3600.0)
+class EvictionTests(TestCase):
+    """
+    Checks that storing icons aggregates the size of the store only when it may exceed the cap, see
+    `maybe_evict_icons`.
+    """
+
+    def setUp(self):
+        icon_store._eviction.update(at=None, stored=0, headroom=0)
+
+    def store(self, number):
+        return icon_store.store_icon(f'{number:064x}', bytes(400), 'PNG', False)
+
+    def test_eviction(self):
+        self.store(1)
+        # Within the 600 bytes left by the first store: the update_or_create of the icon only, no aggregates
+        with self.assertNumQueries(6):
+            self.store(2)
+        self.store(3)
+        self.assertEqual(sorted(ProcessedIcon.objects.values_list('source_hash', flat=True)),
+                         [f'{2:064x}', f'{3:064x}'])
+
+
+class SingleFlightTests(SimpleTestCase):
+    """
+    Checks what the callers waiting on a leader get, see `single_flight`.
+    """
+
+    def setUp(self):
+        state_dir = tempfile.mkdtemp(prefix='api_tests_')
+        self.addCleanup(shutil.rmtree, state_dir, ignore_errors=True)
+        settings_override = override_settings(LOCK_DIR=state_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_leader_error(self):
+        leading, failing = threading.Event(), threading.Event()
+
+        def resolve():
+            leading.set()
+            failing.wait(5)
+            raise ValueError('resolving failed')
+
+        leader_errors = []
+
+        def lead():
+            try:
+                single_flight('test', resolve, lambda: None, 5)
+            except ValueError as e:
+                leader_errors.append(e)
+
+        leader = threading.Thread(target=lead)
+        leader.start()
+        leading.wait(5)
+        threading.Timer(0.1, failing.set).start()
+        # Raised as the leader's error right away, instead of timing out
+        with self.assertRaisesMessage(ValueError, 'resolving failed'):
+            single_flight('test', lambda: 'resolved', lambda: None, 5)
+        leader.join(5)
+        self.assertEqual(len(leader_errors), 1)
+
+
+class HeadScanTests(SimpleTestCase):
+    """
+    Checks the decoding of streamed pages, see `scan_document_head`.
+    """
+
+    def scan(self, content: bytes, content_type: str, encoding: str):
+        response = mock.Mock(headers={'Content-Type': content_type}, encoding=encoding)
+        response.iter_content.return_value = iter([content])
+        scanner = HeadElementScanner('meta', {'property': 'og:image'}, 'content')
+        return scan_document_head(response, scanner)[0]
+
+    def test_undeclared_charset(self):
+        # requests assumes ISO-8859-1 for text/html without a charset
+        page = '<head><meta property="og:image" content="https://example.com/grün.png"></head>'.encode()
+        self.assertEqual(self.scan(page, 'text/html', 'ISO-8859-1'), ['https://example.com/grün.png'])
+
+    def test_declared_charset(self):
+        page = '<head><meta property="og:image" content="https://example.com/grün.png"></head>'.encode('latin-1')
+        self.assertEqual(self.scan(page, 'text/html; charset=ISO-8859-1', 'ISO-8859-1'),
+                         ['https://example.com/grün.png'])
+
+    def test_meta_charset(self):
+        page = ('<head><meta charset="windows-1252">'
+                '<meta property="og:image" content="https://example.com/grün.png"></head>').encode('cp1252')
+        self.assertEqual(self.scan(page, 'text/html', 'ISO-8859-1'), ['https://example.com/grün.png'])
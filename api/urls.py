@@ -1,8 +1,12 @@
 from django.urls import path
 
 from api.views.icon import IconViewSet
+from api.views.metrics import metrics
 
 urlpatterns = [
-    path('api/download_icon/', IconViewSet.as_view({'post': 'download_icon'}), name='download_icon'),
-    path('api/remove_bg_img/', IconViewSet.as_view({'post': 'remove_bg_img'}), name='remove_bg_img')
+    path('api/download_icon/', IconViewSet.as_view({'get': 'download_icon', 'post': 'download_icon'}), name='download_icon'),
+    path('api/download_icons/', IconViewSet.as_view({'post': 'download_icons'}), name='download_icons'),
+    path('api/icon_jobs/<int:job_id>/', IconViewSet.as_view({'get': 'icon_job'}), name='icon_job'),
+    path('api/remove_bg_img/', IconViewSet.as_view({'post': 'remove_bg_img'}), name='remove_bg_img'),
+    path('api/metrics/', metrics, name='metrics'),
 ]
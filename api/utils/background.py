@@ -0,0 +1,125 @@
+import logging
+from io import BytesIO
+from typing import NamedTuple, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+from scipy import ndimage
+
+logger = logging.getLogger(__name__)
+
+# Backgrounds are only removed if they are light, every channel at least this value
+LIGHT_THRESHOLD = 237
+# Maximum difference of a channel from the background colour for a pixel to count as background
+COLOR_TOLERANCE = 12
+# The same for a noisy background, e.g. with JPEG artifacts or a light gradient
+NOISE_TOLERANCE = 40
+# Alpha values up to this count as transparent
+TRANSPARENT_ALPHA = 16
+# Width of the analysed border band, relative to the shorter side of the image
+BORDER_BAND = 0.03
+
+# Share of the border that must be transparent for the image to count as already cut out
+CUT_OUT_COVERAGE = 0.9
+# Share of the border that must match the background colour for a solid background, removed by colour key
+SOLID_UNIFORMITY = 0.97
+# Share of the border that must be within NOISE_TOLERANCE of the background colour for a noisy background,
+# removed by rembg. Borders below it are not a background, e.g. artwork or photos bleeding to the edges.
+NOISY_UNIFORMITY = 0.9
+
+TRANSPARENT = 'transparent'
+SOLID = 'solid'
+NOISY = 'noisy'
+COMPLEX = 'complex'
+
+
+class BackgroundAnalysis(NamedTuple):
+    """
+    The background of an image, judged from its border band.
+
+    `kind` is one of TRANSPARENT (already cut out), SOLID, NOISY or COMPLEX. `confidence` is between 0 and 1.
+    `color` is the median RGB colour of the opaque border and `light` whether it is a light colour.
+    """
+    kind: str
+    confidence: float
+    color: Optional[Tuple[int, int, int]] = None
+    light: bool = False
+
+    @property
+    def color_key(self) -> bool:
+        """
+        Whether the background is solid and light, and can be removed without rembg, see `remove_color_key`.
+        """
+        return self.kind == SOLID and self.light
+
+    @property
+    def needs_rembg(self) -> bool:
+        """
+        Whether the background is light but not uniform enough to remove by colour key.
+        """
+        return self.kind == NOISY and self.light
+
+
+def border_band(pixels: np.ndarray) -> np.ndarray:
+    """
+    Returns the pixels of the border band of an H x W x C array as an N x C array.
+    """
+    height, width = pixels.shape[:2]
+    band = max(1, round(min(height, width) * BORDER_BAND))
+    return np.concatenate([
+        pixels[:band].reshape(-1, pixels.shape[2]),
+        pixels[-band:].reshape(-1, pixels.shape[2]),
+        pixels[band:-band, :band].reshape(-1, pixels.shape[2]),
+        pixels[band:-band, -band:].reshape(-1, pixels.shape[2]),
+    ])
+
+
+def analyze_background(image: Image.Image) -> BackgroundAnalysis:
+    """
+    Classifies the background of an image from its whole border band: whether it is already transparent,
+    and otherwise how uniform the colour of the opaque border is.
+    """
+    pixels = np.asarray(image.convert('RGBA'))
+    border = border_band(pixels)
+
+    transparent = border[:, 3] <= TRANSPARENT_ALPHA
+    coverage = float(transparent.mean())
+    if coverage >= CUT_OUT_COVERAGE:
+        return BackgroundAnalysis(TRANSPARENT, coverage)
+
+    opaque = border[~transparent, :3].astype(np.int16)
+    color = np.median(opaque, axis=0).astype(np.int16)
+    difference = np.abs(opaque - color).max(axis=1)
+    uniformity = float((difference <= COLOR_TOLERANCE).mean())
+    noisy_uniformity = float((difference <= NOISE_TOLERANCE).mean())
+    color = tuple(int(channel) for channel in color)
+    light = all(channel >= LIGHT_THRESHOLD for channel in color)
+
+    if uniformity >= SOLID_UNIFORMITY:
+        return BackgroundAnalysis(SOLID, uniformity, color, light)
+    if noisy_uniformity >= NOISY_UNIFORMITY:
+        return BackgroundAnalysis(NOISY, noisy_uniformity, color, light)
+    return BackgroundAnalysis(COMPLEX, 1 - noisy_uniformity, color, light)
+
+
+def remove_color_key(image: Image.Image, color: Tuple[int, int, int]) -> bytes:
+    """
+    Makes the background of the given colour transparent where it is connected to the border, leaving the same
+    colour inside the motive untouched, and encodes the result as PNG.
+
+    Pixels close to the colour are marked in a mask padded by one pixel, so a single flood fill from a corner
+    reaches the background all around the image. The fill is done by labelling the connected regions of the
+    mask, which unlike ImageDraw.floodfill runs in C.
+    """
+    pixels = np.asarray(image.convert('RGBA'))
+    matches = np.abs(pixels[:, :, :3].astype(np.int16) - np.array(color, dtype=np.int16)).max(axis=2) \
+        <= COLOR_TOLERANCE
+
+    regions, _ = ndimage.label(np.pad(matches, 1, constant_values=True))
+    background = regions[1:-1, 1:-1] == regions[0, 0]
+
+    pixels = pixels.copy()
+    pixels[background, 3] = 0
+    output = BytesIO()
+    Image.fromarray(pixels, 'RGBA').save(output, format="PNG", optimize=True)
+    return output.getvalue()
@@ -0,0 +1,94 @@
+import fcntl
+import hashlib
+import os
+import time
+from typing import Optional
+
+from django.conf import settings
+
+# Seconds between attempts to take a contended lock
+POLL_INTERVAL = 0.05
+
+
+def lock_path(name: str, suffix: str = '.lock') -> str:
+    """
+    Returns the lock file of the given name in LOCK_DIR, creating the directory if needed.
+    Other files kept along with a lock, e.g. shared state, use the same name with another suffix.
+    """
+    os.makedirs(settings.LOCK_DIR, exist_ok=True)
+    return os.path.join(settings.LOCK_DIR, hashlib.sha256(name.encode()).hexdigest() + suffix)
+
+
+class FileLock:
+    """
+    An exclusive lock shared by all processes of the host, held with flock on a lock file.
+
+    The lock is released when its process dies. With `remove=True` the lock file is deleted on release, which is
+    safe since a process that locked a deleted file notices and retries on the new one.
+    """
+
+    def __init__(self, path: str, remove: bool = False):
+        self.path = path
+        self.remove = remove
+        self.waited = False
+        self._fd = None
+
+    def _try_lock(self, blocking: bool = False) -> bool:
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        try:
+            locked_current_file = os.fstat(fd).st_ino == os.stat(self.path).st_ino
+        except FileNotFoundError:
+            locked_current_file = False
+        if not locked_current_file:
+            # The previous holder deleted the file after we opened it
+            os.close(fd)
+            return False
+        self._fd = fd
+        return True
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        """
+        Takes the lock, waiting at most `timeout` seconds, or indefinitely if None.
+        `waited` tells afterwards whether another process held the lock.
+
+        Without a timeout the wait blocks in flock instead of polling, so it ends as soon as the lock is free.
+
+        Returns:
+            bool: Whether the lock was taken.
+        """
+        expires_at = None if timeout is None else time.monotonic() + timeout
+        self.waited = False
+        while not self._try_lock():
+            self.waited = True
+            if expires_at is None:
+                if self._try_lock(blocking=True):
+                    return True
+                continue
+            if time.monotonic() >= expires_at:
+                return False
+            time.sleep(POLL_INTERVAL)
+        return True
+
+    def release(self) -> None:
+        if self._fd is None:
+            return
+        if self.remove:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
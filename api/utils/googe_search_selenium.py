@@ -1,25 +1,46 @@
 import time
+from typing import Optional
+from django.conf import settings
 from selenium import webdriver
+from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.common.by import By
 from urllib.parse import quote
 
+from api.client.deadline import Deadline, remaining_or
+
 IMG_XPATH = '/html/body/div[2]/c-wiz/div[3]/div[2]/div[3]/div[2]/div[2]/div[2]/div[2]/c-wiz/div/div/div/div/div[3]/div[1]/a/img[1]'
 DIV_IMG_SPAN = "/html/body/div[2]/c-wiz/div[3]/div[1]/div/div/div/div/div[1]/div[1]/span/div[1]/div[1]/div[1]/a[1]/div[1]/img"
 
 
-def fetch_icons(query: str):
-    options = webdriver.ChromeOptions()
-    options.add_argument('--headless=new')
-    wd = webdriver.Chrome(options=options)
+class IconNotFound(str):
+    """
+    Returned by `fetch_icons` when Google Images has no image for the query, as opposed to the error message
+    of a search that failed.
+    """
+
 
+def fetch_icons(query: str, wd: webdriver.Chrome, deadline: Optional[Deadline] = None):
+    """
+    Searches Google Images for the query in the given browser and returns the source of the first image,
+    an `IconNotFound` if there is none, or an error message.
+    The browser is borrowed from the caller, usually from the WebDriver pool, and is not quit here.
+    Every page load is limited to SELENIUM_PAGE_LOAD_TIMEOUT and the time left before the deadline, and the
+    search gives up once the deadline passed.
+    """
     encoded_query = quote(query)
     search_url = f"https://www.google.com/search?safe=off&site=&tbm=isch&source=hp&q={encoded_query}&oq={encoded_query}&gs_l=img"
     thumbnail_results = []
     counter = 0
 
     while len(thumbnail_results) == 0 and counter < 10:
+        if deadline and deadline.expired():
+            return f"Timed out while searching Google Images for {query}"
         wd.delete_all_cookies()  # magic
-        wd.get(search_url)
+        wd.set_page_load_timeout(remaining_or(deadline, settings.SELENIUM_PAGE_LOAD_TIMEOUT))
+        try:
+            wd.get(search_url)
+        except TimeoutException:
+            return f"Timed out while loading Google Images for {query}"
         print(counter)
 
         if "Before you continue to Google" in wd.page_source:
@@ -29,7 +50,7 @@ def fetch_icons(query: str):
                 accept_cookies.click()
 
         if "Make sure all words are spelled correctly" in wd.page_source:
-            return f"No image found for {query}"
+            return IconNotFound(f"No image found for {query}")
 
         try:
             thumbnail_results = wd.find_elements(By.XPATH, DIV_IMG_SPAN)
@@ -40,7 +61,7 @@ def fetch_icons(query: str):
     if len(thumbnail_results) > 0:
         try:
             thumbnail_results[0].click()
-            time.sleep(3)
+            time.sleep(remaining_or(deadline, 3))
         except Exception as e:
             return f"Click failed for image {thumbnail_results[0]} with error {e}"
 
@@ -54,6 +75,6 @@ def fetch_icons(query: str):
             image_result = actual_image.get_attribute('src')
             return image_result
         else:
-            return f"Image not found for {query}"
+            return IconNotFound(f"Image not found for {query}")
     else:
-        return f"No images found for {query}"
+        return IconNotFound(f"No images found for {query}")
@@ -1,26 +1,68 @@
+import hashlib
 import json
-from typing import Any
+from datetime import timedelta
+from typing import Any, Optional
 import logging
 from decouple import config
+from django.conf import settings
+from django.db import IntegrityError
+from django.utils import timezone
 
+from api.client.deadline import Deadline
 from api.client.http_client import HTTPClient
+from api.models.serp_cache import SerpCache
+from api.utils.metrics import count_event
+from api.utils.timing import stage
 
 logger = logging.getLogger(__name__)
 
 logging.basicConfig(filename=config('log_path'), encoding='utf-8', level=logging.WARNING)
 
+NO_RESULTS_ERROR = "No links found in the Google API response"
 
-def fetch_google_search(query: str, output_file: str = None) -> list[dict[str, Any]]:
+
+def normalize_query(query: str) -> str:
+    """
+    Normalizes a search query for caching: surrounding whitespace is stripped, inner whitespace collapsed
+    and the query lowercased.
+    """
+    return ' '.join(query.split()).lower()
+
+
+def serp_cache_key(query: str, gl: str, hl: str, result_blocks: str) -> str:
+    return hashlib.sha256(f"{normalize_query(query)}|{gl}|{hl}|{result_blocks}".encode()).hexdigest()
+
+
+def get_cached_search(cache_key: str) -> Optional[list[dict[str, Any]]]:
+    """
+    Returns the organic results stored for the cache key, or None if there are none younger than SERP_CACHE_TTL_DAYS.
+    """
+    fresh_since = timezone.now() - timedelta(days=settings.SERP_CACHE_TTL_DAYS)
+    entry = SerpCache.objects.filter(cache_key=cache_key, fetched_at__gte=fresh_since).only('results').first()
+    return entry.results if entry else None
+
+
+def search_failed(google_response: list[dict[str, Any]]) -> bool:
+    """
+    Checks whether a response of `fetch_google_search` is an error other than the query having no results.
+    """
+    return bool(google_response) and google_response[0].get("error", NO_RESULTS_ERROR) != NO_RESULTS_ERROR
+
+
+def fetch_google_search(query: str, output_file: str = None, deadline: Deadline = None) -> list[dict[str, Any]]:
     """
     Fetches links from Google search results for a given query using the SpaceSERP API.
 
     This function sends a request to the SpaceSERP API with a specific query and optional page size,
     then processes the JSON response to extract the first search result link. If specified, the result
     is also saved to a JSON file for persistence.
+    The organic results are stored in the SERP cache, keyed by the normalized query, gl, hl and resultBlocks,
+    and served from there for SERP_CACHE_TTL_DAYS without calling SpaceSERP again.
     Args:
         query (str): The search query.
         output_file (str, optional): Path to the file where the search result will be saved.
                                      If None, the result is not written to a file. Defaults to None.
+        deadline (Deadline, optional): The total time budget of the calling request.
 
     Returns:
         list[dict[str, Any]]: A list of dictionaries containing the links and their positions.
@@ -41,16 +83,49 @@ def fetch_google_search(query: str, output_file: str = None) -> list[dict[str, A
         # "pageSize": page_size
     }
 
-    client = HTTPClient(url, retry_count=3, backoff_factor=1.0)
-    response = client.request("GET", params=params)
-    result = response.json()
+    cache_key = serp_cache_key(query, params['gl'], params['hl'], params['resultBlocks'])
+    with stage('db'):
+        links = get_cached_search(cache_key)
+    count_event('serp_cache_miss' if links is None else 'serp_cache_hit')
+
+    if links is None:
+        with stage('serp'):
+            client = HTTPClient(url, retry_count=3, backoff_factor=1.0)
+            response = client.request("GET", params=params, deadline=deadline)
+            if isinstance(response, dict) and "error" in response:
+                logger.error(f"SpaceSERP request failed for {query}.")
+                return [{"error": "Failed to fetch the Google API response"}]
+            try:
+                result = response.json()
+            except ValueError:
+                result = None
+
+        # Without organic results, e.g. a quota error answered with a 200, the search did not happen: it is
+        # neither cached nor taken for a query without results
+        if not isinstance(result, dict) or not isinstance(result.get('organic_results'), list):
+            logger.error(f"SpaceSERP response for {query} carries no organic results.")
+            return [{"error": "Invalid Google API response"}]
 
-    if 'organic_results' in result and result['organic_results']:
         links = []
         for item in result['organic_results']:
             link = item['link']
             position = item['position']
             links.append({'link': link, 'position': position})
+
+        # Empty result lists are cached as well, so a query without results is not paid for again
+        try:
+            SerpCache.objects.update_or_create(cache_key=cache_key, defaults={
+                'query': normalize_query(query)[:400],
+                'gl': params['gl'],
+                'hl': params['hl'],
+                'result_blocks': params['resultBlocks'],
+                'results': links,
+            })
+        except IntegrityError:
+            # Stored concurrently by another request for the same query
+            pass
+
+    if links:
         if output_file:
             try:
                 with open(output_file, 'w') as file:
@@ -61,4 +136,4 @@ def fetch_google_search(query: str, output_file: str = None) -> list[dict[str, A
         return links
     else:
         logger.error("No link found in the API response.")
-        return [{"error": "No links found in the Google API response"}]
+        return [{"error": NO_RESULTS_ERROR}]
@@ -1,75 +1,314 @@
+import codecs
 import logging
+import re
+from html.parser import HTMLParser
 from bs4 import BeautifulSoup
-from typing import Union, List
+from typing import Union, List, Optional, Tuple
 from decouple import config
+from django.conf import settings
 
-from api.client.http_client import HTTPClient
+from api.client.deadline import Deadline
+from api.client.http_client import HTTPClient, conditional_headers, response_validators
+from api.utils.timing import stage
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(filename=config('log_path'), encoding='utf-8', level=logging.WARNING)
 
+STREAM_CHUNK_SIZE = 8192
+# Statuses that tell a page or image is gone for good, as opposed to a failed fetch that may succeed later
+GONE_STATUS_CODES = (404, 410)
+# The charset of a <meta charset="..."> or <meta http-equiv="Content-Type" content="...; charset=..."> tag
+META_CHARSET = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?\s*([a-z0-9_.:-]+)', re.IGNORECASE)
 
-def extract_html_element_attribute(url: str, search_criteria: dict, attribute: str) -> Union[
-    str, List[str], List[dict]]:
+
+class HeadElementScanner(HTMLParser):
+    """
+    Incremental parser collecting an attribute of the elements matching a tag name and exact attribute
+    values. Scanning is done once the document head ends, i.e. on `</head>` or `<body>`.
+    """
+
+    def __init__(self, name: str, attrs: dict, attribute: str):
+        super().__init__(convert_charrefs=True)
+        self.name = name
+        self.attrs = attrs
+        self.attribute = attribute
+        self.values = []
+        self.done = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'body':
+            self.done = True
+            return
+        if tag != self.name:
+            return
+        element_attrs = dict(attrs)
+        if all(element_attrs.get(key) == value for key, value in self.attrs.items()) \
+                and element_attrs.get(self.attribute) is not None:
+            self.values.append(element_attrs[self.attribute])
+
+    def handle_endtag(self, tag):
+        if tag == 'head':
+            self.done = True
+
+
+def _head_scanner(search_criteria: dict, attribute: str) -> Optional[HeadElementScanner]:
+    """
+    Returns a head scanner for simple criteria (a tag name plus exact string attribute values), otherwise None.
+    """
+    name = search_criteria.get('name')
+    attrs = search_criteria.get('attrs', {})
+    if not isinstance(name, str) or set(search_criteria) - {'name', 'attrs'} \
+            or not all(isinstance(value, str) for value in attrs.values()):
+        return None
+    return HeadElementScanner(name, attrs, attribute)
+
+
+def document_encoding(response, first_chunk: bytes) -> str:
+    """
+    Returns the encoding of a streamed page: the charset of its Content-Type header, else the one of a
+    <meta> tag in its first chunk, else UTF-8. Without a declared charset requests assumes ISO-8859-1 for
+    text/html, and sniffing the whole body like `apparent_encoding` would defeat the streaming.
+    """
+    if 'charset' in response.headers.get('Content-Type', '').lower() and response.encoding:
+        return response.encoding
+    match = META_CHARSET.search(first_chunk)
+    if match:
+        try:
+            return codecs.lookup(match.group(1).decode('ascii')).name
+        except LookupError:
+            pass
+    return 'utf-8'
+
+
+def scan_document_head(response, scanner: HeadElementScanner) -> Tuple[List[str], bytes]:
+    """
+    Feeds the streamed response to the scanner until the document head ends or HTML_HEAD_MAX_BYTES were read.
+    The page is decoded as told by `document_encoding`.
+
+    Returns:
+        Tuple[List[str], bytes]: The attribute values found in the head and the raw bytes read so far.
+    """
+    decoder = None
+    chunks = []
+    read = 0
+    for chunk in response.iter_content(STREAM_CHUNK_SIZE):
+        if decoder is None:
+            decoder = codecs.getincrementaldecoder(document_encoding(response, chunk))(errors='replace')
+        chunks.append(chunk)
+        read += len(chunk)
+        scanner.feed(decoder.decode(chunk))
+        if scanner.done or read >= settings.HTML_HEAD_MAX_BYTES:
+            break
+    return scanner.values, b''.join(chunks)
+
+
+def extract_html_element_attribute(url: str, search_criteria: dict, attribute: str,
+                                   deadline: Deadline = None) -> Union[str, List[str], List[dict]]:
     """
     Fetches the HTML content from a URL using the HTTPClient and extracts the value(s) of a specified attribute
     from elements matching given search criteria. Returns human-readable error messages upon failure.
 
+    For simple criteria the page is streamed and only scanned up to the end of the document head, after which
+    the connection is closed. If nothing matches in the head, the rest of the page is read and parsed with
+    BeautifulSoup as before. HTML_STREAMING_EXTRACTION = False always parses the full page.
+
     Args:
         url (str): The URL of the webpage to fetch.
         search_criteria (dict): Criteria to find HTML elements.
         attribute (str): The attribute from which to extract the value.
+        deadline (Deadline, optional): The total time budget of the calling request.
 
     Returns:
         Union[str, List[str], List[dict]]: The value(s) of the specified attribute on success,
         or a list of descriptive error messages.
     """
+    return fetch_page_attribute(url, search_criteria, attribute, deadline)['result']
+
+
+def page_fetch_failed(result) -> bool:
+    """
+    Checks whether an extraction result, see `extract_html_element_attribute`, is a failed page fetch, e.g. a
+    timeout or a 5xx, which may succeed later. A page without the element or one that is gone is an answer.
+    """
+    return isinstance(result, list) and bool(result) and isinstance(result[0], dict) \
+        and 'status_code' in result[0] and result[0]['status_code'] not in GONE_STATUS_CODES
+
+
+def fetch_page_attribute(url: str, search_criteria: dict, attribute: str, deadline: Deadline = None,
+                         validators: Optional[dict] = None) -> dict:
+    """
+    Like `extract_html_element_attribute`, but conditional on the validators of a previous fetch of the page.
+
+    Args:
+        validators (Optional[dict]): The 'etag' and 'last_modified' of the previous response, see
+            `response_validators`. The page is only downloaded again if it changed since.
+
+    Returns:
+        dict: 'not_modified' if the server answered 304; otherwise the extracted 'result' as returned by
+        `extract_html_element_attribute`, and the page's new 'validators'.
+    """
 
     # Create an instance of HTTPClient internally
     client = HTTPClient(url, retry_count=3, backoff_factor=1.5)
 
-    response = client.request("GET")
-    if isinstance(response, dict) and "error" in response:
-        return [{"error": f"Error fetching the page for url {url}."}]  # Adjusted error message for clarity
+    # Scanning the head is bound by reading the stream, so it counts as part of the page fetch
+    with stage('page_fetch'):
+        response = client.request("GET", headers=conditional_headers(**validators) if validators else None,
+                                  deadline=deadline, stream=True, accepted_status_codes=(200, 304))
+        if isinstance(response, dict) and "error" in response:
+            # Adjusted error message for clarity
+            return {'not_modified': False, 'result': [{"error": f"Error fetching the page for url {url}.",
+                                                       "status_code": response.get('status_code')}]}
+
+        page = {'not_modified': response.status_code == 304, 'validators': response_validators(response)}
+        if page['not_modified']:
+            response.close()
+            return page
+
+        try:
+            scanner = _head_scanner(search_criteria, attribute) if search_criteria else None
+            if scanner and settings.HTML_STREAMING_EXTRACTION:
+                values, content = scan_document_head(response, scanner)
+                if values:
+                    page['result'] = values if len(values) > 1 else values[0]
+                    return page
+                # Fall back to parsing the full page, reading the rest of the body from the same response
+                content += b''.join(response.iter_content(STREAM_CHUNK_SIZE))
+            else:
+                content = response.content
+        finally:
+            response.close()
 
-    soup = BeautifulSoup(response.content, 'html.parser')
-    elements = soup.find_all(**search_criteria) if search_criteria else []
+    with stage('og_parse'):
+        soup = BeautifulSoup(content, 'html.parser')
+        elements = soup.find_all(**search_criteria) if search_criteria else []
 
     if not elements:
-        return [{"error": f"No matching elements found for the provided search criteria {search_criteria} with url {url}."}]
+        page['result'] = [{"error": f"No matching elements found for the provided search criteria {search_criteria} with url {url}."}]
+        return page
 
     values = [element.get(attribute) for element in elements if element.has_attr(attribute)]
 
     if not values:
-        return [{"error":f"No elements found with the specified attribute '{attribute}'."}]
+        page['result'] = [{"error":f"No elements found with the specified attribute '{attribute}'."}]
+        return page
 
     # Adjusted to ensure the return type is consistent
-    return values if len(values) > 1 else values[0]
+    page['result'] = values if len(values) > 1 else values[0]
+    return page
+
+
+IMAGE_SIGNATURES = {
+    b'\x89PNG\r\n\x1a\n': 'PNG',
+    b'GIF87a': 'GIF',
+    b'GIF89a': 'GIF',
+    b'\xff\xd8\xff': 'JPEG',
+}
+IMAGE_CONTENT_TYPES = {'image/png', 'image/gif', 'image/jpeg', 'image/jpg', 'image/pjpeg', 'image/webp'}
+# Servers that do not label images properly; these are judged by their magic bytes alone
+GENERIC_CONTENT_TYPES = {'', 'application/octet-stream', 'binary/octet-stream'}
+SNIFF_LENGTH = 12
+
+
+def sniff_image_format(header: bytes) -> Optional[str]:
+    """
+    Identifies a PNG, GIF, JPEG or WEBP image from its first bytes.
+
+    Returns:
+        Optional[str]: The image format, or None if the bytes do not start a supported image.
+    """
+    for signature, image_format in IMAGE_SIGNATURES.items():
+        if header.startswith(signature):
+            return image_format
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'WEBP'
+    return None
+
+
+def read_image_body(response, url: str) -> Optional[bytes]:
+    """
+    Reads a streamed image response, aborting as soon as the headers or the first bytes show an
+    unsupported or oversized image.
+
+    Returns:
+        Optional[bytes]: The image bytes, or None if the image was rejected.
+    """
+    max_bytes = settings.IMAGE_MAX_BYTES
+    content_type = response.headers.get('Content-Type', '').split(';')[0].strip().lower()
+    if content_type not in IMAGE_CONTENT_TYPES and content_type not in GENERIC_CONTENT_TYPES:
+        logger.error(f"Rejected image from {url} with unsupported content type '{content_type}'.")
+        return None
+
+    content_length = response.headers.get('Content-Length', '')
+    if content_length.isdigit() and int(content_length) > max_bytes:
+        logger.error(f"Rejected image from {url} of {content_length} bytes, the limit is {max_bytes}.")
+        return None
 
+    body = bytearray()
+    for chunk in response.iter_content(STREAM_CHUNK_SIZE):
+        body += chunk
+        if len(body) > max_bytes:
+            logger.error(f"Aborted image download from {url} after exceeding {max_bytes} bytes.")
+            return None
+        if len(body) - len(chunk) < SNIFF_LENGTH <= len(body) and not sniff_image_format(bytes(body[:SNIFF_LENGTH])):
+            logger.error(f"Rejected image from {url}, its content is not a PNG, GIF, JPEG or WEBP image.")
+            return None
 
-def download_image(url: str):
+    if len(body) < SNIFF_LENGTH and not sniff_image_format(bytes(body)):
+        logger.error(f"Rejected image from {url}, its content is not a PNG, GIF, JPEG or WEBP image.")
+        return None
+    return bytes(body)
+
+
+def download_image(url: str, deadline: Deadline = None):
     """
     Download an image from the URL using the HTTPClient with up to 3 retries and exponential backoff.
+    The body is streamed and the download is aborted early for images that are not PNG, GIF, JPEG or WEBP,
+    or larger than IMAGE_MAX_BYTES.
 
     Args:
         url (str): The URL of the image to download.
+        deadline (Deadline, optional): The total time budget of the calling request.
 
     Returns:
-        A tuple of (content_type, image_data) if successful, or (None, None) on failure.
+        The image bytes if successful, or None on failure.
+    """
+    return fetch_image(url, deadline)['data']
+
+
+def fetch_image(url: str, deadline: Deadline = None, validators: Optional[dict] = None) -> dict:
+    """
+    Like `download_image`, but also returns the validators of the image, and is conditional on the
+    validators of a previous download if given.
+
+    Returns:
+        dict: 'not_modified' if the server answered 304; otherwise the image bytes as 'data', None on failure,
+        and the image's new 'validators'. A failed download has the 'status_code' of the last response, if any.
     """
 
     client = HTTPClient(url, retry_count=3, backoff_factor=0.5)
+    image = {'not_modified': False, 'data': None, 'validators': {}, 'status_code': None}
 
     try:
-        response = client.request("GET")
-        if response.status_code == 200:
-            return response.content
-        else:
-            logger.error(f"Failed to download image from {url}.")
-            return None
+        with stage('image_download'):
+            response = client.request("GET", headers=conditional_headers(**validators) if validators else None,
+                                      deadline=deadline, stream=True, accepted_status_codes=(200, 304))
+            if isinstance(response, dict):
+                image['status_code'] = response.get('status_code')
+                logger.error(f"Failed to download image from {url}.")
+            elif response.status_code == 200:
+                try:
+                    image['validators'] = response_validators(response)
+                    image['data'] = read_image_body(response, url)
+                finally:
+                    response.close()
+            elif response.status_code == 304:
+                response.close()
+                image['not_modified'] = True
+            else:
+                logger.error(f"Failed to download image from {url}.")
     except AttributeError:
         logger.error(f"Response object does not have the expected attributes.")
-        return None
     except Exception as e:
         logger.error(f"An error occurred: {e}")
-        return None
+    return image
@@ -0,0 +1,94 @@
+import logging
+from datetime import timedelta
+from typing import Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from api.models.icon_job import IconJob
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_job(program_name: str, program_id) -> IconJob:
+    """
+    Queues the resolution of a program's icon, reusing a job for the same program that is still queued or running.
+    """
+    job = IconJob.objects.filter(
+        program_id=str(program_id),
+        program_name=program_name,
+        status__in=[IconJob.PENDING, IconJob.RUNNING],
+    ).first()
+    if job:
+        return job
+    return IconJob.objects.create(program_name=program_name, program_id=str(program_id))
+
+
+def claim_job() -> Optional[IconJob]:
+    """
+    Claims the oldest job that is queued, or running with an expired visibility timeout.
+
+    The job row is locked with SELECT ... FOR UPDATE SKIP LOCKED, so concurrent workers never claim the same job.
+    A claimed job is hidden from other workers for ICON_JOB_VISIBILITY_TIMEOUT seconds; if its worker dies, it
+    becomes claimable again afterwards, until ICON_JOB_MAX_ATTEMPTS is reached.
+
+    Returns:
+        Optional[IconJob]: The claimed job, or None if there is nothing to do.
+    """
+    while True:
+        now = timezone.now()
+        with transaction.atomic():
+            job = IconJob.objects.select_for_update(skip_locked=True).filter(
+                Q(status=IconJob.PENDING) | Q(status=IconJob.RUNNING, locked_until__lt=now)
+            ).order_by('date_added').first()
+            if job is None:
+                return None
+
+            if job.attempts >= settings.ICON_JOB_MAX_ATTEMPTS:
+                job.status = IconJob.FAILED
+                job.error = job.error or "The job timed out."
+                job.save(update_fields=['status', 'error', 'last_updated'])
+                continue
+
+            job.status = IconJob.RUNNING
+            job.attempts += 1
+            job.locked_until = now + timedelta(seconds=settings.ICON_JOB_VISIBILITY_TIMEOUT)
+            job.save(update_fields=['status', 'attempts', 'locked_until', 'last_updated'])
+            return job
+
+
+def _update_claimed(job: IconJob, **fields) -> bool:
+    """
+    Updates the job only if this worker still holds its claim, i.e. it was not reclaimed after a timeout.
+    """
+    fields['last_updated'] = timezone.now()
+    return IconJob.objects.filter(pk=job.pk, status=IconJob.RUNNING, attempts=job.attempts).update(**fields) == 1
+
+
+def complete_job(job: IconJob, icon=None, result: Optional[dict] = None) -> bool:
+    """
+    Marks the job as done. A stored icon is referenced through `icon`; other outcomes are kept in `result`.
+    """
+    return _update_claimed(job, status=IconJob.DONE, icon=icon, result=None if icon else result,
+                           locked_until=None)
+
+
+def fail_job(job: IconJob, error: str) -> bool:
+    """
+    Puts the job back in the queue, or marks it as failed once ICON_JOB_MAX_ATTEMPTS is reached.
+    """
+    if job.attempts >= settings.ICON_JOB_MAX_ATTEMPTS:
+        return _update_claimed(job, status=IconJob.FAILED, error=error, locked_until=None)
+    return _update_claimed(job, status=IconJob.PENDING, error=error, locked_until=None)
+
+
+def delete_finished_jobs() -> int:
+    """
+    Removes done and failed jobs older than ICON_JOB_RETENTION_DAYS.
+    """
+    retained_since = timezone.now() - timedelta(days=settings.ICON_JOB_RETENTION_DAYS)
+    deleted, _ = IconJob.objects.filter(status__in=[IconJob.DONE, IconJob.FAILED],
+                                        last_updated__lt=retained_since).delete()
+    return deleted
@@ -0,0 +1,79 @@
+import logging
+from datetime import timedelta
+from typing import Optional
+
+from django.conf import settings
+from django.utils import timezone
+
+from api.models.icon_miss import IconMiss
+from api.models.program import Program
+
+logger = logging.getLogger(__name__)
+
+
+def recheck_interval(failures: int) -> timedelta:
+    """
+    Returns how long a program is answered from the miss cache after the given number of failed resolutions.
+    """
+    interval = timedelta(hours=settings.ICON_MISS_RECHECK_HOURS) * 2 ** max(failures - 1, 0)
+    return min(interval, timedelta(days=settings.ICON_MISS_MAX_RECHECK_DAYS))
+
+
+def get_icon_miss(program_id, program_name: str) -> Optional[IconMiss]:
+    """
+    Looks up the recorded miss of a program, whether or not it is due for a re-check.
+    Use `IconMiss.recheck_after` to tell if it still applies.
+    """
+    return IconMiss.objects.select_related('program').filter(
+        program__program_id=program_id,
+        program__program_name=program_name,
+    ).first()
+
+
+def record_icon_miss(program_id, program_name: str, reason: str, miss: Optional[IconMiss] = None) -> None:
+    """
+    Records that no icon could be found for the program, doubling the re-check interval of a previous miss.
+
+    Args:
+        program_id: The program ID.
+        program_name (str): The program name.
+        reason (str): Why the resolution failed, returned to clients until the next re-check.
+        miss (Optional[IconMiss]): The previous miss of the program, see `get_icon_miss`.
+    """
+    program = miss.program if miss else Program.objects.filter(program_id=program_id,
+                                                               program_name=program_name).first()
+    if program is None:
+        return
+
+    failures = miss.failures + 1 if miss else 1
+    IconMiss.objects.update_or_create(program=program, defaults={
+        'reason': reason,
+        'failures': failures,
+        'recheck_after': timezone.now() + recheck_interval(failures),
+    })
+    logger.warning(f"No icon found for {program_name} after {failures} attempts: {reason}")
+
+
+def clear_icon_miss(miss: Optional[IconMiss]) -> None:
+    """
+    Forgets a recorded miss once the program's icon was found.
+    """
+    if miss is not None:
+        IconMiss.objects.filter(pk=miss.pk).delete()
+
+
+def invalidate_icon_misses(program_id=None, program_name: Optional[str] = None) -> int:
+    """
+    Removes recorded misses so the programs are searched again on their next request.
+    Without arguments every miss is removed.
+
+    Returns:
+        int: The number of removed misses.
+    """
+    misses = IconMiss.objects.all()
+    if program_id is not None:
+        misses = misses.filter(program__program_id=program_id)
+    if program_name is not None:
+        misses = misses.filter(program__program_name=program_name)
+    deleted, _ = misses.delete()
+    return deleted
@@ -0,0 +1,323 @@
+import hashlib
+import logging
+import threading
+import time
+from datetime import timedelta
+from typing import Optional, Tuple
+
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import F, Q, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from api.models.icon_variant import IconVariant
+from api.models.processed_icon import ProcessedIcon
+from api.models.program import Program
+from api.utils.perceptual_hash import HASH_BANDS, PerceptualHashes, hamming_distance
+
+logger = logging.getLogger(__name__)
+
+# Only refresh last_accessed once per interval so a warm hit stays a single read.
+ACCESS_TOUCH_INTERVAL = timedelta(hours=1)
+# Near duplicates must have the same aspect ratio as the source image, within this share
+SIMILAR_ASPECT_TOLERANCE = 0.05
+# Upper bound of the candidates sharing a dHash band that are compared in full
+SIMILAR_CANDIDATES = 50
+
+# When this process last ran `evict_icons`, the bytes it stored since and the room left under
+# ICON_STORE_MAX_BYTES at that time, see `maybe_evict_icons`
+_eviction = {'at': None, 'stored': 0, 'headroom': 0}
+_eviction_lock = threading.Lock()
+
+
+def source_hash(image_data: bytes) -> str:
+    """
+    Returns the content hash used to address a source image in the store.
+    """
+    return hashlib.sha256(image_data).hexdigest()
+
+
+def _fresh_since():
+    return timezone.now() - timedelta(days=settings.ICON_STORE_TTL_DAYS)
+
+
+def _servable_since():
+    return _fresh_since() - timedelta(days=settings.ICON_STORE_STALE_DAYS)
+
+
+def is_stale(icon: ProcessedIcon) -> bool:
+    """
+    Checks whether the icon is past the store TTL. Stale icons are still served, but should be refreshed.
+    """
+    return icon.last_updated < _fresh_since()
+
+
+def _touch(icon: ProcessedIcon) -> None:
+    now = timezone.now()
+    if icon.last_accessed < now - ACCESS_TOUCH_INTERVAL:
+        ProcessedIcon.objects.filter(pk=icon.pk).update(last_accessed=now)
+        icon.last_accessed = now
+
+
+def get_program_icon(program_id, program_name: str) -> Optional[ProcessedIcon]:
+    """
+    Looks up the processed icon linked to a program. Stale icons, see `is_stale`, are returned as well
+    during ICON_STORE_STALE_DAYS.
+
+    Args:
+        program_id: The program ID.
+        program_name (str): The program name.
+
+    Returns:
+        Optional[ProcessedIcon]: The stored icon, or None on a miss.
+    """
+    icon = ProcessedIcon.objects.filter(
+        programs__program_id=program_id,
+        programs__program_name=program_name,
+        last_updated__gte=_servable_since(),
+    ).first()
+    if icon:
+        _touch(icon)
+    return icon
+
+
+def get_program_icons(programs: list) -> dict:
+    """
+    Looks up the processed icons of many programs with a single query.
+
+    Args:
+        programs (list): (program_id, program_name) pairs.
+
+    Returns:
+        dict: The stored icons keyed by (str(program_id), program_name), for the programs that have one.
+        Stale icons are included, as in `get_program_icon`.
+    """
+    if not programs:
+        return {}
+
+    condition = Q()
+    for program_id, program_name in programs:
+        try:
+            condition |= Q(program_id=int(str(program_id)), program_name=program_name)
+        except ValueError:
+            # Numeric but not an integer, such a program cannot be stored
+            continue
+    if not condition:
+        return {}
+
+    stored_icons = {}
+    for program in Program.objects.filter(condition, icon__last_updated__gte=_servable_since()).select_related('icon'):
+        _touch(program.icon)
+        stored_icons[(str(program.program_id), program.program_name)] = program.icon
+    return stored_icons
+
+
+def get_icon_by_source(image_hash: str, rm_bg: bool, rembg_model: str = '') -> Optional[ProcessedIcon]:
+    """
+    Looks up a processed icon by the hash of its source image, the background removal flag and the rembg model,
+    '' for REMBG_MODEL.
+    """
+    icon = ProcessedIcon.objects.filter(
+        source_hash=image_hash,
+        rm_bg=rm_bg,
+        rembg_model=rembg_model,
+        last_updated__gte=_fresh_since(),
+    ).first()
+    if icon:
+        _touch(icon)
+    return icon
+
+
+def get_similar_icon(hashes: PerceptualHashes, source_size: Tuple[int, int],
+                     rembg_model: str = '') -> Optional[ProcessedIcon]:
+    """
+    Looks up a processed icon, with the background removed, whose source image is a near duplicate of the given
+    one: both its dHash and aHash within ICON_DEDUP_MAX_DISTANCE bits, the same aspect ratio, and at least the
+    same size, so that a mirror's small copy of a logo is never served in place of a larger one.
+
+    Candidates are found by equal dHash bands, which finds every dHash within HASH_BANDS - 1 bits.
+
+    Args:
+        hashes (PerceptualHashes): The hashes of the source image.
+        source_size (Tuple[int, int]): Width and height of the source image.
+        rembg_model (str): The rembg model the icon was processed with, '' for REMBG_MODEL.
+
+    Returns:
+        Optional[ProcessedIcon]: The closest stored icon, or None.
+    """
+    max_distance = settings.ICON_DEDUP_MAX_DISTANCE
+    if max_distance < 0:
+        return None
+
+    width, height = source_size
+    bands = Q()
+    for band, value in enumerate(hashes.bands):
+        bands |= Q(**{f'dhash_band{band}': value})
+    candidates = ProcessedIcon.objects.filter(
+        bands,
+        rm_bg=True,
+        rembg_model=rembg_model,
+        last_updated__gte=_fresh_since(),
+        source_width__gte=width,
+        source_height__gte=height,
+    ).order_by('-last_accessed').values_list('pk', 'source_ahash', 'source_dhash', 'source_width',
+                                             'source_height')[:SIMILAR_CANDIDATES]
+
+    best = None
+    for pk, ahash, dhash, candidate_width, candidate_height in candidates:
+        if abs(candidate_width / candidate_height - width / height) > SIMILAR_ASPECT_TOLERANCE * width / height:
+            continue
+        distance = hamming_distance(int(dhash, 16), hashes.dhash)
+        if distance > max_distance or hamming_distance(int(ahash, 16), hashes.ahash) > max_distance:
+            continue
+        if best is None or distance < best[1]:
+            best = (pk, distance)
+    if best is None:
+        return None
+
+    icon = ProcessedIcon.objects.filter(pk=best[0]).first()
+    if icon:
+        _touch(icon)
+    return icon
+
+
+def link_program_icon(program: Optional[Program], icon: ProcessedIcon) -> None:
+    """
+    Points the program at the given processed icon so later requests hit the store directly.
+    """
+    if program is not None and program.icon_id != icon.pk:
+        Program.objects.filter(pk=program.pk).update(icon=icon)
+        program.icon = icon
+
+
+def store_icon(image_hash: str, image_data: bytes, image_format: str, rm_bg: bool,
+               program: Optional[Program] = None, source_url: str = '',
+               validators: Optional[dict] = None, hashes: Optional[PerceptualHashes] = None,
+               source_size: Optional[Tuple[int, int]] = None, rembg_model: str = '') -> ProcessedIcon:
+    """
+    Saves the final icon bytes in the store and links them to the program, evicting old entries if needed,
+    see `maybe_evict_icons`.
+
+    Args:
+        image_hash (str): Hash of the source image, see `source_hash`.
+        image_data (bytes): The processed image bytes returned to the client.
+        image_format (str): The image format of the processed bytes, e.g. "PNG".
+        rm_bg (bool): Whether background removal was requested.
+        program (Optional[Program]): The program the icon belongs to.
+        source_url (str): The URL the source image was downloaded from, if any.
+        validators (Optional[dict]): The 'etag' and 'last_modified' of the source image download.
+        hashes (Optional[PerceptualHashes]): The perceptual hashes of the source image, see `get_similar_icon`.
+        source_size (Optional[Tuple[int, int]]): Width and height of the source image.
+        rembg_model (str): The rembg model requested for the icon, '' for REMBG_MODEL.
+
+    Returns:
+        ProcessedIcon: The stored icon.
+    """
+    defaults = {
+        'image_data': image_data,
+        'image_format': image_format,
+        'size': len(image_data),
+        'last_accessed': timezone.now(),
+        'source_url': source_url[:4000],
+        'source_etag': (validators or {}).get('etag', ''),
+        'source_last_modified': (validators or {}).get('last_modified', ''),
+        'source_ahash': f'{hashes.ahash:016x}' if hashes else '',
+        'source_dhash': f'{hashes.dhash:016x}' if hashes else '',
+        'source_width': source_size[0] if source_size else None,
+        'source_height': source_size[1] if source_size else None,
+    }
+    bands = hashes.bands if hashes else [None] * HASH_BANDS
+    for band, value in enumerate(bands):
+        defaults[f'dhash_band{band}'] = value
+    try:
+        icon, _ = ProcessedIcon.objects.update_or_create(source_hash=image_hash, rm_bg=rm_bg,
+                                                         rembg_model=rembg_model, defaults=defaults)
+    except IntegrityError:
+        # Another worker stored the same source image concurrently
+        icon = ProcessedIcon.objects.get(source_hash=image_hash, rm_bg=rm_bg, rembg_model=rembg_model)
+
+    link_program_icon(program, icon)
+    maybe_evict_icons(len(image_data))
+    return icon
+
+
+def revalidate_icon(icon: ProcessedIcon, validators: Optional[dict] = None) -> None:
+    """
+    Marks a stale icon as fresh again, after its source was found to be unchanged.
+    New validators of the source image, if the server sent the full image again, are kept as well.
+    """
+    fields = {'last_updated': timezone.now()}
+    if validators:
+        fields.update(source_etag=validators['etag'], source_last_modified=validators['last_modified'])
+    ProcessedIcon.objects.filter(pk=icon.pk).update(**fields)
+    icon.last_updated = fields['last_updated']
+
+
+def claim_icon_refresh(program_id, program_name: str, seconds: float) -> bool:
+    """
+    Claims the refresh of a program's stale icon for the given number of seconds. The claim is a single
+    conditional UPDATE, so only one request across all processes wins it.
+
+    Returns:
+        bool: Whether the caller should run the refresh.
+    """
+    now = timezone.now()
+    return Program.objects.filter(
+        Q(refresh_claimed_until__isnull=True) | Q(refresh_claimed_until__lt=now),
+        program_id=program_id,
+        program_name=program_name,
+    ).update(refresh_claimed_until=now + timedelta(seconds=seconds)) > 0
+
+
+def maybe_evict_icons(stored_bytes: int) -> None:
+    """
+    Counts the bytes just stored, and runs `evict_icons` if ICON_STORE_EVICT_INTERVAL seconds passed since
+    this process last did, or if the bytes it stored since may have filled the room that was left. The size
+    of the whole store is not aggregated on every store.
+    """
+    now = time.monotonic()
+    with _eviction_lock:
+        _eviction['stored'] += stored_bytes
+        if _eviction['at'] is not None and now - _eviction['at'] < settings.ICON_STORE_EVICT_INTERVAL \
+                and _eviction['stored'] < _eviction['headroom']:
+            return
+        _eviction.update(at=now, stored=0)
+    evict_icons()
+
+
+def evict_icons() -> int:
+    """
+    Removes entries older than the store TTL and the stale period, then the least recently accessed entries
+    until the store, including the icon variants, is back under ICON_STORE_MAX_BYTES.
+
+    Returns:
+        int: The number of evicted icons.
+    """
+    _, deleted_by_model = ProcessedIcon.objects.filter(last_updated__lt=_servable_since()).delete()
+    # Not counting the variants deleted along with the icons
+    evicted = deleted_by_model.get(ProcessedIcon._meta.label, 0)
+
+    total_size = (ProcessedIcon.objects.aggregate(total=Sum('size'))['total'] or 0) \
+        + (IconVariant.objects.aggregate(total=Sum('size'))['total'] or 0)
+    overflow = total_size - settings.ICON_STORE_MAX_BYTES
+    if overflow <= 0:
+        _eviction['headroom'] = -overflow
+        return evicted
+
+    # An icon's variants are deleted along with it
+    icons = ProcessedIcon.objects.annotate(
+        total_size=F('size') + Coalesce(Sum('variants__size'), 0),
+    ).order_by('last_accessed').values_list('pk', 'total_size')
+    to_delete = []
+    for pk, size in icons.iterator():
+        if overflow <= 0:
+            break
+        to_delete.append(pk)
+        overflow -= size
+    _eviction['headroom'] = max(0, -overflow)
+
+    _, deleted_by_model = ProcessedIcon.objects.filter(pk__in=to_delete).delete()
+    deleted = deleted_by_model.get(ProcessedIcon._meta.label, 0)
+    logger.info(f"Evicted {deleted} processed icons to stay under {settings.ICON_STORE_MAX_BYTES} bytes")
+    return evicted + deleted
@@ -0,0 +1,66 @@
+import logging
+from io import BytesIO
+from typing import Optional
+
+from django.db import IntegrityError
+from PIL import Image
+
+from api.models.icon_variant import IconVariant
+from api.models.processed_icon import ProcessedIcon
+from api.utils.timing import stage
+
+logger = logging.getLogger(__name__)
+
+VARIANT_FORMATS = ["PNG", "WEBP"]
+# Downscale in steps of at least this factor: JPEG sources are decoded at a reduced scale (draft) and other
+# images are shrunk with the fast box reduce() before the final high quality resample
+REDUCING_GAP = 2.0
+WEBP_QUALITY = 90
+
+
+def render_variant(image_data: bytes, dimension: int, image_format: str) -> bytes:
+    """
+    Downscales an encoded image to fit in `dimension` x `dimension` pixels, keeping its aspect ratio,
+    and encodes it as optimized PNG or WEBP. Images are never upscaled; a dimension of 0 only re-encodes.
+    """
+    with Image.open(BytesIO(image_data)) as image:
+        if dimension:
+            image.thumbnail((dimension, dimension), Image.Resampling.LANCZOS, reducing_gap=REDUCING_GAP)
+        else:
+            image.load()
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA')
+
+        output = BytesIO()
+        if image_format == "WEBP":
+            image.save(output, format="WEBP", quality=WEBP_QUALITY, method=6)
+        else:
+            image.save(output, format="PNG", optimize=True)
+        return output.getvalue()
+
+
+def get_icon_variant(icon: ProcessedIcon, dimension: int, image_format: str) -> Optional[IconVariant]:
+    """
+    Returns the stored variant of the processed icon at the given dimension and format, rendering and storing
+    it on first use. Stored variants are served as they are, without decoding the icon again.
+
+    Returns:
+        Optional[IconVariant]: The variant, or None if the icon could not be rendered.
+    """
+    variant = IconVariant.objects.filter(icon=icon, dimension=dimension, image_format=image_format).first()
+    if variant:
+        return variant
+
+    try:
+        with stage('encode'):
+            image_data = render_variant(bytes(icon.image_data), dimension, image_format)
+    except Exception as e:
+        logger.error(f"Rendering the {dimension}px {image_format} variant of icon {icon.pk} failed", exc_info=e)
+        return None
+
+    try:
+        return IconVariant.objects.create(icon=icon, dimension=dimension, image_format=image_format,
+                                          image_data=image_data, size=len(image_data))
+    except IntegrityError:
+        # Another worker rendered the same variant concurrently
+        return IconVariant.objects.get(icon=icon, dimension=dimension, image_format=image_format)
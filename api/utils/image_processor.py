@@ -1,66 +1,167 @@
 import logging
 import base64
-import tempfile
+import hashlib
 from io import BytesIO
 
-from rembg import remove
 from rest_framework import status
 
-from api.utils.html_content_parser import download_image
+from api.utils.html_content_parser import fetch_image
 from PIL import Image
 from decouple import config
-from django.http import JsonResponse
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from api.utils.background import analyze_background, remove_color_key
 from api.utils.rembg import rembg
-import re
+from api.utils.icon_store import source_hash, get_icon_by_source, get_similar_icon, store_icon, link_program_icon
+from api.utils.metrics import count_event
+from api.utils.perceptual_hash import perceptual_hashes
+from api.utils.timing import stage
 
 # Configure logging
 logging.basicConfig(filename=config('log_path'), encoding='utf-8', level=logging.WARNING)
 
+SUPPORTED_FORMATS = ["PNG", "GIF", "JPG", "JPEG", "WEBP"]
+CONTENT_TYPES = {"PNG": "image/png", "GIF": "image/gif", "JPG": "image/jpeg", "JPEG": "image/jpeg",
+                 "WEBP": "image/webp"}
 
-def process_icon_image(image_url, rm_bg=True):
+
+def icon_data_uri(icon):
+    """
+    Returns the stored icon as a base64 encoded data URI.
+    """
+    base64_string = base64.b64encode(icon.image_data).decode('utf-8')
+    return f'data:image/{icon.image_format};base64,{base64_string}'
+
+
+def icon_response(icon):
+    """
+    Builds the JSON response carrying the stored icon as a base64 encoded data URI.
+    The stored icon is attached to the response as `processed_icon`.
+    """
+    response = JsonResponse({'image_data': icon_data_uri(icon)}, status=status.HTTP_200_OK)
+    response.processed_icon = icon
+    return response
+
+
+def icon_etag(icon):
+    """
+    Returns the strong ETag of the stored icon, built from the hash of its bytes.
+    """
+    return '"%s"' % hashlib.sha256(icon.image_data).hexdigest()
+
+
+def raw_icon_response(request, icon):
+    """
+    Responds with the raw bytes of the stored icon, with its Content-Type, a strong ETag and Cache-Control.
+    A GET whose If-None-Match matches the ETag gets a 304 without a body.
+    The stored icon is attached to the response as `processed_icon`.
+    """
+    etag = icon_etag(icon)
+    response = None
+    if request.method in ('GET', 'HEAD'):
+        response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(bytes(icon.image_data),
+                                content_type=CONTENT_TYPES.get(icon.image_format, 'application/octet-stream'))
+    response['ETag'] = etag
+    response['Cache-Control'] = f'public, max-age={settings.ICON_CACHE_MAX_AGE}'
+    # The same URL responds with JSON unless raw bytes are asked for
+    patch_vary_headers(response, ['Accept'])
+    response.processed_icon = icon
+    return response
+
+
+def process_icon_data(image_data, source, rm_bg=True, program=None, deadline=None, source_url='',
+                      validators=None, rembg_model=None):
+    """
+    Processes an encoded image held in memory and responds with it as a base64 encoded data URI.
+    Shared by `process_icon_image` and `process_icon_base64`; nothing is written to disk.
+
+    A source image already processed, by content hash, or a near duplicate of one, by perceptual hash, e.g. the
+    same vendor logo from a mirror, reuses the stored icon instead of being processed again.
+
+    Args:
+        image_data (bytes): The encoded source image.
+        source (str): Describes where the image came from, used in error messages.
+        rm_bg (bool): Whether to remove a light background, see `analyze_background`.
+        program (Program, optional): The program the processed icon is stored for.
+        deadline (Deadline, optional): The total time budget of the calling request.
+        source_url (str, optional): The URL the image was downloaded from, kept to revalidate the icon.
+        validators (dict, optional): The 'etag' and 'last_modified' of the download.
+        rembg_model (str, optional): The rembg model to remove the background with, defaults to REMBG_MODEL.
+            Icons of other models are stored apart and only reused for requests of the same model.
+    """
+    image_hash = source_hash(image_data)
+    # The store key of the model, '' for REMBG_MODEL
+    model_key = rembg_model if rembg_model and rembg_model != settings.REMBG_MODEL else ''
+    with stage('db'):
+        stored_icon = get_icon_by_source(image_hash, bool(rm_bg), model_key)
+    if stored_icon:
+        count_event('source_dedup_hit')
+        link_program_icon(program, stored_icon)
+        return icon_response(stored_icon)
+
+    with Image.open(BytesIO(image_data)) as icon:
+        icon_format = icon.format
+        with stage('decode'):
+            icon.load()
+
+        if icon_format not in SUPPORTED_FORMATS:
+            return JsonResponse({'error': f"The file format '{icon_format}' is not supported for {source}."},
+                                status=status.HTTP_200_OK)
+
+        hashes = None
+        if rm_bg:
+            with stage('dedup'):
+                hashes = perceptual_hashes(icon)
+                similar_icon = get_similar_icon(hashes, icon.size, model_key) if hashes else None
+            if similar_icon:
+                count_event('similar_dedup_hit')
+                link_program_icon(program, similar_icon)
+                return icon_response(similar_icon)
+
+        source_size = icon.size
+        icon_data = image_data
+        if rm_bg:
+            with stage('decode'):
+                background = analyze_background(icon)
+            if background.color_key:
+                # A solid light background is cut out directly, without model inference
+                count_event('color_key')
+                with stage('encode'):
+                    icon_data = remove_color_key(icon, background.color)
+                icon_format = "PNG"
+            elif background.needs_rembg:
+                count_event('rembg')
+                with stage('rembg'):
+                    processed_image = rembg(image_data, timeout=deadline.remaining() if deadline else None,
+                                            model_name=rembg_model)
+                if not processed_image:
+                    # Not stored, so the next request tries rembg again instead of getting the unprocessed image
+                    return JsonResponse({'error': f"Removing the background failed for {source}."},
+                                        status=status.HTTP_200_OK)
+                # rembg always encodes its output as PNG
+                icon_data = processed_image
+                icon_format = "PNG"
+
+    with stage('db'):
+        stored_icon = store_icon(image_hash, icon_data, icon_format, bool(rm_bg), program, source_url,
+                                 validators, hashes, source_size, model_key)
+    return icon_response(stored_icon)
+
+
+def process_icon_image(image_url, rm_bg=True, program=None, deadline=None, rembg_model=None):
     """
     Process and convert the given image URL to a base64 encoded data URI, with error handling.
+    Processed icons are kept in the icon store, keyed by the hash of the downloaded image.
     """
     try:
-        image_data = download_image(image_url)
-
-        if image_data:
-            # Save the downloaded image to a temporary file
-            temp_file = tempfile.NamedTemporaryFile(delete=False)
-            temp_file_path = temp_file.name
-            with open(temp_file_path, 'wb') as file:
-                file.write(image_data)
-
-            icon = Image.open(temp_file_path)
-            icon_format = icon.format
-
-            if icon_format not in ["PNG", "GIF", "JPG", "JPEG", "WEBP"]:
-                return JsonResponse({
-                    'error': f"The file format '{icon_format}' is not supported for the url {image_url}."},
-                    status=status.HTTP_200_OK)
-
-            if hasattr(icon, 'info') and 'transparency' in icon.info:
-                base64_encoded_data = base64.b64encode(image_data)
-            else:
-                if not icon.mode == "RGBA":
-                    icon = icon.convert('RGBA')
-
-                pixels = icon.getpixel((1, 1))
-                print(pixels)
-
-                if pixels[0] >= 237 and pixels[1] >= 237 and pixels[2] >= 237 and rm_bg:
-                    processed_image = rembg(temp_file_path)
-                    if processed_image:
-                        base64_encoded_data = base64.b64encode(processed_image)
-                    else:
-                        base64_encoded_data = base64.b64encode(image_data)
-                else:
-                    base64_encoded_data = base64.b64encode(image_data)
-
-            base64_string = base64_encoded_data.decode('utf-8')
-            image_data_uri = f'data:image/{icon_format};base64,{base64_string}'
-            icon.close()
-            return JsonResponse({'image_data': image_data_uri}, status=status.HTTP_200_OK)
+        image = fetch_image(image_url, deadline)
+
+        if image['data']:
+            return process_icon_data(image['data'], f"the url {image_url}", rm_bg, program, deadline, image_url,
+                                     image['validators'], rembg_model)
         else:
             return JsonResponse({'error': f'Failed to download icon from {image_url}.'},
                                 status=status.HTTP_200_OK)
@@ -72,36 +173,16 @@ def process_icon_image(image_url, rm_bg=True):
             status=status.HTTP_200_OK)
 
 
-def process_icon_base64(base64_icon, program_name, rm_bg=True):
+def process_icon_base64(base64_icon, program_name, rm_bg=True, program=None, deadline=None):
+    """
+    Process the given base64 data URI, e.g. from the Selenium fallback, the same way as a downloaded image.
+    """
     try:
-        base64_str = re.search(r'base64,(.*)', base64_icon).group(1)
-        im = Image.open(BytesIO(base64.b64decode(base64_str)))
-        img_format = im.format
-
-        if img_format not in ["PNG", "GIF", "JPG", "JPEG", "WEBP"]:
-            return {'error': f"The file format '{img_format}' is not supported for {program_name}."}
-
-        if hasattr(im, 'info') and 'transparency' in im.info:
-            image_data_uri = f'data:image/{img_format};base64,{base64_str}'
-            return JsonResponse({'image_data': image_data_uri}, status=status.HTTP_200_OK)
-        else:
-            if not im.mode == "RGBA":
-                im = im.convert('RGBA')
-
-                pixels = im.getpixel((1, 1))
-                print(pixels)
-
-                if pixels[0] >= 237 and pixels[1] >= 237 and pixels[2] >= 237 and rm_bg:
-                    rm_img = remove(base64.b64decode(base64_str))
-                    base64_encoded_data = base64.b64encode(rm_img)
-                    base64_string = base64_encoded_data.decode('utf-8')
-                    image_data_uri = f'data:image/{img_format};base64,{base64_string}'
-                    return JsonResponse({'image_data': image_data_uri}, status=status.HTTP_200_OK)
-                else:
-                    image_data_uri = f'data:image/{img_format};base64,{base64_str}'
-                    return JsonResponse({'image_data': image_data_uri}, status=status.HTTP_200_OK)
+        image_data = base64.b64decode(base64_icon[base64_icon.index('base64,') + len('base64,'):])
+        return process_icon_data(image_data, program_name, rm_bg, program, deadline)
 
     except Exception as e:
-        JsonResponse(
+        logging.exception(f"Error processing the base64 icon for {program_name}: {e}")
+        return JsonResponse(
             {'error': f'An error occurred while processing the icon for {program_name}.'},
             status=status.HTTP_200_OK)
@@ -0,0 +1,250 @@
+import atexit
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+from django.conf import settings
+
+from api.client.http_client import pool_stats
+from api.utils.file_lock import FileLock, lock_path
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds of the duration histogram buckets, the last bucket is +Inf
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+STAGE_DURATION = 'icon_stage_duration_seconds'
+REQUEST_DURATION = 'icon_request_duration_seconds'
+EVENTS = 'icon_events_total'
+POOL_CHECKOUTS = 'http_pool_checkouts_total'
+
+# The metrics of the processes that exited, folded into one file, see `_fold_exited_processes`
+AGGREGATE_FILE = 'aggregate.json'
+
+METRIC_HELP = {
+    STAGE_DURATION: ('histogram', "Time spent in each stage of resolving and processing icons."),
+    REQUEST_DURATION: ('histogram', "Time to respond to a request, per endpoint."),
+    EVENTS: ('counter', "Cache hits and misses, fallbacks and other outcomes of resolving icons."),
+    POOL_CHECKOUTS: ('counter', "Outbound HTTP connection checkouts per host, reusing a pooled connection or not."),
+}
+
+
+def _series(name: str, labels: Dict[str, str]) -> str:
+    return json.dumps([name, sorted(labels.items())])
+
+
+class _Registry:
+    """
+    The metrics of this process, flushed to a file of its own in METRICS_DIR, named `<pid>-<time>.json`,
+    see `flush_metrics`.
+    """
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.path = os.path.join(settings.METRICS_DIR, f"{self.pid}-{time.time_ns()}.json")
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.flushed_at = 0.0
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def _get_registry() -> _Registry:
+    # Recreated after a fork, so that a gunicorn worker does not report the metrics of the master again
+    global _registry
+    pid = os.getpid()
+    if _registry is None or _registry.pid != pid:
+        with _registry_lock:
+            if _registry is None or _registry.pid != pid:
+                _registry = _Registry()
+    return _registry
+
+
+def observe(name: str, labels: Dict[str, str], seconds: float) -> None:
+    """
+    Adds a duration to a histogram.
+    """
+    registry = _get_registry()
+    with registry.lock:
+        histogram = registry.histograms.setdefault(_series(name, labels), {
+            'buckets': [0] * (len(DURATION_BUCKETS) + 1), 'sum': 0.0, 'count': 0})
+        bucket = next((index for index, bound in enumerate(DURATION_BUCKETS) if seconds <= bound),
+                      len(DURATION_BUCKETS))
+        histogram['buckets'][bucket] += 1
+        histogram['sum'] += seconds
+        histogram['count'] += 1
+
+
+def count_event(event: str, amount: int = 1) -> None:
+    """
+    Increments the counter of an event, e.g. 'store_hit' or 'selenium_fallback'.
+    """
+    registry = _get_registry()
+    series = _series(EVENTS, {'event': event})
+    with registry.lock:
+        registry.counters[series] = registry.counters.get(series, 0) + amount
+
+
+def flush_metrics(force: bool = False) -> None:
+    """
+    Writes the metrics of this process to its file, at most every METRICS_FLUSH_INTERVAL seconds unless forced.
+    """
+    registry = _get_registry()
+    now = time.monotonic()
+    if not force and now - registry.flushed_at < settings.METRICS_FLUSH_INTERVAL:
+        return
+    registry.flushed_at = now
+
+    with registry.lock:
+        counters = dict(registry.counters)
+        histograms = {series: dict(histogram, buckets=list(histogram['buckets']))
+                      for series, histogram in registry.histograms.items()}
+    for host, checkouts in pool_stats().items():
+        counters[_series(POOL_CHECKOUTS, {'host': host, 'result': 'hit'})] = checkouts['hits']
+        counters[_series(POOL_CHECKOUTS, {'host': host, 'result': 'miss'})] = checkouts['misses']
+
+    try:
+        _write_metrics(registry.path, {'counters': counters, 'histograms': histograms})
+    except OSError as e:
+        logger.error(f"Writing the metrics to {registry.path} failed", exc_info=e)
+
+
+atexit.register(flush_metrics, True)
+
+
+def _write_metrics(path: str, metrics: dict) -> None:
+    # Replaced at once, so a reader never sees a partly written file
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'w', encoding='utf-8') as metrics_file:
+        json.dump(metrics, metrics_file)
+    os.replace(temporary_path, path)
+
+
+def _read_metrics(path: str) -> Optional[dict]:
+    try:
+        with open(path, encoding='utf-8') as metrics_file:
+            return json.load(metrics_file)
+    except (OSError, ValueError):
+        return None
+
+
+def _add_metrics(total: dict, metrics: dict) -> None:
+    """
+    Adds the counters and histograms of a metrics file to `total`.
+    """
+    counters = total.setdefault('counters', {})
+    histograms = total.setdefault('histograms', {})
+    for series, value in metrics['counters'].items():
+        counters[series] = counters.get(series, 0) + value
+    for series, histogram in metrics['histograms'].items():
+        total_histogram = histograms.setdefault(series, {'buckets': [0] * (len(DURATION_BUCKETS) + 1),
+                                                         'sum': 0.0, 'count': 0})
+        total_histogram['buckets'] = [a + b for a, b in zip(total_histogram['buckets'], histogram['buckets'])]
+        total_histogram['sum'] += histogram['sum']
+        total_histogram['count'] += histogram['count']
+
+
+def _process_exited(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        # Alive, but owned by another user
+        return False
+    return False
+
+
+def _fold_exited_processes() -> None:
+    """
+    Adds the metrics files of the processes that exited to the aggregate file and removes them, so METRICS_DIR
+    holds one file per live process plus the aggregate. Must be called under the metrics lock.
+
+    The aggregate lists the files folded into it, so a file whose removal was cut short is not counted twice.
+    """
+    aggregate_path = os.path.join(settings.METRICS_DIR, AGGREGATE_FILE)
+    aggregate = _read_metrics(aggregate_path) or {'counters': {}, 'histograms': {}, 'folded': []}
+    folded = set(aggregate.get('folded', []))
+
+    exited, newly_folded = [], []
+    for path in glob.glob(os.path.join(settings.METRICS_DIR, '*-*.json*')):
+        name = os.path.basename(path)
+        pid = name.split('-', 1)[0]
+        if not pid.isdigit() or not _process_exited(int(pid)):
+            continue
+        exited.append(path)
+        # A temporary file left by a process that died while flushing is incomplete, its last flush counts
+        if name.endswith('.json') and name not in folded:
+            metrics = _read_metrics(path)
+            if metrics:
+                _add_metrics(aggregate, metrics)
+            newly_folded.append(name)
+
+    if newly_folded:
+        # Names whose files are gone cannot be counted again, so they are dropped
+        aggregate['folded'] = [name for name in folded
+                               if os.path.exists(os.path.join(settings.METRICS_DIR, name))] + newly_folded
+        _write_metrics(aggregate_path, aggregate)
+    for path in exited:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels: list) -> str:
+    pairs = [f'{key}="{_escape(value)}"' for key, value in labels]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def render_metrics() -> str:
+    """
+    Sums up the metrics files of the live processes and the aggregate of those that exited since, so counters
+    never go down, and renders them in the Prometheus text format. METRICS_DIR should be emptied on deploy.
+    """
+    flush_metrics(force=True)
+
+    total = {'counters': {}, 'histograms': {}}
+    # Folding and summing under one lock, so a concurrent scrape never misses a file between the two
+    with FileLock(lock_path('metrics')):
+        try:
+            _fold_exited_processes()
+        except OSError as e:
+            logger.error(f"Folding the metrics of exited processes in {settings.METRICS_DIR} failed", exc_info=e)
+        for path in glob.glob(os.path.join(settings.METRICS_DIR, '*.json')):
+            metrics = _read_metrics(path)
+            if metrics:
+                _add_metrics(total, metrics)
+    counters, histograms = total['counters'], total['histograms']
+
+    lines = []
+    for name, (metric_type, help_text) in METRIC_HELP.items():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+        for series in sorted(counters):
+            series_name, labels = json.loads(series)
+            if series_name == name:
+                lines.append(f"{name}{_labels(labels)} {counters[series]}")
+        for series in sorted(histograms):
+            series_name, labels = json.loads(series)
+            if series_name != name:
+                continue
+            histogram = histograms[series]
+            cumulative = 0
+            for bound, bucket_count in zip(list(DURATION_BUCKETS) + ['+Inf'], histogram['buckets']):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_labels(labels + [['le', bound]])} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {histogram['sum']}")
+            lines.append(f"{name}_count{_labels(labels)} {histogram['count']}")
+    return "\n".join(lines) + "\n"
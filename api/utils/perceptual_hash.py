@@ -0,0 +1,76 @@
+from typing import List, NamedTuple, Optional
+
+import numpy as np
+from PIL import Image
+
+# Side of the grayscale grid the hashes are computed on, giving 64 bit hashes
+HASH_SIZE = 8
+# Number of 16 bit bands the dHash is split into for the candidate lookup
+HASH_BANDS = 4
+BAND_BITS = HASH_SIZE * HASH_SIZE // HASH_BANDS
+# Images are first reduced by an integer factor to about this size, which keeps hashing large images cheap
+REDUCED_SIZE = 64
+# Images whose grid spans fewer gray levels than this are nearly blank and not hashed,
+# since any two of them would match
+MIN_CONTRAST = 16
+
+
+class PerceptualHashes(NamedTuple):
+    """
+    The average hash and difference hash of an image, as 64 bit integers.
+    """
+    ahash: int
+    dhash: int
+
+    @property
+    def bands(self) -> List[int]:
+        """
+        Splits the dHash into HASH_BANDS integers. Two hashes within HASH_BANDS - 1 bits of each other
+        share at least one band, so looking up equal bands finds all of them.
+        """
+        mask = (1 << BAND_BITS) - 1
+        return [(self.dhash >> (band * BAND_BITS)) & mask for band in range(HASH_BANDS)]
+
+
+def _grid(image: Image.Image, width: int, height: int) -> np.ndarray:
+    # Transparent areas count as white, so a cut out logo hashes like the same logo on a white background.
+    reduced = image.resize((width, height), Image.Resampling.BOX)
+    flattened = Image.new('RGBA', reduced.size, (255, 255, 255, 255))
+    flattened.alpha_composite(reduced)
+    return np.asarray(flattened.convert('L'), dtype=np.int16)
+
+
+def _to_int(bits: np.ndarray) -> int:
+    return int(''.join('1' if bit else '0' for bit in bits.flatten()), 2)
+
+
+def perceptual_hashes(image: Image.Image) -> Optional[PerceptualHashes]:
+    """
+    Computes the aHash, each pixel of the grayscale grid against its mean, and the dHash, each pixel against
+    its right neighbour, of the image.
+
+    Returns:
+        Optional[PerceptualHashes]: The hashes, or None if the image is nearly blank, see MIN_CONTRAST.
+    """
+    if image.mode not in ('RGB', 'RGBA', 'L'):
+        image = image.convert('RGBA')
+    factor = min(image.size) // REDUCED_SIZE
+    if factor > 1:
+        # Reduced in its own mode, images without transparency skip the alpha handling of RGBA
+        image = image.reduce(factor)
+    rgba = image.convert('RGBA')
+    difference_grid = _grid(rgba, HASH_SIZE + 1, HASH_SIZE)
+    if difference_grid.max() - difference_grid.min() < MIN_CONTRAST:
+        return None
+    average_grid = _grid(rgba, HASH_SIZE, HASH_SIZE)
+
+    difference_hash = _to_int(difference_grid[:, 1:] > difference_grid[:, :-1])
+    average_hash = _to_int(average_grid > average_grid.mean())
+    return PerceptualHashes(average_hash, difference_hash)
+
+
+def hamming_distance(first: int, second: int) -> int:
+    """
+    Returns the number of bits in which two hashes differ.
+    """
+    return bin(first ^ second).count('1')
@@ -1,11 +1,250 @@
-from rembg import remove
+import atexit
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from typing import List, Optional, Tuple
 
+import onnxruntime as ort
+from django.conf import settings
+from PIL import Image, ImageChops
+from rembg import new_session, remove
 
-def rembg(temp_file_path):
+logger = logging.getLogger(__name__)
+
+# The model sessions of the current process, loaded once per model and reused by every inference
+_sessions = {}
+
+
+class RembgQueueFull(Exception):
+    """
+    Raised when the background removal queue is at REMBG_QUEUE_DEPTH and cannot take more images.
+    """
+
+
+def get_session(model_name: str, threads: Tuple[int, int] = (0, 0)):
+    """
+    Returns the rembg session of this process for the model, loading the model on first use.
+
+    Args:
+        model_name (str): The rembg model, e.g. "u2net", or the lighter "silueta" and "u2netp".
+        threads (Tuple[int, int]): The ONNX Runtime intra-op and inter-op thread counts, 0 for its defaults.
+    """
+    session = _sessions.get(model_name)
+    if session is None:
+        sess_opts = ort.SessionOptions()
+        sess_opts.intra_op_num_threads, sess_opts.inter_op_num_threads = threads
+        session = _sessions[model_name] = new_session(model_name, sess_opts=sess_opts)
+    return session
+
+
+def session_threads() -> Tuple[int, int]:
+    """
+    Returns the ONNX Runtime (intra-op, inter-op) thread counts configured for this deployment.
+    """
+    return settings.REMBG_INTRA_OP_THREADS, settings.REMBG_INTER_OP_THREADS
+
+
+def remove_background(image_data: bytes, session, max_input_size: int = 0) -> bytes:
+    """
+    Removes the background of an image with the given session.
+
+    Images larger than `max_input_size` are downscaled for inference only: the predicted mask is upsampled
+    back and applied to the original image, so the output keeps the source resolution.
+
+    Returns:
+        bytes: The PNG encoded image without background.
+    """
+    with Image.open(BytesIO(image_data)) as source:
+        image = source.convert('RGBA')
+
+    model_input = image
+    if max_input_size and max(image.size) > max_input_size:
+        # The model only sees RGB, and a fast filter is good enough for its input
+        model_input = image.convert('RGB')
+        model_input.thumbnail((max_input_size, max_input_size), Image.Resampling.BILINEAR, reducing_gap=2.0)
+
+    mask = remove(model_input, session=session, only_mask=True)
+    if mask.size != image.size:
+        mask = mask.resize(image.size, Image.Resampling.BILINEAR)
+    # Keep pixels that were already transparent
+    image.putalpha(ImageChops.darker(image.getchannel('A'), mask))
+
+    output = BytesIO()
+    image.save(output, format="PNG")
+    return output.getvalue()
+
+
+def _init_worker(model_name: str, threads: Tuple[int, int]) -> None:
+    get_session(model_name, threads)
+
+
+def _remove_batch(images: List[Tuple[bytes, str]], max_input_size: int,
+                  threads: Tuple[int, int]) -> List[Optional[bytes]]:
+    """
+    Removes the background of a batch of (image, model) pairs with the worker's preloaded sessions.
+    Runs in a background removal worker process.
+    """
+    results = []
+    for image_data, model_name in images:
+        try:
+            results.append(remove_background(image_data, get_session(model_name, threads), max_input_size))
+        except Exception:
+            logger.exception(f"Background removal with {model_name} failed")
+            results.append(None)
+    return results
+
+
+class BackgroundRemover:
+    """
+    Submits background removal to a dedicated process pool, off the request thread.
+
+    Images wait in a queue bounded by `queue_depth`. A dispatcher thread groups up to `batch_size` queued
+    images, waiting at most `batch_window` seconds for a batch to fill, into a single task for a worker.
+    At most one batch per worker process is in flight at a time; images stay queued, and can still be
+    cancelled by their callers, until a worker is free to take them.
+    """
+
+    def __init__(self, model_name: str, workers: int, queue_depth: int, batch_size: int, batch_window: float,
+                 max_input_size: int = 0, threads: Tuple[int, int] = (0, 0)):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.max_input_size = max_input_size
+        self.threads = threads
+        self._queue = queue.Queue(maxsize=queue_depth)
+        self.workers = workers
+        self._in_flight = threading.BoundedSemaphore(workers)
+        self._executor = self._new_executor()
+        self._dispatcher = threading.Thread(target=self._dispatch, name='rembg-dispatcher', daemon=True)
+        self._dispatcher.start()
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=_init_worker, initargs=(self.model_name, self.threads))
+
+    def submit(self, image_data: bytes, model_name: Optional[str] = None) -> Future:
+        """
+        Queues an image for background removal, with the pool's model unless another one is given.
+
+        Returns:
+            Future: Resolves to the processed image bytes, or None if removal failed.
+
+        Raises:
+            RembgQueueFull: If the queue is full.
+        """
+        future = Future()
+        try:
+            self._queue.put_nowait(((image_data, model_name or self.model_name), future))
+        except queue.Full:
+            raise RembgQueueFull(f"{self._queue.maxsize} images are already waiting for background removal.")
+        return future
+
+    def _next_batch(self) -> list:
+        batch = [self._queue.get()]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get(timeout=self.batch_window))
+            except queue.Empty:
+                break
+        # Drop images whose caller gave up waiting before they were dispatched
+        return [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+
+    def _submit_batch(self, images: List[Tuple[bytes, str]]) -> Future:
+        try:
+            return self._executor.submit(_remove_batch, images, self.max_input_size, self.threads)
+        except BrokenProcessPool:
+            logger.error("Background removal pool broke, restarting it")
+            self._executor = self._new_executor()
+            return self._executor.submit(_remove_batch, images, self.max_input_size, self.threads)
+
+    def _dispatch(self) -> None:
+        while True:
+            # Batches are only taken from the queue, and marked running, once a worker is free
+            self._in_flight.acquire()
+            batch = self._next_batch()
+            if not batch:
+                self._in_flight.release()
+                continue
+            try:
+                task = self._submit_batch([item for item, _ in batch])
+            except Exception as e:
+                self._in_flight.release()
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            task.add_done_callback(lambda done, batch=batch: self._complete(done, batch))
+
+    def _complete(self, task: Future, batch: list) -> None:
+        self._in_flight.release()
+        try:
+            results = task.result()
+        except Exception as e:
+            logger.error("Background removal batch failed", exc_info=e)
+            results = [None] * len(batch)
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_remover = None
+_remover_pid = None
+_remover_lock = threading.Lock()
+
+
+def get_background_remover() -> BackgroundRemover:
+    """
+    Returns the background removal pool of this process, starting it on first use (and again after a fork).
+    """
+    global _remover, _remover_pid
+    pid = os.getpid()
+    if _remover is None or _remover_pid != pid:
+        with _remover_lock:
+            if _remover is None or _remover_pid != pid:
+                _remover = BackgroundRemover(settings.REMBG_MODEL, settings.REMBG_WORKERS, settings.REMBG_QUEUE_DEPTH,
+                                             settings.REMBG_BATCH_SIZE, settings.REMBG_BATCH_WINDOW,
+                                             settings.REMBG_MAX_INPUT_SIZE, session_threads())
+                _remover_pid = pid
+                atexit.register(_remover.shutdown)
+    return _remover
+
+
+def rembg(image_data: bytes, timeout: Optional[float] = None, model_name: Optional[str] = None) -> Optional[bytes]:
+    """
+    Removes the background of an image.
+
+    With REMBG_WORKERS set, the image is processed by the background removal pool and the calling thread
+    only waits for the result. Otherwise it is processed inline with this process's preloaded session.
+    See `remove_background` for the downscaling of large images.
+
+    Args:
+        image_data (bytes): The encoded source image.
+        timeout (Optional[float]): Seconds to wait for the result, e.g. the rest of a deadline. Never more than
+            REMBG_TIMEOUT.
+        model_name (Optional[str]): The rembg model to use, one of REMBG_MODELS. Defaults to REMBG_MODEL.
+
+    Returns:
+        Optional[bytes]: The PNG encoded image without background, or None on failure.
+    """
     try:
-        with open(temp_file_path, 'rb') as i:
-            output = remove(i.read())
-            return output
-    except Exception as e:
-        print("Error:", str(e))
-        return None
\ No newline at end of file
+        if settings.REMBG_WORKERS <= 0:
+            session = get_session(model_name or settings.REMBG_MODEL, session_threads())
+            return remove_background(image_data, session, settings.REMBG_MAX_INPUT_SIZE)
+
+        future = get_background_remover().submit(image_data, model_name)
+        try:
+            return future.result(timeout=settings.REMBG_TIMEOUT if timeout is None
+                                 else min(timeout, settings.REMBG_TIMEOUT))
+        except FutureTimeoutError:
+            future.cancel()
+            logger.warning("Background removal timed out")
+            return None
+    except Exception:
+        logger.exception("Background removal failed")
+        return None
@@ -0,0 +1,76 @@
+import threading
+from typing import Callable, Optional, TypeVar
+
+from api.utils.file_lock import FileLock, lock_path
+
+T = TypeVar('T')
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+_calls = {}
+_calls_lock = threading.Lock()
+
+
+def single_flight(key: str, resolve: Callable[[], T], recheck: Callable[[], Optional[T]], timeout: float,
+                  share: Callable[[T], T] = lambda result: result) -> Optional[T]:
+    """
+    Coalesces concurrent calls for the same key, so that only one of them runs `resolve`.
+
+    Within a process, the first caller leads and the others wait for its result, passed through `share`.
+    If the leader raises, the waiting callers raise its error as well.
+    Across processes the leaders serialize on a file lock; a leader that had to wait first calls `recheck`,
+    which should look up what the previous holder stored, and only runs `resolve` if that finds nothing.
+
+    Args:
+        key (str): Identifies the work, e.g. the program.
+        resolve (Callable): Does the work.
+        recheck (Callable): Returns the stored result of the work, or None.
+        timeout (float): Seconds to wait for another caller's result.
+        share (Callable): Copies the leader's result for a waiting caller.
+
+    Returns:
+        Optional[T]: The result, or None if waiting for another caller timed out.
+
+    Raises:
+        Exception: Whatever `resolve` or `recheck` raised, in the leader or the caller it was waiting for.
+    """
+    with _calls_lock:
+        call = _calls.get(key)
+        leader = call is None
+        if leader:
+            call = _calls[key] = _Call()
+
+    if not leader:
+        if not call.done.wait(timeout):
+            return None
+        if call.error is not None:
+            raise call.error
+        if call.result is None:
+            return None
+        return share(call.result)
+
+    try:
+        lock = FileLock(lock_path(key), remove=True)
+        if not lock.acquire(timeout):
+            return None
+        try:
+            result = recheck() if lock.waited else None
+            if result is None:
+                result = resolve()
+        finally:
+            lock.release()
+        call.result = result
+        return result
+    except Exception as e:
+        call.error = e
+        raise
+    finally:
+        with _calls_lock:
+            _calls.pop(key, None)
+        call.done.set()
@@ -0,0 +1,72 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from api.utils.metrics import STAGE_DURATION, observe
+
+
+class Timings:
+    """
+    The time spent in each stage of one request, summed per stage. Stages run on other threads are added as
+    well if they were submitted with `submit_in_context`, so stages may overlap.
+    """
+
+    def __init__(self):
+        self.durations = {}
+        self.lock = threading.Lock()
+
+    def add(self, stage_name: str, seconds: float) -> None:
+        with self.lock:
+            self.durations[stage_name] = self.durations.get(stage_name, 0.0) + seconds
+
+    def server_timing(self, total: Optional[float] = None) -> str:
+        """
+        Returns the stages as the value of a Server-Timing header, in milliseconds.
+        """
+        with self.lock:
+            entries = [f"{stage_name};dur={seconds * 1000:.1f}" for stage_name, seconds in self.durations.items()]
+        if total is not None:
+            entries.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(entries)
+
+
+_timings = contextvars.ContextVar('timings', default=None)
+
+
+def start_timings() -> tuple[Timings, contextvars.Token]:
+    """
+    Starts collecting the stage timings of the current request. Pass the token to `stop_timings` at its end.
+    """
+    timings = Timings()
+    return timings, _timings.set(timings)
+
+
+def stop_timings(token: contextvars.Token) -> None:
+    _timings.reset(token)
+
+
+@contextmanager
+def stage(stage_name: str):
+    """
+    Times the enclosed block as a stage of icon processing, e.g. 'serp' or 'rembg', for the Server-Timing
+    header of the current request and the stage duration histogram.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        timings = _timings.get()
+        if timings is not None:
+            timings.add(stage_name, seconds)
+        observe(STAGE_DURATION, {'stage': stage_name}, seconds)
+
+
+def submit_in_context(executor, fn, *args, **kwargs):
+    """
+    Submits a call to a thread pool so that it runs in the context of the caller, and its stages are timed
+    as part of the caller's request.
+    """
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
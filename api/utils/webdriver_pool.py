@@ -0,0 +1,153 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+from contextlib import contextmanager
+from typing import Optional
+
+from django.conf import settings
+from selenium import webdriver
+
+logger = logging.getLogger(__name__)
+
+
+class WebDriverPoolTimeout(Exception):
+    """
+    Raised when no WebDriver could be checked out of the pool in time.
+    """
+
+
+class _PooledDriver:
+    def __init__(self, driver):
+        self.driver = driver
+        self.uses = 0
+
+
+class WebDriverPool:
+    """
+    A bounded pool of warm headless Chrome instances.
+
+    At most `size` browsers exist at a time. A browser is health checked when it is checked out, reset
+    (cookies, storage, blank page) when it is returned, and quit after `max_uses` checkouts.
+    """
+
+    def __init__(self, size: int, max_uses: int):
+        self.size = size
+        self.max_uses = max_uses
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = queue.LifoQueue()
+        self._closed = False
+
+    @staticmethod
+    def _create_driver():
+        options = webdriver.ChromeOptions()
+        options.add_argument('--headless=new')
+        options.add_argument('--disable-gpu')
+        options.add_argument('--no-sandbox')
+        options.add_argument('--disable-dev-shm-usage')
+        return webdriver.Chrome(options=options)
+
+    @staticmethod
+    def _quit(entry: _PooledDriver) -> None:
+        try:
+            entry.driver.quit()
+        except Exception as e:
+            logger.error("Failed to quit a pooled WebDriver", exc_info=e)
+
+    @staticmethod
+    def _is_healthy(entry: _PooledDriver) -> bool:
+        try:
+            return entry.driver.execute_script('return 1') == 1
+        except Exception:
+            return False
+
+    @staticmethod
+    def _reset(entry: _PooledDriver) -> bool:
+        try:
+            entry.driver.delete_all_cookies()
+            entry.driver.execute_script('window.localStorage.clear(); window.sessionStorage.clear();')
+        except Exception:
+            # Storage is not accessible on some pages, e.g. about:blank or error pages
+            pass
+        try:
+            entry.driver.get('about:blank')
+            return True
+        except Exception as e:
+            logger.error("Failed to reset a pooled WebDriver", exc_info=e)
+            return False
+
+    def _acquire(self) -> _PooledDriver:
+        while True:
+            try:
+                entry = self._idle.get_nowait()
+            except queue.Empty:
+                return _PooledDriver(self._create_driver())
+            if self._is_healthy(entry):
+                return entry
+            logger.warning("Discarding an unhealthy pooled WebDriver")
+            self._quit(entry)
+
+    def _release(self, entry: _PooledDriver) -> None:
+        entry.uses += 1
+        if self._closed or entry.uses >= self.max_uses or not self._reset(entry):
+            self._quit(entry)
+        else:
+            self._idle.put(entry)
+
+    @contextmanager
+    def checkout(self, timeout: Optional[float] = None):
+        """
+        Borrows a WebDriver from the pool for the duration of the with block.
+
+        Args:
+            timeout (Optional[float]): Seconds to wait for a free browser. Waits indefinitely if None.
+
+        Raises:
+            WebDriverPoolTimeout: If no browser became available within the timeout.
+        """
+        if self._closed:
+            raise WebDriverPoolTimeout("The WebDriver pool is shut down.")
+        if not self._slots.acquire(timeout=timeout):
+            raise WebDriverPoolTimeout(f"No WebDriver became available within {timeout}s.")
+
+        entry = None
+        try:
+            entry = self._acquire()
+            yield entry.driver
+        finally:
+            if entry is not None:
+                self._release(entry)
+            self._slots.release()
+
+    def shutdown(self) -> None:
+        """
+        Quits all idle browsers. Browsers that are checked out are quit when they are returned.
+        """
+        self._closed = True
+        while True:
+            try:
+                entry = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._quit(entry)
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_webdriver_pool() -> WebDriverPool:
+    """
+    Returns the WebDriver pool of this process, creating it on first use (and again after a fork).
+    """
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is None or _pool_pid != pid:
+        with _pool_lock:
+            if _pool is None or _pool_pid != pid:
+                _pool = WebDriverPool(settings.SELENIUM_POOL_SIZE, settings.SELENIUM_MAX_USES)
+                _pool_pid = pid
+                atexit.register(_pool.shutdown)
+    return _pool
@@ -1,26 +1,50 @@
+import json
 import logging
 import hashlib
+import threading
 import time
 import re
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError, as_completed
+from django.db import connection
+from django.db.models import F
 from django.http import JsonResponse
 from rest_framework import status, viewsets
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
+from django.urls import reverse
 from rest_framework.response import Response
 from django.utils import timezone
 from datetime import timedelta
 from decouple import config
+from django.conf import settings
 
+from api.client.circuit_breaker import breaker_open
+from api.client.deadline import Deadline
+from api.models.icon_job import IconJob
+from api.models.processed_icon import ProcessedIcon
 from api.models.program import Program
 from api.models.search_results import SearchResults
 from api.models.search_term import SearchTerm
+from api.renderer.image import ImageRenderer
 from api.serializer.search_result import SearchResultsSerializer
-from api.utils.googe_search_selenium import fetch_icons
-from api.utils.google_search import fetch_google_search
-from api.utils.html_content_parser import extract_html_element_attribute
-from api.utils.image_processor import process_icon_image, process_icon_base64
+from api.utils.googe_search_selenium import IconNotFound, fetch_icons
+from api.utils.google_search import fetch_google_search, search_failed
+from api.utils.html_content_parser import (GONE_STATUS_CODES, extract_html_element_attribute, fetch_image,
+                                           fetch_page_attribute, page_fetch_failed)
+from api.utils.icon_store import (claim_icon_refresh, get_program_icon, get_program_icons, is_stale,
+                                  revalidate_icon, source_hash)
+from api.utils.icon_jobs import enqueue_job
+from api.utils.icon_variants import VARIANT_FORMATS, get_icon_variant
+from api.utils.icon_misses import clear_icon_miss, get_icon_miss, record_icon_miss
+from api.utils.image_processor import (icon_data_uri, icon_response, process_icon_data, process_icon_image,
+                                      process_icon_base64, raw_icon_response)
+from api.utils.metrics import count_event
+from api.utils.single_flight import single_flight
+from api.utils.timing import stage, submit_in_context
+from api.utils.webdriver_pool import WebDriverPoolTimeout, get_webdriver_pool
 from django.core.validators import URLValidator
 from django.core.exceptions import ValidationError
 from rest_framework.decorators import action
+from rest_framework.settings import api_settings
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(filename=config('log_path'), encoding='utf-8', level=logging.WARNING)
@@ -29,190 +53,827 @@ logging.basicConfig(filename=config('log_path'), encoding='utf-8', level=logging
 from django.http import JsonResponse
 from rest_framework import status
 
+SITES = [
+    {'site': 'computerbase.de', 'inurl': 'downloads', 'url_pattern': 'https://www.computerbase.de/downloads/*'},
+    {'site': 'uptodown.com', 'inurl': 'windows', 'url_pattern': 'https://.*\\.uptodown\\.com/windows'},
+    {'site': 'softonic.com', 'inurl': '', 'url_pattern': ''}
+]
 
-def handle_base64icon_processing(program_name):
+META_SEARCH_CRITERIA = {"name": "meta", "attrs": {"property": "og:image"}}
+META_ATTRIBUTE = "content"
+
+_search_executor = None
+_search_executor_lock = threading.Lock()
+
+
+def get_search_executor() -> ThreadPoolExecutor:
+    """
+    Returns the bounded thread pool shared by all concurrent site searches of this process.
+    """
+    global _search_executor
+    if _search_executor is None:
+        with _search_executor_lock:
+            if _search_executor is None:
+                _search_executor = ThreadPoolExecutor(max_workers=settings.ICON_SEARCH_MAX_WORKERS,
+                                                      thread_name_prefix='icon-search')
+    return _search_executor
+
+
+_refresh_executor = None
+_refresh_executor_lock = threading.Lock()
+
+
+def get_refresh_executor() -> ThreadPoolExecutor:
+    """
+    Returns the thread pool running the background refreshes of stale icons in this process.
+    """
+    global _refresh_executor
+    if _refresh_executor is None:
+        with _refresh_executor_lock:
+            if _refresh_executor is None:
+                _refresh_executor = ThreadPoolExecutor(max_workers=settings.ICON_REFRESH_WORKERS,
+                                                       thread_name_prefix='icon-refresh')
+    return _refresh_executor
+
+
+def handle_base64icon_processing(program_name, program=None, deadline=None, sites_answered=False):
     """
     Fetches and processes the icon for the given program.
 
     Args:
     program_name (str): The name of the program to fetch and process the icon for.
+    program (Program, optional): The program the processed icon is stored for.
+    deadline (Deadline, optional): The total time budget of the calling request.
+    sites_answered (bool, optional): Whether every site in SITES was searched and answered without an icon.
 
     Returns:
     JsonResponse: The response containing the processed icon or an error message.
+    When every site answered and the browser search finds nothing either, the response carries the reason as
+    `icon_miss`. Failed searches are not misses, they are tried again on the next request.
     """
-    icon = fetch_icons(program_name + " icon")
+    if deadline and deadline.expired():
+        return JsonResponse({'error': f'Timed out while searching an icon for {program_name}.'},
+                            status=status.HTTP_200_OK)
+
+    checkout_timeout = settings.SELENIUM_CHECKOUT_TIMEOUT
+    if deadline:
+        checkout_timeout = deadline.cap(checkout_timeout)
+    count_event('selenium_fallback')
+    try:
+        with stage('selenium'), get_webdriver_pool().checkout(timeout=checkout_timeout) as wd:
+            icon = fetch_icons(program_name + " icon", wd, deadline)
+    except WebDriverPoolTimeout as e:
+        logger.error(f"Selenium fallback skipped for {program_name}: {e}")
+        return JsonResponse({'error': f'No browser available to search an icon for {program_name}.'},
+                            status=status.HTTP_200_OK)
     if isinstance(icon, str) and icon.startswith('http'):
-        return process_icon_image(icon)
+        return process_icon_image(icon, program=program, deadline=deadline)
     elif isinstance(icon, str) and 'base64' in icon:
-        return process_icon_base64(icon, program_name)
-    else:
-        return JsonResponse({'error': icon}, status=status.HTTP_200_OK)
+        return process_icon_base64(icon, program_name, program=program, deadline=deadline)
+    response = JsonResponse({'error': icon}, status=status.HTTP_200_OK)
+    if sites_answered and isinstance(icon, IconNotFound):
+        # Every source answered, remember that this program has no findable icon
+        response.icon_miss = str(icon)
+    return response
 
 
-def extract_icon(url: str, search_term_instance: SearchTerm, program_name: str) -> HttpResponse | Response:
+def extract_icon(url: str, search_term_instance: SearchTerm, program_name: str,
+                 program: Program | None = None, deadline: Deadline | None = None,
+                 meta_result=None) -> HttpResponse | Response:
     """
     Extract the required meta attribute from the URL and respond with the image.
+    A meta_result that was already extracted from the URL skips fetching the page again.
+
+    A page without the attribute, or one that is gone, is answered with a 404, and a page that could not be
+    fetched with a 502, so the caller can move on to the next site.
     """
-    # Update attempt count for the search term
-    search_term_instance.attempts += 1
-    search_term_instance.save()
+    # Update attempt count for the search term, atomically so concurrent requests don't lose increments
+    SearchTerm.objects.filter(pk=search_term_instance.pk).update(attempts=F('attempts') + 1)
 
-    meta_search_criteria = {"name": "meta", "attrs": {"property": "og:image"}}
-    meta_attribute = "content"
-    meta_result = extract_html_element_attribute(url, meta_search_criteria, meta_attribute)
+    if meta_result is None:
+        meta_result = extract_html_element_attribute(url, META_SEARCH_CRITERIA, META_ATTRIBUTE, deadline)
     print("meta_result", meta_result)
     if isinstance(meta_result, list) and meta_result and isinstance(meta_result[0], dict) and "error" in meta_result[0]:
-        return handle_base64icon_processing(program_name)
+        return JsonResponse({'error': meta_result[0]['error']},
+                            status=status.HTTP_502_BAD_GATEWAY if page_fetch_failed(meta_result)
+                            else status.HTTP_404_NOT_FOUND)
     else:
         image_url = meta_result[0] if isinstance(meta_result, list) else meta_result
         logger.info(image_url)
-        return process_icon_image(image_url)
+        return process_icon_image(image_url, program=program, deadline=deadline)
 
 
-def search_icon(program_name: str, program_id: str) -> HttpResponse:
+def site_search_terms(program_name: str, site_info: dict) -> tuple[str, str]:
     """
-    Search for an icon by checking both quoted and unquoted program names for each site.
+    Returns the unquoted and quoted search terms for the program on the given site.
     """
-    sites = [
-        {'site': 'computerbase.de', 'inurl': 'downloads', 'url_pattern': 'https://www.computerbase.de/downloads/*'},
-        {'site': 'uptodown.com', 'inurl': 'windows', 'url_pattern': 'https://.*\\.uptodown\\.com/windows'},
-        {'site': 'softonic.com', 'inurl': '', 'url_pattern': ''}
-    ]
+    site = site_info['site']
+    inurl = site_info['inurl']
+    unquoted_term = f"{program_name} site:{site}" + (f" inurl:{inurl}" if inurl else "")
+    quoted_term = f'"{program_name}" site:{site}' + (f" inurl:{inurl}" if inurl else "")
+    return unquoted_term, quoted_term
 
-    program_instance, _ = Program.objects.get_or_create(program_name=program_name, program_id=program_id)
 
-    for site_info in sites:
-        found = False
+def known_site_terms(program_name: str) -> dict:
+    """
+    Looks up the search terms of every site that were searched before, with a single query.
 
-        site = site_info['site']
-        inurl = site_info['inurl']
-        pattern = site_info['url_pattern']
-        # Prepare both quoted and unquoted terms for this site.
-        unquoted_term = f"{program_name} site:{site}" + (f" inurl:{inurl}" if inurl else "")
-        quoted_term = f'"{program_name}" site:{site}' + (f" inurl:{inurl}" if inurl else "")
+    Returns:
+        dict: The stored SearchTerm instances keyed by term.
+    """
+    terms = [term for site_info in SITES for term in site_search_terms(program_name, site_info)]
+    return {search_term.term: search_term for search_term in SearchTerm.objects.filter(term__in=terms)}
 
-        term = quoted_term
 
-        # Check if either term exists.
-        if SearchTerm.objects.filter(term=unquoted_term).exists():
-            found = True
-            continue
+def prepare_site_term(program_name: str, site_info: dict, known_terms: dict) -> SearchTerm:
+    """
+    Returns the search term to query for the site, reusing one searched before, see `known_site_terms`.
+    New terms are created with one attempt. Either way the SERP cache answers the query while it is fresh,
+    and SpaceSERP is only queried again once it expired.
+    """
+    unquoted_term, quoted_term = site_search_terms(program_name, site_info)
+    search_term_instance = known_terms.get(unquoted_term) or known_terms.get(quoted_term)
+    if search_term_instance:
+        return search_term_instance
+
+    search_term_instance, created = SearchTerm.objects.get_or_create(term=quoted_term, defaults={'attempts': 1})
+    if not created:
+        # Created by a concurrent request since the lookup
+        SearchTerm.objects.filter(pk=search_term_instance.pk).update(attempts=F('attempts') + 1)
+    known_terms[quoted_term] = search_term_instance
+    return search_term_instance
+
 
-        if SearchTerm.objects.filter(term=quoted_term).exists():
-            found = True
+def save_search_result(search_term_instance: SearchTerm, program_instance: Program, item: dict,
+                       validators: dict | None = None) -> None:
+    """
+    Stores the SERP item as a search result of the program, or marks an already stored one as updated.
+    URLs are unique, so this is a single UPDATE for a known URL and an insert that ignores conflicts otherwise.
+    The validators of the page, if it was fetched, are stored along, so refreshing it is a conditional request.
+    """
+    validators = validators or {}
+    if SearchResults.objects.filter(url=item['link']).update(last_updated=timezone.now(), **validators):
+        return
+    SearchResults.objects.bulk_create([
+        SearchResults(
+            search_term=search_term_instance,
+            program_id=program_instance,
+            position=item['position'],
+            url=item['link'],
+            **validators
+        )
+    ], ignore_conflicts=True)
+
+
+def fetch_site_candidate(search_term: str, pattern: str, deadline: Deadline | None,
+                         cancelled: threading.Event) -> dict:
+    """
+    Runs the SERP query for one site and extracts the og:image of the first result matching the site pattern.
+    Runs on the search thread pool; its only database access is the SERP cache lookup.
+
+    Returns:
+        dict: The 'google_response', and if a result matched, its 'item', the extracted 'meta_result' and the
+        'validators' of its page.
+    """
+    try:
+        google_response = fetch_google_search(search_term, deadline=deadline)
+        candidate = {'google_response': google_response}
+        if cancelled.is_set() or not google_response or google_response[0].get("error"):
+            return candidate
+
+        item = next((item for item in google_response if re.match(pattern, item['link'])), None)
+        if item is None or cancelled.is_set():
+            return candidate
+
+        candidate['item'] = item
+        page = fetch_page_attribute(item['link'], META_SEARCH_CRITERIA, META_ATTRIBUTE, deadline)
+        candidate['meta_result'] = page['result']
+        candidate['validators'] = page.get('validators')
+        return candidate
+    finally:
+        connection.close()
+
+
+def search_icon_concurrent(program_name: str, program_instance: Program,
+                           deadline: Deadline | None = None) -> HttpResponse:
+    """
+    Runs the SERP query and page extraction of every site in parallel and responds with the first site,
+    in priority order, that yields an icon. Work still running for lower priority sites is cancelled.
+    """
+    known_terms = known_site_terms(program_name)
+    # Whether every site was searched and answered, so finding nothing makes a miss
+    sites_answered = True
+    pending_sites = []
+    for site_info in SITES:
+        if breaker_open(site_info['site']):
+            logger.warning(f"Skipping {site_info['site']}, its circuit breaker is open")
+            sites_answered = False
             continue
+        pending_sites.append((site_info, prepare_site_term(program_name, site_info, known_terms)))
+
+    cancelled = threading.Event()
+    executor = get_search_executor()
+    futures = [
+        submit_in_context(executor, fetch_site_candidate, search_term_instance.term, site_info['url_pattern'],
+                          deadline, cancelled)
+        for site_info, search_term_instance in pending_sites
+    ]
 
-        if not found:
-            term_to_use = quoted_term
-            search_term_instance, _ = SearchTerm.objects.get_or_create(term=term_to_use)
-            search_term_instance.attempts += 1
-            search_term_instance.save()
+    try:
+        for (site_info, search_term_instance), future in zip(pending_sites, futures):
+            try:
+                candidate = future.result(timeout=deadline.remaining() if deadline else None)
+            except FutureTimeoutError:
+                logger.error(f"Deadline exceeded while searching an icon for {program_name}")
+                sites_answered = False
+                break
+            except Exception as e:
+                logger.error(f"Search failed for {search_term_instance.term}", exc_info=e)
+                sites_answered = False
+                continue
+
+            google_response = candidate['google_response']
+            if search_failed(google_response):
+                sites_answered = False
+            if not google_response or google_response[0].get("error"):
+                logger.error(f"No links found in the Google API response for {search_term_instance.term}")
+                continue
+
+            item = candidate.get('item')
+            if item is None:
+                logger.error(f"No url matches the pattern {site_info['url_pattern']} for {search_term_instance.term}")
+                continue
+
+            save_search_result(search_term_instance, program_instance, item, candidate['validators'])
+            extraction_response = extract_icon(item['link'], search_term_instance, program_name, program_instance,
+                                               deadline, meta_result=candidate['meta_result'])
+            if extraction_response.status_code in [status.HTTP_200_OK]:
+                return extraction_response
+            if extraction_response.status_code != status.HTTP_404_NOT_FOUND:
+                sites_answered = False
+            logger.error("Error during extraction, attempting next site if available.")
+    finally:
+        cancelled.set()
+        for future in futures:
+            future.cancel()
+
+    return handle_base64icon_processing(program_name, program_instance, deadline, sites_answered)
+
+
+def search_icon(program_name: str, program_id: str, deadline: Deadline | None = None) -> HttpResponse:
+    """
+    Search for an icon by checking both quoted and unquoted program names for each site.
+    The deadline, if given, bounds the total time spent across all sites and the fallback.
+    With ICON_SEARCH_CONCURRENT enabled, the sites are searched in parallel, see `search_icon_concurrent`.
+    """
+    program_instance, _ = Program.objects.get_or_create(program_name=program_name, program_id=program_id)
 
-        search_term = term
-        google_response = fetch_google_search(search_term)
+    if settings.ICON_SEARCH_CONCURRENT:
+        return search_icon_concurrent(program_name, program_instance, deadline)
+
+    known_terms = known_site_terms(program_name)
+    # Whether every site was searched and answered, so finding nothing makes a miss
+    sites_answered = True
+    for site_info in SITES:
+        if deadline and deadline.expired():
+            logger.error(f"Deadline exceeded while searching an icon for {program_name}")
+            sites_answered = False
+            break
+
+        if breaker_open(site_info['site']):
+            logger.warning(f"Skipping {site_info['site']}, its circuit breaker is open")
+            sites_answered = False
+            continue
+
+        pattern = site_info['url_pattern']
+        search_term_instance = prepare_site_term(program_name, site_info, known_terms)
+        search_term = search_term_instance.term
+        google_response = fetch_google_search(search_term, deadline=deadline)
+        if search_failed(google_response):
+            sites_answered = False
 
         if not google_response or isinstance(google_response, list) and google_response[0].get("error"):
             logger.error(f"No links found in the Google API response for {search_term}")
             continue
 
         for item in google_response:
-            # Check if the URL already exists for the given search term and program
-            if not SearchResults.objects.filter(search_term=search_term_instance, program_id=program_instance,
-                                                url=item['link']).exists():
-                if re.match(pattern, item['link']):
-                    print(f"this is the item link {item['link']} for {program_name}")
-                    SearchResults.objects.create(
-                        search_term=search_term_instance,
-                        program_id=program_instance,
-                        position=item['position'],
-                        url=item['link']
-                    )
-                    extraction_response = extract_icon(item['link'], search_term_instance, program_name)
-                    if extraction_response.status_code in [status.HTTP_200_OK]:
-                        return extraction_response  # Successfully found and extracted, or not found but processed
-                    else:
-                        logger.error("Error during extraction, attempting next site if available.")
+            if re.match(pattern, item['link']):
+                print(f"this is the item link {item['link']} for {program_name}")
+                page = fetch_page_attribute(item['link'], META_SEARCH_CRITERIA, META_ATTRIBUTE, deadline)
+                save_search_result(search_term_instance, program_instance, item, page.get('validators'))
+                extraction_response = extract_icon(item['link'], search_term_instance, program_name,
+                                                   program_instance, deadline, meta_result=page['result'])
+                if extraction_response.status_code in [status.HTTP_200_OK]:
+                    return extraction_response  # Successfully found and extracted, or not found but processed
                 else:
-                    logger.error(f"Url {item['link']} does not match the pattern {pattern}")
+                    if extraction_response.status_code != status.HTTP_404_NOT_FOUND:
+                        sites_answered = False
+                    logger.error("Error during extraction, attempting next site if available.")
             else:
-                return handle_base64icon_processing(program_name)
+                logger.error(f"Url {item['link']} does not match the pattern {pattern}")
+
+    return handle_base64icon_processing(program_name, program_instance, deadline, sites_answered)
+
+
+def refresh_icon(program_name: str, program_id, icon: ProcessedIcon) -> None:
+    """
+    Revalidates a stale icon on the refresh thread pool, with conditional requests where possible.
+
+    The page of the program's stored search result is fetched with its ETag/Last-Modified; if it is unchanged,
+    or still points at the same og:image, the source image is revalidated the same way. An unchanged image
+    only marks the icon as fresh again. A changed image is processed and stored. Only a page that is gone or
+    has no og:image anymore, or an image that is gone, falls back to searching for the icon again; on fetch
+    or processing errors the stored icon is kept and refreshed again on a later request.
+    """
+    deadline = Deadline(settings.ICON_REFRESH_DEADLINE)
+    try:
+        program = Program.objects.filter(program_id=program_id, program_name=program_name).first()
+        result = SearchResults.objects.filter(program_id=program).first() if program else None
+        image_url = icon.source_url
+
+        if result:
+            page = fetch_page_attribute(result.url, META_SEARCH_CRITERIA, META_ATTRIBUTE, deadline,
+                                        {'etag': result.etag, 'last_modified': result.last_modified})
+            meta_result = page.get('result')
+            if page['not_modified']:
+                SearchResults.objects.filter(pk=result.pk).update(last_updated=timezone.now())
+            elif page_fetch_failed(meta_result):
+                logger.warning(f"Keeping the icon of {program_name}, its page {result.url} could not be fetched")
+                return
+            elif isinstance(meta_result, list) and meta_result and isinstance(meta_result[0], dict):
+                image_url = ''
+            else:
+                SearchResults.objects.filter(pk=result.pk).update(last_updated=timezone.now(),
+                                                                  **page['validators'])
+                image_url = meta_result[0] if isinstance(meta_result, list) else meta_result
+
+        if image_url:
+            same_source = image_url == icon.source_url
+            validators = {'etag': icon.source_etag, 'last_modified': icon.source_last_modified}
+            image = fetch_image(image_url, deadline, validators if same_source else None)
+            if image['not_modified'] or image['data'] and source_hash(image['data']) == icon.source_hash:
+                revalidate_icon(icon, image['validators'])
+                return
+            if image['data']:
+                response = process_icon_data(image['data'], f"the url {image_url}", icon.rm_bg, program, deadline,
+                                             image_url, image['validators'], icon.rembg_model or None)
+                if not getattr(response, 'processed_icon', None):
+                    logger.warning(f"Keeping the icon of {program_name}, the image {image_url} failed to process")
+                return
+            if image['status_code'] not in GONE_STATUS_CODES:
+                logger.warning(f"Keeping the icon of {program_name}, the image {image_url} could not be fetched")
+                return
+
+        # The stored source is gone, search for the icon again
+        search_icon(program_name, program_id, deadline)
+    except Exception as e:
+        logger.error(f"Refreshing the icon of {program_name} failed", exc_info=e)
+    finally:
+        Program.objects.filter(program_id=program_id, program_name=program_name).update(refresh_claimed_until=None)
+        connection.close()
+
+
+def serve_stored_icon(icon: ProcessedIcon, program_name: str, program_id) -> JsonResponse:
+    """
+    Responds with a stored icon right away. A stale icon is refreshed in the background, by a single request
+    across all processes, see `claim_icon_refresh`.
+    """
+    if is_stale(icon):
+        count_event('stale_hit')
+        if claim_icon_refresh(program_id, program_name, settings.ICON_REFRESH_DEADLINE):
+            get_refresh_executor().submit(refresh_icon, program_name, program_id, icon)
+    else:
+        count_event('store_hit')
+    return icon_response(icon)
+
+
+def validate_api_key(api_key) -> JsonResponse | None:
+    """
+    Returns an error response if the API key is missing or invalid, otherwise None.
+    """
+    if not api_key:
+        return JsonResponse({"error": "API key is missing."}, status=status.HTTP_401_UNAUTHORIZED)
 
-    return handle_base64icon_processing(program_name)
+    if api_key != config('API_KEY') or len(api_key) != 41:
+        return JsonResponse({"error": "Invalid API key."}, status=status.HTTP_401_UNAUTHORIZED)
+    return None
+
+
+def validate_program_input(program_name, program_id, provided_hash) -> JsonResponse | None:
+    """
+    Validates the program name, program ID and the hash over both. Returns an error response, or None if valid.
+    """
+    # Validate program name and program ID lengths
+    if not program_name or not program_id or not provided_hash:
+        return JsonResponse({"error": "Invalid input variables. Variables must not be null"},
+                            status=status.HTTP_400_BAD_REQUEST)
+    if not isinstance(program_name, str) or not 0 < len(program_name.strip()) < 80:
+        return JsonResponse(
+            {"error": "Invalid input variables. 'program_name' length should be between 0 and 80"},
+            status=status.HTTP_400_BAD_REQUEST)
+
+    program_id_str = str(program_id)
+    try:
+        float(program_id_str)
+        is_numeric = True
+    except ValueError:
+        is_numeric = False
+
+    if not is_numeric:
+        return JsonResponse({"error": "Invalid input variables. 'program_id' must be numeric."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+    salt = config('SECRET_KEY')
+
+    hash_string = f"{program_name.strip()}{program_id}{salt.strip()}"
+    expected_hash = hashlib.sha256(hash_string.encode()).hexdigest()
+
+    if not isinstance(provided_hash, str) or provided_hash.strip() != expected_hash \
+            or len(provided_hash.strip()) != 64:
+        return JsonResponse({"error": "Hash validation failed."}, status=status.HTTP_400_BAD_REQUEST)
+    return None
+
+
+def cached_icon_response(program_name: str, program_id) -> HttpResponse | None:
+    """
+    Responds from the icon store, or from the miss cache for a program whose icon could not be found.
+    Returns None if the program's icon has to be resolved.
+    """
+    with stage('db'):
+        stored_icon = get_program_icon(program_id, program_name)
+    if stored_icon:
+        return serve_stored_icon(stored_icon, program_name, program_id)
+
+    with stage('db'):
+        miss = get_icon_miss(program_id, program_name)
+    if miss and miss.recheck_after > timezone.now():
+        count_event('miss_cache_hit')
+        response = JsonResponse({'error': miss.reason}, status=status.HTTP_200_OK)
+        response.icon_miss = miss.reason
+        return response
+    count_event('store_miss')
+    return None
+
+
+def copy_response(response: HttpResponse) -> HttpResponse:
+    """
+    Copies an icon response for another request, along with its `processed_icon` and `icon_miss`.
+    """
+    copy = HttpResponse(response.content, status=response.status_code, content_type=response['Content-Type'])
+    copy.processed_icon = getattr(response, 'processed_icon', None)
+    copy.icon_miss = getattr(response, 'icon_miss', None)
+    return copy
+
+
+def resolve_uncached_icon(program_name: str, program_id, deadline: Deadline | None = None) -> HttpResponse:
+    """
+    Resolves the icon of a program that is not in the icon store: from the stored search result of the last
+    month, or by searching for it. The outcome is recorded in the miss cache.
+
+    Expects the program name stripped, as in `resolve_icon`, since the stored icons, search results, programs
+    and misses are all keyed by it.
+    """
+    # Calculate the date one month ago
+    one_month_ago = timezone.now() - timedelta(days=30)
+
+    with stage('db'):
+        queryset = SearchResults.objects.select_related('program_id', 'search_term').filter(
+            program_id__program_id=program_id,
+            program_id__program_name=program_name,
+            last_updated__gte=one_month_ago,
+        ).first()
+    if queryset and queryset.url:
+        search_term_instance = queryset.search_term
+        page = fetch_page_attribute(queryset.url, META_SEARCH_CRITERIA, META_ATTRIBUTE, deadline)
+        if page.get('validators'):
+            SearchResults.objects.filter(pk=queryset.pk).update(**page['validators'])
+        # match pattern on the url
+        response = extract_icon(queryset.url, search_term_instance, program_name, queryset.program_id,
+                                deadline, meta_result=page['result'])
+        if response.status_code != status.HTTP_200_OK:
+            # The stored result no longer yields an icon, search every site again
+            response = search_icon(program_name, program_id, deadline)
+    else:
+        response = search_icon(program_name, program_id, deadline)
+
+    miss = get_icon_miss(program_id, program_name)
+    if getattr(response, 'icon_miss', None):
+        count_event('unresolved')
+        record_icon_miss(program_id, program_name, response.icon_miss, miss)
+    elif getattr(response, 'processed_icon', None):
+        count_event('resolved')
+        clear_icon_miss(miss)
+    return response
+
+
+def resolve_icon(program_name: str, program_id, deadline: Deadline | None = None) -> HttpResponse:
+    """
+    Responds with the icon of a validated program, see `cached_icon_response` and `resolve_uncached_icon`.
+
+    Concurrent requests for the same program are coalesced: one of them resolves the icon, in this process and
+    across worker processes, and the others wait for its response instead of repeating the searches, page
+    fetches and background removal.
+    """
+    # The hash is checked over the stripped name, so every lookup and record goes by it too
+    program_name = program_name.strip()
+    try:
+        response = cached_icon_response(program_name, program_id)
+        if response:
+            return response
+
+        response = single_flight(
+            f"icon:{program_id}:{program_name}",
+            lambda: resolve_uncached_icon(program_name, program_id, deadline),
+            lambda: cached_icon_response(program_name, program_id),
+            deadline.remaining() if deadline else settings.ICON_REQUEST_DEADLINE,
+            share=copy_response,
+        )
+        if response is None:
+            return JsonResponse({'error': f'Timed out while waiting for the icon of {program_name}.'},
+                                status=status.HTTP_200_OK)
+        return response
+
+    except Exception as e:
+        print(e)
+        return JsonResponse({'error': 'An unexpected error occurred.'},
+                            status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+def response_payload(response: HttpResponse) -> dict:
+    """
+    Returns the JSON body of an icon response as a dict.
+    """
+    try:
+        return json.loads(response.content)
+    except ValueError:
+        return {'error': 'An unexpected error occurred.'}
+
+
+def resolve_batch_item(index: int, program_name: str, program_id) -> dict:
+    """
+    Resolves one program of a batch on a batch worker thread and returns its NDJSON record.
+    """
+    try:
+        response = resolve_icon(program_name, program_id, Deadline(settings.ICON_REQUEST_DEADLINE))
+        return {'index': index, 'program_id': program_id, 'program_name': program_name,
+                **response_payload(response)}
+    finally:
+        connection.close()
+
+
+def stream_batch(records: list, misses: list):
+    """
+    Yields the NDJSON lines of a batch: the already known records first, then each miss as soon as it is resolved.
+    """
+    for record in records:
+        yield json.dumps(record) + "\n"
+
+    if not misses:
+        return
+
+    executor = ThreadPoolExecutor(max_workers=settings.ICON_BATCH_CONCURRENCY, thread_name_prefix='icon-batch')
+    try:
+        futures = {executor.submit(resolve_batch_item, index, program_name, program_id): (index, program_name,
+                                                                                          program_id)
+                   for index, program_name, program_id in misses}
+        for future in as_completed(futures):
+            try:
+                record = future.result()
+            except Exception as e:
+                index, program_name, program_id = futures[future]
+                logger.error(f"Batch resolution failed for {program_name}", exc_info=e)
+                record = {'index': index, 'program_id': program_id, 'program_name': program_name,
+                          'error': 'An unexpected error occurred.'}
+            yield json.dumps(record) + "\n"
+    finally:
+        # Stop resolving if the client went away before the batch finished
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def wants_async(request) -> bool:
+    """
+    Checks whether the client asked for async mode, through `async` in the POST data or `Prefer: respond-async`.
+    """
+    if 'respond-async' in request.headers.get('Prefer', ''):
+        return True
+    return str(request.data.get('async', '')).lower() in ('1', 'true', 'yes')
+
+
+def request_params(request):
+    """
+    Returns the parameters of the request: the query string of a GET, otherwise the POST data.
+    """
+    return request.query_params if request.method in ('GET', 'HEAD') else request.data
+
+
+def wants_raw_icon(request) -> bool:
+    """
+    Checks whether the client asked for the raw image bytes instead of JSON, through `raw` in the request
+    parameters or an Accept header preferring an image type.
+    """
+    if str(request_params(request).get('raw', '')).lower() in ('1', 'true', 'yes'):
+        return True
+    preferred = request.headers.get('Accept', '').split(',')[0]
+    return preferred.split(';')[0].strip().startswith('image/')
+
+
+def requested_variant(request) -> tuple[int, str | None]:
+    """
+    Returns the icon size in pixels (0 for the original size) and image format asked for through the `size`
+    and `image_format` request parameters.
+    """
+    params = request_params(request)
+    size = str(params.get('size') or 0).strip()
+    image_format = str(params.get('image_format') or '').strip().upper()
+    return int(size) if size.isdigit() else -1, image_format or None
+
+
+def validate_variant_input(request) -> JsonResponse | None:
+    """
+    Validates the requested icon size and format, see `requested_variant`. Returns an error response, or None.
+    """
+    size, image_format = requested_variant(request)
+    if size and size not in settings.ICON_VARIANT_SIZES:
+        return JsonResponse(
+            {"error": f"Invalid input variables. 'size' must be one of {settings.ICON_VARIANT_SIZES}."},
+            status=status.HTTP_400_BAD_REQUEST)
+    if image_format and image_format not in VARIANT_FORMATS:
+        return JsonResponse(
+            {"error": f"Invalid input variables. 'image_format' must be one of {VARIANT_FORMATS}."},
+            status=status.HTTP_400_BAD_REQUEST)
+    return None
+
+
+def requested_image(request, icon: ProcessedIcon):
+    """
+    Returns the stored variant of the icon in the requested size and format, or the icon itself if none was
+    asked for, or the variant could not be rendered.
+    """
+    size, image_format = requested_variant(request)
+    if not size and (not image_format or image_format == icon.image_format):
+        return icon
+    return get_icon_variant(icon, max(size, 0), image_format or 'PNG') or icon
+
+
+def negotiate_icon_response(request, response: HttpResponse) -> HttpResponse:
+    """
+    Serves a response carrying a stored icon in the requested size and format, see `requested_variant`,
+    and as a raw image response if the client asked for one, see `wants_raw_icon`.
+    Other responses, e.g. errors, are returned as they are.
+    """
+    icon = getattr(response, 'processed_icon', None)
+    if icon is None:
+        return response
+    image = requested_image(request, icon)
+    if wants_raw_icon(request):
+        return raw_icon_response(request, image)
+    if image is not icon:
+        return icon_response(image)
+    return response
+
+
+def job_response(request, job: IconJob, status_code: int = status.HTTP_200_OK) -> JsonResponse:
+    """
+    Describes an icon job. Done jobs carry their result, served from the icon store when an icon was found.
+    """
+    payload = {
+        'job_id': job.pk,
+        'status': job.status,
+        'status_url': request.build_absolute_uri(reverse('icon_job', kwargs={'job_id': job.pk})),
+    }
+    if job.status == IconJob.DONE:
+        if job.icon_id:
+            payload['image_data'] = icon_data_uri(requested_image(request, job.icon))
+        elif job.result:
+            payload.update(job.result)
+        else:
+            payload['error'] = 'The icon is no longer stored, please request it again.'
+    elif job.status == IconJob.FAILED:
+        payload['error'] = job.error or 'The icon could not be resolved.'
+    return JsonResponse(payload, status=status_code)
 
 
 class IconViewSet(viewsets.ModelViewSet):
     serializer_class = SearchResultsSerializer
     queryset = SearchResults.objects.all()
+    # Accept: image/* asks for raw image responses
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [ImageRenderer]
 
     # todo add hash + salt when sending the base64 image
     # reinstall rembg with GPU support on production
     # crop the image so it focuses on the motive of the image
 
-    @action(detail=False, methods=['post'])
+    @action(detail=False, methods=['get', 'post'])
     def download_icon(self, request):
         """
-        Custom action to fetch or search for an icon based on `program_name` and `program_id` from POST data.
+        Custom action to fetch or search for an icon based on `program_name` and `program_id` from POST data,
+        or from the query string of a GET.
+
+        In async mode (see `wants_async`) an icon that is not in the store is resolved by the icon workers
+        instead; the response is a 202 with the job to poll at `status_url`.
+        Found icons are returned as raw image bytes instead of JSON if asked for, see `wants_raw_icon`, and in
+        the size and format given by `size` and `image_format`, see `requested_variant`.
         """
-        program_name = request.data.get("program_name")
-        program_id = request.data.get("program_id")
+        params = request_params(request)
+        program_name = params.get("program_name")
+        program_id = params.get("program_id")
         provided_hash = request.headers.get("x-Hash")
         api_key = request.headers.get("api-key")
 
         # Validate api key
-        if not api_key:
-            return JsonResponse({"error": "API key is missing."}, status=status.HTTP_401_UNAUTHORIZED)
-
-        if api_key != config('API_KEY') or len(api_key) != 41:
-            return JsonResponse({"error": "Invalid API key."}, status=status.HTTP_401_UNAUTHORIZED)
-
-        # Validate program name and program ID lengths
-        if not program_name or not program_id or not provided_hash:
-            return JsonResponse({"error": "Invalid input variables. Variables must not be null"},
-                                status=status.HTTP_400_BAD_REQUEST)
-        if not 0 < len(program_name.strip()) < 80:
-            return JsonResponse(
-                {"error": "Invalid input variables. 'program_name' length should be between 0 and 80"},
-                status=status.HTTP_400_BAD_REQUEST)
+        error_response = validate_api_key(api_key)
+        if error_response:
+            return error_response
+
+        error_response = validate_program_input(program_name, program_id, provided_hash) \
+            or validate_variant_input(request)
+        if error_response:
+            return error_response
+
+        if wants_async(request):
+            try:
+                response = cached_icon_response(program_name.strip(), program_id)
+                if response:
+                    return negotiate_icon_response(request, response)
+                job = enqueue_job(program_name.strip(), program_id)
+            except Exception as e:
+                logger.error(f"Queueing the icon of {program_name} failed", exc_info=e)
+                return JsonResponse({'error': 'An unexpected error occurred.'},
+                                    status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            return job_response(request, job, status.HTTP_202_ACCEPTED)
+
+        response = resolve_icon(program_name, program_id, Deadline(settings.ICON_REQUEST_DEADLINE))
+        return negotiate_icon_response(request, response)
+
+    @action(detail=False, methods=['get'])
+    def icon_job(self, request, job_id=None):
+        """
+        Custom action reporting the status, and once done the result, of an icon job.
+        The icon of a done job can be fetched as raw image bytes, see `wants_raw_icon`, and in another size
+        and format, see `requested_variant`.
+        """
+        error_response = validate_api_key(request.headers.get("api-key"))
+        if error_response:
+            return error_response
 
-        program_id_str = str(program_id)
-        try:
-            float(program_id_str)
-            is_numeric = True
-        except ValueError:
-            is_numeric = False
+        error_response = validate_variant_input(request)
+        if error_response:
+            return error_response
 
-        if not is_numeric:
-            return JsonResponse({"error": "Invalid input variables. 'program_id' must be numeric."},
-                                status=status.HTTP_400_BAD_REQUEST)
+        job = IconJob.objects.select_related('icon').filter(pk=job_id).first()
+        if job is None:
+            return JsonResponse({"error": "Job not found."}, status=status.HTTP_404_NOT_FOUND)
+        if job.status == IconJob.DONE and job.icon_id and wants_raw_icon(request):
+            return raw_icon_response(request, requested_image(request, job.icon))
+        return job_response(request, job)
 
-        salt = config('SECRET_KEY')
+    @action(detail=False, methods=['post'])
+    def download_icons(self, request):
+        """
+        Custom action to fetch or search the icons of many programs at once.
 
-        hash_string = f"{program_name.strip()}{program_id}{salt.strip()}"
-        expected_hash = hashlib.sha256(hash_string.encode()).hexdigest()
-        print(expected_hash)
+        Expects `programs`, a list of objects with `program_name`, `program_id` and `hash`, in the POST data.
+        Responds with one NDJSON line per program, carrying its `index` in the list, as soon as it is resolved.
+        Icons already in the store are answered with a single query; the others are resolved concurrently.
+        """
+        error_response = validate_api_key(request.headers.get("api-key"))
+        if error_response:
+            return error_response
 
-        if not provided_hash or provided_hash.strip() != expected_hash or len(provided_hash.strip()) != 64:
-            return JsonResponse({"error": "Hash validation failed."}, status=status.HTTP_400_BAD_REQUEST)
-        # Calculate the date one month ago
-        one_month_ago = timezone.now() - timedelta(days=30)
+        programs = request.data.get("programs")
+        if not isinstance(programs, list) or not programs:
+            return JsonResponse({"error": "Invalid input variables. 'programs' must be a non-empty list."},
+                                status=status.HTTP_400_BAD_REQUEST)
+        if len(programs) > settings.ICON_BATCH_MAX_ITEMS:
+            return JsonResponse(
+                {"error": f"Invalid input variables. At most {settings.ICON_BATCH_MAX_ITEMS} programs per batch."},
+                status=status.HTTP_400_BAD_REQUEST)
 
-        try:
-            queryset = self.queryset.filter(
-                program_id__program_id=program_id,
-                program_id__program_name=program_name.strip(),
-                last_updated__gte=one_month_ago,
-            ).first()
-            if queryset and queryset.url:
-                search_term_instance = queryset.search_term
-                # match pattern on the url
-                return extract_icon(queryset.url, search_term_instance, program_name)
+        records = []
+        valid = []
+        for index, entry in enumerate(programs):
+            entry = entry if isinstance(entry, dict) else {}
+            program_name = entry.get("program_name")
+            program_id = entry.get("program_id")
+            error_response = validate_program_input(program_name, program_id, entry.get("hash"))
+            if error_response:
+                records.append({'index': index, 'program_id': program_id, 'program_name': program_name,
+                                **response_payload(error_response)})
             else:
-                return search_icon(program_name, program_id)
+                valid.append((index, program_name, program_id))
+
+        stored_icons = get_program_icons([(program_id, program_name.strip()) for _, program_name, program_id in valid])
+        misses = []
+        for index, program_name, program_id in valid:
+            stored_icon = stored_icons.get((str(program_id), program_name.strip()))
+            if stored_icon:
+                records.append({'index': index, 'program_id': program_id, 'program_name': program_name,
+                                **response_payload(serve_stored_icon(stored_icon, program_name.strip(),
+                                                                     program_id))})
+            else:
+                misses.append((index, program_name, program_id))
 
-        except Exception as e:
-            print(e)
-            return JsonResponse({'error': 'An unexpected error occurred.'},
-                                status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return StreamingHttpResponse(stream_batch(records, misses), content_type='application/x-ndjson')
 
     @action(detail=False, methods=['post'])
     def remove_bg_img(self, request):
@@ -249,8 +910,20 @@ class IconViewSet(viewsets.ModelViewSet):
             validator = URLValidator()
             validator(icon_url)
 
+            error_response = validate_variant_input(request)
+            if error_response:
+                return error_response
+
+            # The rembg model tier, trading quality for latency
+            rembg_model = request.data.get("rembg-model") or None
+            if rembg_model and rembg_model not in settings.REMBG_MODELS:
+                return JsonResponse({'error': f'rembg-model must be one of {settings.REMBG_MODELS}.'},
+                                    status=status.HTTP_400_BAD_REQUEST)
+
             # If validations pass, process the
-            return process_icon_image(icon_url, rm_bg)
+            response = process_icon_image(icon_url, rm_bg, deadline=Deadline(settings.ICON_REQUEST_DEADLINE),
+                                          rembg_model=rembg_model)
+            return negotiate_icon_response(request, response)
 
         except ValidationError:
             return JsonResponse({'error': 'Invalid Icon URL format.'}, status=status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,14 @@
+from django.http import HttpResponse
+
+from api.utils.metrics import render_metrics
+from api.views.icon import validate_api_key
+
+
+def metrics(request):
+    """
+    Exposes the metrics of all worker processes in the Prometheus text format, for the API key in `api-key`.
+    """
+    error_response = validate_api_key(request.headers.get("api-key"))
+    if error_response:
+        return error_response
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')